@@ -184,7 +184,7 @@ if __name__=='__main__':
     print('Cython Order Book')
     price_levels = 'cylist'
     price_level = 'cydeque'
-    ob = CyOrderBook(price_level_type=price_level, price_levels_type=price_levels)
+    ob = CyOrderBook(price_level_type='cylots', price_levels_type=price_levels)
     ra_ops, ra_tpo = test_random_orders(ob, orders)
     ds = orderstream(order_paths='../data/feather/', snapshot_paths='../data/snap_json/')
     m = ExternalMarket(price_level_type=price_level, price_levels_type=price_levels)
@@ -0,0 +1,47 @@
+import asyncio
+import os
+import tempfile
+import time
+
+import ujson
+
+from orderbookmdp.data_all.recorder import Recorder
+from orderbookmdp.data_all.replay_server import ReplayServer
+from orderbookmdp.data_all.replay_server import consume
+
+
+def write_messages(data_dir, repeats=100):
+    """ Writes the test messages repeated, with increasing sequences, as a recorded feed. """
+    with open('tests/testdata/messages.json', 'rb') as messages_json_file:
+        messages = ujson.load(messages_json_file)
+    os.makedirs(data_dir + '/json')
+    sequence = 0
+    with open(data_dir + '/json/01_08_2018_10_00_00_mess.json', 'w') as f:
+        for _ in range(repeats):
+            for msg in messages:
+                sequence += 1
+                f.write(ujson.dumps(dict(msg, sequence=sequence)) + '\n')
+    return sequence
+
+
+def test_replay(data_dir, channels, record):
+    server = ReplayServer(data_dir).start()
+    out_dir = tempfile.TemporaryDirectory()
+    recorder = Recorder(out_dir.name + '/') if record else None
+    t = time.time()
+    messages = asyncio.run(consume(server.url, channels, on_message=recorder.write if record else None))
+    if record:
+        recorder.close()
+    seconds = time.time() - t
+    server.stop()
+    out_dir.cleanup()
+    return messages, seconds
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as data_dir:
+        n = write_messages(data_dir)
+        print('Messages: {}'.format(n))
+        for channels, record in ((['full'], False), (['full'], True)):
+            messages, seconds = test_replay(data_dir, channels, record)
+            print('{} record={}: {} messages, {:.0f} messages/s'.format(channels[0], record, messages, messages / seconds))
@@ -0,0 +1,109 @@
+"""Compares the storage formats of reformatted messages and snapshots on the same dataset.
+
+For every option the raw files are reformatted and the compression ratio against the uncompressed columns, the decode
+speed of the order files and snapshots and the end to end replay speed through a CyExternalMarket are reported.
+
+    python speed_tests/speed_test_storage.py [data_dir] [--repeats 50]
+
+Without data_dir the test messages are repeated with new sequences as the dataset.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import ujson
+
+from orderbookmdp._orderbookmdp import CyExternalMarket
+from orderbookmdp.data_all.orderstream import load_columns
+from orderbookmdp.data_all.orderstream import load_snap
+from orderbookmdp.data_all.orderstream import orderstream_batches
+from orderbookmdp.data_all.reformat_data import reformat
+
+# Name, reformat options
+OPTIONS = (('store, mmap', dict(store=True)),
+           ('feather', dict(message_compression=None)),
+           ('feather lz4', dict(message_compression='lz4')),
+           ('feather zstd 1', dict(message_compression='zstd', message_level=1)),
+           ('feather zstd 9', dict(message_compression='zstd', message_level=9)),
+           ('bin snaps', dict(message_compression='lz4', binary_snaps=True)),
+           ('bin snaps zstd', dict(message_compression='lz4', binary_snaps=True, snap_compression='zstd')),
+           ('json snaps zstd', dict(message_compression='lz4', snap_compression='zstd')))
+
+
+def write_dataset(data_dir, repeats):
+    """ Writes the test messages repeated with new sequences after the beginning snapshot as raw files. """
+    with open('tests/testdata/messages.json', 'rb') as messages_json_file:
+        messages = ujson.load(messages_json_file)
+    with open('tests/testdata/beginning_level_3.json', 'rb') as begin_json_file:
+        snap = ujson.load(begin_json_file)
+    os.makedirs(data_dir + '/json')
+    with open(data_dir + '/json/01_08_2018_10_00_00_snaps.json', 'w') as f:
+        f.write(ujson.dumps(snap) + '\n')
+    sequence = snap['sequence']
+    with open(data_dir + '/json/01_08_2018_10_00_00_mess.json', 'w') as f:
+        for _ in range(repeats):
+            for message in messages:
+                sequence += 1
+                f.write(ujson.dumps(dict(message, sequence=sequence)) + '\n')
+
+
+def test_option(raw_dir, options):
+    with tempfile.TemporaryDirectory() as data_dir:
+        shutil.copytree(raw_dir + '/json', data_dir + '/json')
+        reformat(data_dir, **options)
+        order_paths = data_dir + ('/store/' if options.get('store') else '/feather/')
+        snapshot_paths = data_dir + ('/snap_bin/' if options.get('binary_snaps') else '/snap_json/')
+        order_files = [name for name in os.listdir(order_paths) if name != 'index.npz']
+        snap_files = os.listdir(snapshot_paths)
+
+        t = time.perf_counter()
+        decoded = 0
+        for name in order_files:
+            columns = load_columns(order_paths + name)
+            decoded += sum(column.nbytes for column in columns.values() if column.dtype != object)
+        order_seconds = time.perf_counter() - t
+        order_bytes = sum(os.path.getsize(order_paths + name) for name in order_files)
+
+        t = time.perf_counter()
+        for name in snap_files:
+            load_snap(snapshot_paths + name)
+        snap_seconds = time.perf_counter() - t
+        snap_bytes = sum(os.path.getsize(snapshot_paths + name) for name in snap_files)
+
+        market = CyExternalMarket(tick_size=0.01, lot_size=1e-8)
+        messages = 0
+        t = time.perf_counter()
+        for batch, snap in orderstream_batches(order_paths, snapshot_paths):
+            if snap is not None:
+                if messages > 0:
+                    break
+                market.fill_snap(snap)
+                continue
+            market.send_messages(batch)
+            messages += len(batch['sequence'])
+        replay_seconds = time.perf_counter() - t
+
+    return {'ratio': decoded / order_bytes, 'order MB/s': decoded / 1e6 / order_seconds, 'order MB': order_bytes / 1e6,
+            'snap ms': snap_seconds * 1e3 / max(len(snap_files), 1), 'snap kB': snap_bytes / 1e3 / max(len(snap_files), 1),
+            'replay messages/s': messages / replay_seconds}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares the storage formats of the messages and snapshots.')
+    parser.add_argument('data_dir', nargs='?', help='A data directory with downloaded raw files in json/')
+    parser.add_argument('--repeats', type=int, default=50, help='Times the test messages are repeated without data_dir')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        raw_dir = args.data_dir
+        if raw_dir is None:
+            raw_dir = test_dir
+            write_dataset(raw_dir, args.repeats)
+        results = [(name, test_option(raw_dir, options)) for name, options in OPTIONS]
+
+    columns = list(results[0][1])
+    print('{:<16}'.format('') + ''.join('{:>19}'.format(column) for column in columns))
+    for name, result in results:
+        print('{:<16}'.format(name) + ''.join('{:>19.2f}'.format(result[column]) for column in columns))
@@ -3,7 +3,15 @@ def long(args):
 
 from collections import deque
 import numpy as np
+import pandas as pd
+from orderbookmdp.order_book.utils import check_market_batch
+from orderbookmdp.order_book.utils import stop_row
+from orderbookmdp.order_book.utils import time_to_ns
 from cpython cimport list
+from libc.math cimport llround
+from posix.time cimport CLOCK_MONOTONIC
+from posix.time cimport clock_gettime
+from posix.time cimport timespec
 
 cdef int BUY = 0
 cdef int SELL = 1
@@ -37,6 +45,23 @@ cdef int EXT_ID = -1
 cdef int SO_PRICE = 0
 cdef int SO_SIZE = 1
 cdef int SO_EXT_ID = 2
+# Message Types
+cdef int M_RECEIVED = 0
+cdef int M_OPEN = 1
+cdef int M_DONE = 2
+cdef int M_MATCH = 3
+cdef int M_CHANGE = 4
+# Order Types
+cdef int OT_LIMIT = 0
+cdef int OT_MARKET = 1
+# Done Reasons
+cdef int R_FILLED = 0
+cdef int R_CANCELED = 1
+# Codes of the exchange strings
+cdef dict MESSAGE_TYPE_CODES = {'received': M_RECEIVED, 'open': M_OPEN, 'done': M_DONE, 'match': M_MATCH,
+                                'change': M_CHANGE}
+cdef dict ORDER_TYPE_CODES = {'limit': OT_LIMIT, 'market': OT_MARKET}
+cdef dict REASON_CODES = {'filled': R_FILLED, 'canceled': R_CANCELED}
 
 
 cdef class CyQeuePriceLevel:
@@ -295,6 +320,59 @@ cdef class CyQeuePriceLevel:
         return len(self.orders) == 0
 
 
+cdef class CyLotPriceLevel:
+    """ A price level where the order sizes are integer lots, multiples of the lot size of the product.
+
+    The total size is kept as an integer so that a level or an order is empty exactly when its size is 0. The size
+    property converts to a float size, the lots attribute is the integer size.
+    """
+
+    cdef public long long lots
+    cdef public double lot_size
+    cdef public object orders
+
+    def __init__(self, double lot_size=1e-8):
+        self.lots = 0
+        self.lot_size = lot_size
+        self.orders = deque()
+
+    @property
+    def size(self):
+        return self.lots * self.lot_size
+
+    cpdef append(self, list order):
+        self.orders.append(order)
+        self.lots += order[O_SIZE]
+
+    cpdef delete(self, list order):
+        self.orders.remove(order)
+        self.lots -= order[O_SIZE]
+
+    cpdef update(self, list order, long long diff):
+        self.lots += diff
+        order[O_SIZE] += diff
+
+    cpdef list get_first(self):
+        return self.orders[0]
+
+    cpdef delete_first(self, list order):
+        self.orders.popleft()
+        self.lots -= order[O_SIZE]
+
+    cpdef list get_last(self):
+        return self.orders[-1]
+
+    cpdef delete_last(self, list order):
+        self.orders.pop()
+        self.lots -= order[O_SIZE]
+
+    cpdef is_not_empty(self):
+        return len(self.orders) > 0
+
+    cpdef is_empty(self):
+        return len(self.orders) == 0
+
+
 cdef class CyListPriceLevels:
 
     cdef double tick_size
@@ -305,18 +383,31 @@ cdef class CyListPriceLevels:
     cdef int bid_index
     cdef int ask_index
     cdef list price_level_list
+    cdef bint lots
+    cdef public double lot_size
+    cdef public long long dropped
 
-    def __init__(self, price_level_type, tick_size=0.01, max_price=13000, min_price=5000, **kwargs):
+    def __init__(self, price_level_type, tick_size=0.01, max_price=13000, min_price=5000, lot_size=1e-8, **kwargs):
 
         self.tick_size = tick_size
         self.tick_dec = int(np.log10(1/self.tick_size))
-        self.max_price = int(max_price*10**self.tick_dec)
-        self.min_price = int(min_price*10**self.tick_dec)
+        self.max_price = int(round(max_price*10**self.tick_dec))
+        self.min_price = int(round(min_price*10**self.tick_dec))
         self.max_index = self.max_price - self.min_price
         self.bid_index = 0
         self.ask_index = self.max_index
+        # 'cylots' levels keep integer lot sizes, used by CyOrderBook. Other types keep float sizes.
+        self.lots = price_level_type == 'cylots'
+        self.lot_size = lot_size
+        # Number of orders outside [min_price, max_price) that were not added
+        self.dropped = 0
 
-        self.price_level_list = [CyQeuePriceLevel() for _ in range(self.max_index + 1)]
+        self.price_level_list = [self.new_level() for _ in range(self.max_index + 1)]
+
+    cdef object new_level(self):
+        if self.lots:
+            return CyLotPriceLevel(self.lot_size)
+        return CyQeuePriceLevel()
 
     cdef int get_price_index(self, int price):
         return price - self.min_price
@@ -324,15 +415,19 @@ cdef class CyListPriceLevels:
     cdef int get_price(self, int index):
         return index + self.min_price
 
-    cpdef CyQeuePriceLevel get_level(self, int side, int price):
+    cpdef object get_level(self, int side, int price):
         return self.price_level_list[self.get_price_index(price)]
 
+    cdef inline CyLotPriceLevel get_lot_level(self, int price):
+        # The typed level of 'cylots' price levels, for the matching loops of CyOrderBook
+        return <CyLotPriceLevel> self.price_level_list[self.get_price_index(price)]
+
     cpdef is_empty(self, int index):
         return len(self.price_level_list[index].orders) == 0
 
     cpdef remove_level(self, int side, int price):
         cdef int price_index = self.get_price_index(price)
-        self.price_level_list[price_index] = CyQeuePriceLevel()
+        self.price_level_list[price_index] = self.new_level()
         if price_index == self.ask_index:
             while self.is_empty(self.ask_index) and self.ask_index < self.max_index:
                 self.ask_index += 1
@@ -340,7 +435,7 @@ cdef class CyListPriceLevels:
             while self.is_empty(self.bid_index) and self.bid_index > 0:
                 self.bid_index -= 1
 
-    cpdef add_order(self, int side, long int price, double size, int trader_id, long int order_id):
+    cpdef add_order(self, int side, long int price, object size, int trader_id, long int order_id):
         if self.min_price <= price < self.max_price:
             price_index = self.get_price_index(price)
             price_level = self.price_level_list[price_index]
@@ -352,6 +447,7 @@ cdef class CyListPriceLevels:
                 self.ask_index = price_index
             return order
         else:
+            self.dropped += 1
             return -1
 
 
@@ -404,33 +500,60 @@ cdef class CyListPriceLevels:
 
 
 cdef class CyOrderBook:
+    """ An order book where all sizes are kept as integer lots, multiples of lot_size.
+
+    The methods taking float sizes convert them to lots and the trades and orders in book that are returned have
+    float sizes. The *_lots methods take integer lots directly, for example sizes from reformatted data. With
+    keep_trades False orders are matched without returning the trades. The price levels are always 'cylots' levels of
+    a 'cylist'. The 'cydeque' price level of earlier versions is taken as 'cylots', other types raise a ValueError.
+    """
 
     cdef long int order_id
-    cdef dict orders
+    cdef public dict orders
     cdef public CyListPriceLevels price_levels
-
-    def __init__(self, price_level_type='cydeque', price_levels_type='cylist', **kwargs):
+    cdef public double lot_size
+    cdef public double lot_multiplier
+    cdef public bint keep_trades
+
+    def __init__(self, price_level_type='cylots', price_levels_type='cylist', lot_size=1e-8, **kwargs):
+        if price_level_type == 'cydeque':
+            price_level_type = 'cylots'
+        if price_level_type != 'cylots':
+            raise ValueError("price_level_type is 'cylots' or 'cydeque', not {!r}".format(price_level_type))
+        if price_levels_type != 'cylist':
+            raise ValueError("price_levels_type is 'cylist', not {!r}".format(price_levels_type))
 
         self.orders = {}
         self.order_id = 0
-        self.price_levels = CyListPriceLevels(price_level_type, **kwargs)
+        self.keep_trades = True
+        self.lot_size = lot_size
+        self.lot_multiplier = 10**int(round(np.log10(1 / lot_size)))
+        self.price_levels = CyListPriceLevels(price_level_type, lot_size=lot_size, **kwargs)
+
+    cpdef limit(self, long int price, int side, double size, int trader_id, object time):
+        return self.limit_lots(price, side, to_lots(size, self.lot_multiplier), trader_id, time)
 
-    cpdef limit(self, long int price, int side, double size, int trader_id, str time):
+    cpdef limit_lots(self, long int price, int side, long long size, int trader_id, object time):
 
         cdef list trades = []
+        cdef long long level_entry_size
+        cdef long int ask, bid
+        cdef CyLotPriceLevel price_level
 
         if side == BUY:
             if self.price_levels.exist_sell_orders():
                 ask = self.price_levels.get_ask()
                 while price >= ask:
-                    price_level = self.price_levels.get_level(SELL, ask)
+                    price_level = self.price_levels.get_lot_level(ask)
                     while price_level.is_not_empty():
                         level_entry = price_level.get_first()
                         level_entry_size = level_entry[O_SIZE]
                         if size < level_entry_size:
                             price_level.update(level_entry, -size)
                             # Trade : (trader_id, counter_part_id, price, size, order_id)
-                            trades.append((trader_id, level_entry[O_TRADER_ID], ask, size, level_entry[O_ID], side, time))
+                            if self.keep_trades:
+                                trades.append((trader_id, level_entry[O_TRADER_ID], ask, size * self.lot_size,
+                                               level_entry[O_ID], side, time))
                             return trades, None
                         else:
                             price_level.delete_first(level_entry)
@@ -439,7 +562,9 @@ cdef class CyOrderBook:
                                 self.price_levels.remove_level(SELL, ask)
                             size -= level_entry_size
                             # Trade : (trader_id, counter_part_id, price, size, order_id)
-                            trades.append((trader_id, level_entry[O_TRADER_ID], ask, level_entry_size, level_entry[O_ID], side, time))
+                            if self.keep_trades:
+                                trades.append((trader_id, level_entry[O_TRADER_ID], ask, level_entry_size * self.lot_size,
+                                               level_entry[O_ID], side, time))
                             if size == 0:
                                 return trades, None
 
@@ -456,7 +581,7 @@ cdef class CyOrderBook:
                 self.orders[self.order_id] = order
 
                 # Order in Book : (order_id, size, side, price)
-                order_in_book = (self.order_id, size, side, price)
+                order_in_book = (self.order_id, size * self.lot_size, side, price)
 
                 return trades, order_in_book
             else:
@@ -466,14 +591,16 @@ cdef class CyOrderBook:
             if self.price_levels.exist_buy_orders():
                 bid = self.price_levels.get_bid()
                 while price <= bid:
-                    price_level = self.price_levels.get_level(BUY, bid)
+                    price_level = self.price_levels.get_lot_level(bid)
                     while price_level.is_not_empty():
                         level_entry = price_level.get_first()
                         level_entry_size = level_entry[O_SIZE]
                         if size < level_entry_size:
                             price_level.update(level_entry, -size)
                             # Trade : (trader_id, counter_part_id, price, size, order_id)
-                            trades.append((trader_id, level_entry[O_TRADER_ID], bid, size, level_entry[O_ID], side, time))
+                            if self.keep_trades:
+                                trades.append((trader_id, level_entry[O_TRADER_ID], bid, size * self.lot_size,
+                                               level_entry[O_ID], side, time))
                             return trades, None
                         else:
                             price_level.delete_first(level_entry)
@@ -482,7 +609,9 @@ cdef class CyOrderBook:
                                 self.price_levels.remove_level(BUY, bid)
                             size -= level_entry_size
                             # Trade : (trader_id, counter_part_id, price, size, order_id)
-                            trades.append((trader_id, level_entry[O_TRADER_ID], bid, level_entry_size, level_entry[O_ID], side, time))
+                            if self.keep_trades:
+                                trades.append((trader_id, level_entry[O_TRADER_ID], bid, level_entry_size * self.lot_size,
+                                               level_entry[O_ID], side, time))
                             if size == 0:
                                 return trades, None
 
@@ -499,47 +628,63 @@ cdef class CyOrderBook:
             if order != -1:
                 self.orders[self.order_id] = order
                 # Order in Book : (order_id, size, side, price)
-                order_in_book = (self.order_id, size, side, price)
+                order_in_book = (self.order_id, size * self.lot_size, side, price)
 
                 return trades, order_in_book
             else:
                 return trades, None
 
     def cancel(self, int order_id):
+        cdef CyLotPriceLevel level
         if order_id in self.orders:
             order = self.orders.pop(order_id)
-            level = self.price_levels.get_level(order[O_SIDE], order[O_PRICE])
+            level = self.price_levels.get_lot_level(order[O_PRICE])
             level.delete(order)
             if not level.is_not_empty():
                 self.price_levels.remove_level(order[O_SIDE], order[O_PRICE])
 
     def update(self, int order_id, double size):
+        self.update_lots(order_id, to_lots(size, self.lot_multiplier))
+
+    cpdef update_lots(self, int order_id, long long size):
+        cdef CyLotPriceLevel price_level
         if order_id in self.orders:
             order = self.orders[order_id]
-            price_level = self.price_levels.get_level(order[O_SIDE], order[O_PRICE])
+            price_level = self.price_levels.get_lot_level(order[O_PRICE])
             price_level.update(order, size - order[O_SIZE])
 
-    def market_order(self, double size, int side, int trader_id, str time):
+    def market_order(self, double size, int side, int trader_id, object time):
+        return self.market_order_lots(to_lots(size, self.lot_multiplier), side, trader_id, time)
+
+    cpdef market_order_lots(self, long long size, int side, int trader_id, object time):
+
+        cdef list trades = []
+        cdef long long level_entry_size
+        cdef long int ask, bid
+        cdef CyLotPriceLevel price_level
 
-        trades = []
         if side == BUY:
             while (size > 0) and self.price_levels.exist_sell_orders():
                 ask = self.price_levels.get_ask()
-                price_level = self.price_levels.get_level(SELL, ask)
+                price_level = self.price_levels.get_lot_level(ask)
                 while price_level.is_not_empty():
                     level_entry = price_level.get_first()
                     level_entry_size = level_entry[O_SIZE]
                     if size < level_entry_size:
                         price_level.update(level_entry, -size)
                         # Trade : (trader_id, counter_part_id, price, size, order_id)
-                        trades.append((trader_id, level_entry[O_TRADER_ID], ask, size, level_entry[O_ID], side, time))
+                        if self.keep_trades:
+                            trades.append((trader_id, level_entry[O_TRADER_ID], ask, size * self.lot_size,
+                                           level_entry[O_ID], side, time))
                         return trades
                     else:
                         price_level.delete_first(level_entry)
                         self.orders.pop(level_entry[O_ID])
                         size -= level_entry_size
                         # Trade : (trader_id, counter_part_id, price, size, order_id)
-                        trades.append((trader_id, level_entry[O_TRADER_ID], ask, level_entry_size, level_entry[O_ID], side, time))
+                        if self.keep_trades:
+                            trades.append((trader_id, level_entry[O_TRADER_ID], ask, level_entry_size * self.lot_size,
+                                           level_entry[O_ID], side, time))
                         if size == 0:
                             return trades
 
@@ -548,21 +693,25 @@ cdef class CyOrderBook:
         else:
             while (size > 0) and self.price_levels.exist_buy_orders():
                 bid = self.price_levels.get_bid()
-                price_level = self.price_levels.get_level(BUY, bid)
+                price_level = self.price_levels.get_lot_level(bid)
                 while price_level.is_not_empty():
                     level_entry = price_level.get_first()
                     level_entry_size = level_entry[O_SIZE]
                     if size < level_entry_size:
                         price_level.update(level_entry, -size)
                         # Trade : (trader_id, counter_part_id, price, size, order_id)
-                        trades.append((trader_id, level_entry[O_TRADER_ID], bid, size, level_entry[O_ID], side, time))
+                        if self.keep_trades:
+                            trades.append((trader_id, level_entry[O_TRADER_ID], bid, size * self.lot_size,
+                                           level_entry[O_ID], side, time))
                         return trades
                     else:
                         price_level.delete_first(level_entry)
                         self.orders.pop(level_entry[O_ID])
                         size -= level_entry_size
                         # Trade : (trader_id, counter_part_id, price, size, order_id)
-                        trades.append((trader_id, level_entry[O_TRADER_ID], bid, level_entry_size, level_entry[O_ID], side, time))
+                        if self.keep_trades:
+                            trades.append((trader_id, level_entry[O_TRADER_ID], bid, level_entry_size * self.lot_size,
+                                           level_entry[O_ID], side, time))
                         if size == 0:
                             return trades
 
@@ -570,56 +719,72 @@ cdef class CyOrderBook:
 
         return trades
 
-    cpdef market_order_funds(self, double funds, int side, int trader_id, str time):
-        trades = []
+    cpdef market_order_funds(self, double funds, int side, int trader_id, object time):
+        cdef list trades = []
+        cdef long long size, level_entry_size
+        cdef long int ask, bid
+        cdef CyLotPriceLevel price_level
+
         if side == BUY:
             while (funds > 0) and self.price_levels.exist_sell_orders():
                 ask = self.price_levels.get_ask()
-                size = funds / ask
-                price_level = self.price_levels.get_level(SELL, ask)
+                size = <long long> (funds / ask * self.lot_multiplier)
+                if size == 0:
+                    return trades
+                price_level = self.price_levels.get_lot_level(ask)
                 while price_level.is_not_empty():
                     level_entry = price_level.get_first()
                     level_entry_size = level_entry[O_SIZE]
                     if size < level_entry_size:
                         price_level.update(level_entry, -size)
                         # Trade : (trader_id, counter_part_id, price, size, order_id)
-                        trades.append((trader_id, level_entry[O_TRADER_ID], ask, size, level_entry[O_ID], side, time))
+                        if self.keep_trades:
+                            trades.append((trader_id, level_entry[O_TRADER_ID], ask, size * self.lot_size,
+                                           level_entry[O_ID], side, time))
                         return trades
                     else:
                         price_level.delete_first(level_entry)
                         self.orders.pop(level_entry[O_ID])
                         size -= level_entry_size
                         # Trade : (trader_id, counter_part_id, price, size, order_id)
-                        trades.append((trader_id, level_entry[O_TRADER_ID], ask, level_entry_size, level_entry[O_ID], side, time))
+                        if self.keep_trades:
+                            trades.append((trader_id, level_entry[O_TRADER_ID], ask, level_entry_size * self.lot_size,
+                                           level_entry[O_ID], side, time))
                         if size == 0:
                             return trades
                         else:
-                            funds -= level_entry_size * ask
+                            funds -= level_entry_size * self.lot_size * ask
 
                 self.price_levels.remove_level(SELL, ask)
         else:
             while (funds > 0) and self.price_levels.exist_buy_orders():
                 bid = self.price_levels.get_bid()
-                size = funds / bid
-                price_level = self.price_levels.get_level(BUY, bid)
+                size = <long long> (funds / bid * self.lot_multiplier)
+                if size == 0:
+                    return trades
+                price_level = self.price_levels.get_lot_level(bid)
                 while price_level.is_not_empty():
                     level_entry = price_level.get_first()
                     level_entry_size = level_entry[O_SIZE]
                     if size < level_entry_size:
                         price_level.update(level_entry, -size)
                         # Trade : (trader_id, counter_part_id, price, size, order_id)
-                        trades.append((trader_id, level_entry[O_TRADER_ID], bid, size, level_entry[O_ID], side, time))
+                        if self.keep_trades:
+                            trades.append((trader_id, level_entry[O_TRADER_ID], bid, size * self.lot_size,
+                                           level_entry[O_ID], side, time))
                         return trades
                     else:
                         price_level.delete_first(level_entry)
                         self.orders.pop(level_entry[O_ID])
                         size -= level_entry_size
                         # Trade : (trader_id, counter_part_id, price, size, order_id)
-                        trades.append((trader_id, level_entry[O_TRADER_ID], bid, level_entry_size, level_entry[O_ID], side, time))
+                        if self.keep_trades:
+                            trades.append((trader_id, level_entry[O_TRADER_ID], bid, level_entry_size * self.lot_size,
+                                           level_entry[O_ID], side, time))
                         if size == 0:
                             return trades
                         else:
-                            funds -= level_entry_size * bid
+                            funds -= level_entry_size * self.lot_size * bid
 
                 self.price_levels.remove_level(BUY, bid)
 
@@ -634,6 +799,223 @@ cpdef long int to_int(double price, int multiplier):
 cpdef double to_float(int price, int tick_dec, int multiplier):
     return round(price/float(multiplier), tick_dec)
 
+
+cpdef long long to_lots(double size, double lot_multiplier):
+    return llround(size*lot_multiplier)
+
+
+cpdef object uuid_to_int(str order_id):
+    return int(order_id.replace('-', ''), 16)
+
+
+cdef inline long long now_ns():
+    cdef timespec ts
+    clock_gettime(CLOCK_MONOTONIC, &ts)
+    return ts.tv_sec * 1000000000LL + ts.tv_nsec
+
+
+cdef inline int to_code(object value, dict codes) except *:
+    if type(value) is str:
+        return codes[value]
+    if value is None:
+        raise ValueError('A field of the message is None, a market needs the fields of MARKET_COLUMNS')
+    return value
+
+
+cdef inline object external_order_id(object order_id):
+    if type(order_id) is str:
+        return uuid_to_int(order_id)
+    return order_id
+
+# Kinds of bars, a bar of a kind is finished when its measure reaches the threshold
+cdef int BAR_TIME = 0
+cdef int BAR_TICK = 1
+cdef int BAR_VOLUME = 2
+cdef int BAR_DOLLAR = 3
+BAR_KINDS = {'time': BAR_TIME, 'tick': BAR_TICK, 'volume': BAR_VOLUME, 'dollar': BAR_DOLLAR}
+BAR_COLUMNS = ('start', 'end', 'open', 'high', 'low', 'close', 'volume', 'dollar', 'vwap', 'buy_volume', 'ticks')
+
+
+cdef class BarBuilder:
+    """ Aggregates the trades of a market to OHLCV bars while they are created.
+
+    Attached to a market as its bars, see :py:class:`CyExternalMarket` and
+    :py:class:`orderbookmdp.order_book.market.ExternalMarket`, the trades of every message sent to the market are added
+    to the current bar, of which only the running aggregates are kept. A finished bar is written to the next row of
+    preallocated columns, which double in size when they are full::
+
+        market.bars = BarBuilder('volume', 10.0)
+        for batch in batches:
+            market.send_messages(batch)
+            bars = market.bars.pop()
+
+    A 'tick', 'volume' or 'dollar' bar is finished by the trade that brings its number of trades, size or size times
+    price to the threshold. A 'time' bar holds the trades of an interval of threshold nanoseconds aligned to the epoch
+    and is finished by the first trade after it, intervals without trades have no bar. The trades of a fast forward
+    are not added.
+
+    Parameters
+    ----------
+    kind: str
+        'time', 'tick', 'volume' or 'dollar'
+    threshold: float or str
+        The measure of a bar, a pandas timedelta such as '1min' for time bars
+    tick_size: float
+        The tick size of the market, the trade prices are integer ticks
+    capacity: int
+        The number of bars the columns are allocated for
+    """
+
+    cdef readonly str kind
+    cdef readonly double threshold
+    cdef readonly Py_ssize_t n
+    cdef int kind_code
+    cdef long long interval
+    cdef double multiplier
+    cdef dict columns
+    cdef long long[:] starts, ends, ticks
+    cdef double[:] opens, highs, lows, closes, volumes, dollars, vwaps, buy_volumes
+    # The running aggregates of the current bar
+    cdef long long bar_start, bar_end, bar_ticks, bar_stop
+    cdef double bar_open, bar_high, bar_low, bar_close, bar_volume, bar_dollar, bar_buy_volume
+
+    def __init__(self, str kind='time', threshold='1min', double tick_size=0.01, Py_ssize_t capacity=1024):
+        if kind not in BAR_KINDS:
+            raise ValueError('Unknown kind of bar {}'.format(kind))
+        self.kind = kind
+        self.kind_code = BAR_KINDS[kind]
+        if self.kind_code == BAR_TIME:
+            self.interval = pd.to_timedelta(threshold).value
+            self.threshold = self.interval
+        else:
+            self.threshold = threshold
+        if self.threshold <= 0:
+            raise ValueError('The threshold of a bar must be positive')
+        self.multiplier = 10**int(np.log10(1 / tick_size))
+        self.n = 0
+        self.bar_ticks = 0
+        self.allocate(max(capacity, 1))
+
+    cdef allocate(self, Py_ssize_t capacity):
+        columns = {}
+        for name in BAR_COLUMNS:
+            column = np.zeros(capacity, dtype=np.int64 if name in ('start', 'end', 'ticks') else np.float64)
+            if self.columns is not None:
+                column[:self.n] = self.columns[name][:self.n]
+            columns[name] = column
+        self.columns = columns
+        self.starts, self.ends, self.ticks = columns['start'], columns['end'], columns['ticks']
+        self.opens, self.highs, self.lows, self.closes = columns['open'], columns['high'], columns['low'], columns['close']
+        self.volumes, self.dollars, self.vwaps = columns['volume'], columns['dollar'], columns['vwap']
+        self.buy_volumes = columns['buy_volume']
+
+    cpdef add_trades(self, list trades):
+        """ Adds trades, (trader_id, counter_part_id, price, size, order_id, side, time), in the order they were made. """
+        cdef tuple trade
+        cdef object time
+        for trade in trades:
+            time = trade[T_TIME]
+            if type(time) is str:
+                time = time_to_ns(time)
+            self.add(trade[T_PRICE] / self.multiplier, trade[T_SIZE], time, trade[T_SIDE])
+
+    cdef add(self, double price, double size, long long time, int side):
+        if self.bar_ticks > 0 and self.kind_code == BAR_TIME and time >= self.bar_stop:
+            self.finish()
+        if self.bar_ticks == 0:
+            self.bar_start = time
+            self.bar_open = self.bar_high = self.bar_low = price
+            self.bar_volume = self.bar_dollar = self.bar_buy_volume = 0.0
+            if self.kind_code == BAR_TIME:
+                self.bar_stop = (time // self.interval + 1) * self.interval
+        elif price > self.bar_high:
+            self.bar_high = price
+        elif price < self.bar_low:
+            self.bar_low = price
+        self.bar_end = time
+        self.bar_close = price
+        self.bar_volume += size
+        self.bar_dollar += size * price
+        self.bar_ticks += 1
+        if side == BUY:
+            self.bar_buy_volume += size
+
+        if ((self.kind_code == BAR_TICK and self.bar_ticks >= self.threshold) or
+                (self.kind_code == BAR_VOLUME and self.bar_volume >= self.threshold) or
+                (self.kind_code == BAR_DOLLAR and self.bar_dollar >= self.threshold)):
+            self.finish()
+
+    cdef finish(self):
+        cdef Py_ssize_t k = self.n
+        if k == self.starts.shape[0]:
+            self.allocate(2 * k)
+        self.starts[k], self.ends[k], self.ticks[k] = self.bar_start, self.bar_end, self.bar_ticks
+        self.opens[k], self.highs[k], self.lows[k], self.closes[k] = (self.bar_open, self.bar_high, self.bar_low,
+                                                                      self.bar_close)
+        self.volumes[k], self.dollars[k], self.buy_volumes[k] = self.bar_volume, self.bar_dollar, self.bar_buy_volume
+        self.vwaps[k] = self.bar_dollar / self.bar_volume if self.bar_volume > 0 else self.bar_close
+        self.n += 1
+        self.bar_ticks = 0
+
+    def close(self):
+        """ Finishes the current bar if it has trades, for example at the end of a replay. """
+        if self.bar_ticks > 0:
+            self.finish()
+
+    def bars(self):
+        """ Returns the finished bars, column name to a view of the numpy array. The start and end are the epoch
+        nanoseconds of the first and last trade of a bar, the ticks its number of trades and the buy_volume the size
+        bought by the takers.
+        """
+        return {name: column[:self.n] for name, column in self.columns.items()}
+
+    def pop(self):
+        """ Returns a copy of the finished bars and removes them, the columns are reused for the next bars. """
+        bars = {name: column[:self.n].copy() for name, column in self.columns.items()}
+        self.n = 0
+        return bars
+
+    def __len__(self):
+        return self.n
+
+
+cdef class Message:
+    """ A compact message with typed fields, see :py:mod:`orderbookmdp.order_book.order_types`.
+
+    The type, order_type and reason are integer codes. Fields that are not used by a message are left at their
+    defaults, for example the size of a cancellation message.
+    """
+
+    cdef public int type
+    cdef public int order_type
+    cdef public int reason
+    cdef public int side
+    cdef public double size
+    cdef public object price
+    cdef public double funds
+    cdef public int trader_id
+    cdef public object order_id
+    cdef public object time
+
+    def __init__(self, int type, int order_type=-1, int reason=-1, int side=-1, double size=-1, object price=0,
+                 double funds=-1, int trader_id=EXT_ID, object order_id=None, object time=None):
+        self.type = type
+        self.order_type = order_type
+        self.reason = reason
+        self.side = side
+        self.size = size
+        self.price = price
+        self.funds = funds
+        self.trader_id = trader_id
+        self.order_id = order_id
+        self.time = time
+
+    def __repr__(self):
+        return ('Message(type={}, order_type={}, reason={}, side={}, size={}, price={}, funds={}, trader_id={}, '
+                'order_id={}, time={})').format(self.type, self.order_type, self.reason, self.side, self.size,
+                                                self.price, self.funds, self.trader_id, self.order_id, self.time)
+
+
 cdef class CyExternalMarket:
 
     cdef public CyOrderBook ob
@@ -642,47 +1024,66 @@ cdef class CyExternalMarket:
     cdef dict external_market_order_ids
     cdef public int multiplier
     cdef public object time
+    cdef public BarBuilder bars
 
-    def __init__(self, tick_size=0.01, ob_type='cy_order_book', price_level_type='cydeque',
-                 price_levels_type='cylist', **kwargs):
+    def __init__(self, tick_size=0.01, ob_type='cy_order_book', price_level_type='cylots',
+                 price_levels_type='cylist', lot_size=1e-8, **kwargs):
         self.tick_size = tick_size
         self.tick_dec = int(np.log10(1 / tick_size))
         self.multiplier = 10**self.tick_dec
-        self.ob = CyOrderBook(price_level_type='cydeque', price_levels_type='cylist', **kwargs)
+        self.ob = CyOrderBook(price_level_type, price_levels_type, lot_size=lot_size, tick_size=tick_size, **kwargs)
         self.external_market_order_ids = {}
         self.time = '2000-1-1 00:00'
+        self.bars = None
+
+    cdef long long external_lots(self, object size, bint lots) except? -1:
+        # Reformatted data has integer lot sizes, raw exchange messages have float sizes
+        if lots:
+            return size
+        return to_lots(size, self.ob.lot_multiplier)
+
+    def send_message(self, mess, external=False, lots=False):
+        """ Sends a message to the market, see :py:meth:`orderbookmdp.order_book.market.ExternalMarket.send_message`.
+        With lots the size of an external message is in integer lots, as in reformatted data, else it is a float size
+        as in raw exchange messages.
+        """
+        cdef int mess_type, order_type
+        if type(mess) is Message:
+            return self.send_typed_message(mess, external, lots)
 
-
-    def send_message(self, mess, external=False):
         trades, order_in_book = [], None
-        mess_type = mess.type
+        mess_type = to_code(mess.type, MESSAGE_TYPE_CODES)
 
         if external:
             self.time = mess.time
 
-        if mess_type == 'received':
-            order_type = mess.order_type
-            if order_type == 'limit':
+        if mess_type == M_RECEIVED:
+            order_type = to_code(mess.order_type, ORDER_TYPE_CODES)
+            if order_type == OT_LIMIT:
 
                 if external:
-                    trades, order_in_book = self.ob.limit(to_int(mess.price, self.multiplier),
-                                                          mess.side, mess.size, mess.trader_id, self.time)
+                    trades, order_in_book = self.ob.limit_lots(to_int(mess.price, self.multiplier), mess.side,
+                                                               self.external_lots(mess.size, lots), mess.trader_id,
+                                                               self.time)
                 else:
                     trades, order_in_book = self.ob.limit(mess.price,
                                                           mess.side, mess.size, mess.trader_id, self.time)
 
                 if external and order_in_book is not None:
-                    self.external_market_order_ids[mess.order_id] = order_in_book[OIB_ID]
-            elif order_type == 'market':
-                if mess.size != -1:
-                    trades = self.ob.market_order(mess.size, mess.side, mess.trader_id, self.time)
-                else:
+                    self.external_market_order_ids[external_order_id(mess.order_id)] = order_in_book[OIB_ID]
+            elif order_type == OT_MARKET:
+                if mess.size == -1:
                     trades = self.ob.market_order_funds(mess.funds*self.multiplier, mess.side, mess.trader_id, self.time)
-        elif mess_type == 'done':
-            if mess.reason == 'canceled':
+                elif external:
+                    trades = self.ob.market_order_lots(self.external_lots(mess.size, lots), mess.side, mess.trader_id,
+                                                       self.time)
+                else:
+                    trades = self.ob.market_order(mess.size, mess.side, mess.trader_id, self.time)
+        elif mess_type == M_DONE:
+            if to_code(mess.reason, REASON_CODES) == R_CANCELED:
                 if external:
                     try:
-                        order_id = self.external_market_order_ids.pop(mess.order_id)
+                        order_id = self.external_market_order_ids.pop(external_order_id(mess.order_id))
                         self.ob.cancel(order_id)
                     except (ValueError, KeyError) as e:
                         # TODO Fix
@@ -697,24 +1098,167 @@ cdef class CyExternalMarket:
                         #print(mess)
                         pass
 
-        elif mess_type == 'change':
+        elif mess_type == M_CHANGE:
             if external:
                 try:
-                    order_id = self.external_market_order_ids[mess.order_id]
-                    self.ob.update(order_id, mess.size)
+                    order_id = self.external_market_order_ids[external_order_id(mess.order_id)]
+                    self.ob.update_lots(order_id, self.external_lots(mess.size, lots))
                 except KeyError:
                     pass  # TODO FIX
             else:
                 self.ob.update(mess.order_id, mess.size)
 
+        if trades and self.bars is not None:
+            self.bars.add_trades(trades)
         return trades, order_in_book
 
+    cpdef tuple send_typed_message(self, Message mess, bint external=False, bint lots=False):
+        trades, order_in_book = [], None
+
+        if external:
+            self.time = mess.time
+
+        if mess.type == M_RECEIVED:
+            if mess.order_type == OT_LIMIT:
+                if external:
+                    trades, order_in_book = self.ob.limit_lots(to_int(mess.price, self.multiplier), mess.side,
+                                                               self.external_lots(mess.size, lots), mess.trader_id,
+                                                               self.time)
+                    if order_in_book is not None:
+                        self.external_market_order_ids[external_order_id(mess.order_id)] = order_in_book[OIB_ID]
+                else:
+                    trades, order_in_book = self.ob.limit(mess.price,
+                                                          mess.side, mess.size, mess.trader_id, self.time)
+            elif mess.order_type == OT_MARKET:
+                if mess.size != -1 and external:
+                    trades = self.ob.market_order_lots(self.external_lots(mess.size, lots), mess.side, mess.trader_id,
+                                                       self.time)
+                elif mess.size != -1:
+                    trades = self.ob.market_order(mess.size, mess.side, mess.trader_id, self.time)
+                else:
+                    trades = self.ob.market_order_funds(mess.funds*self.multiplier, mess.side, mess.trader_id, self.time)
+        elif mess.type == M_DONE:
+            if mess.reason == R_CANCELED:
+                try:
+                    if external:
+                        self.ob.cancel(self.external_market_order_ids.pop(external_order_id(mess.order_id)))
+                    else:
+                        self.ob.cancel(mess.order_id)
+                except (ValueError, KeyError):
+                    pass  # TODO Fix
+        elif mess.type == M_CHANGE:
+            if external:
+                order_id = self.external_market_order_ids.get(external_order_id(mess.order_id))
+                if order_id is not None:
+                    self.ob.update_lots(order_id, self.external_lots(mess.size, lots))
+            else:
+                self.ob.update(mess.order_id, mess.size)
+
+        if trades and self.bars is not None:
+            self.bars.add_trades(trades)
+        return trades, order_in_book
+
+    def send_messages(self, dict batch, latencies=None):
+        """ Sends a batch of external messages given as columns, see
+        :py:func:`orderbookmdp.data_all.orderstream.orderstream_batches`. Sizes are integer lots and the order
+        ids are split in their high and low 64 bits. Returns the trades of all the messages.
+
+        If latencies, an int64 array as long as the batch, is given the nanoseconds each message took is written to it.
+        A batch without the columns of :py:data:`orderbookmdp.order_book.utils.MARKET_COLUMNS` raises a ValueError.
+        """
+        check_market_batch(batch)
+        return self.apply_messages(batch, len(batch['type']), True, latencies)
+
+    def fast_forward(self, dict batch, until_time=None, until_sequence=None):
+        """ Applies the external messages of a batch before until_time and until_sequence, see
+        :py:func:`orderbookmdp.order_book.utils.stop_row`, for example to position the market at the start of an
+        episode. Unlike :py:meth:`send_messages` the orders are matched without creating trades and the time of the
+        market is only set to the time of the last message. Returns the number of messages applied, the rest of the
+        batch is to be sent after them.
+        """
+        check_market_batch(batch)
+        cdef Py_ssize_t stop = stop_row(batch, until_time, until_sequence)
+        self.ob.keep_trades = False
+        try:
+            self.apply_messages(batch, stop, False)
+        finally:
+            self.ob.keep_trades = True
+        if stop > 0:
+            self.time = batch['time'][stop - 1].item()
+        return stop
+
+    cdef list apply_messages(self, dict batch, Py_ssize_t stop, bint keep_trades, latencies=None):
+        cdef const signed char[:] types = batch['type']
+        cdef const signed char[:] order_types = batch['order_type']
+        cdef const signed char[:] reasons = batch['reason']
+        cdef const signed char[:] sides = batch['side']
+        cdef const double[:] prices = batch['price']
+        cdef const long long[:] sizes = batch['size']
+        cdef const double[:] funds = batch['funds']
+        cdef const long long[:] trader_ids = batch['trader_id']
+        cdef const unsigned long long[:] order_id_hi = batch['order_id_hi']
+        cdef const unsigned long long[:] order_id_lo = batch['order_id_lo']
+        cdef list times = batch['time'][:stop].tolist() if keep_trades else None
+        cdef list trades = []
+        cdef Py_ssize_t i
+        cdef object order_id
+        cdef long long[:] latency = latencies
+        cdef bint timed = latencies is not None
+        cdef long long start = 0, now
+
+        for i in range(stop):
+            if timed:  # The time since the previous message started is its latency
+                now = now_ns()
+                if i > 0:
+                    latency[i - 1] = now - start
+                start = now
+            if keep_trades:
+                self.time = times[i]
+            if types[i] == M_RECEIVED:
+                if order_types[i] == OT_LIMIT:
+                    trades_, order_in_book = self.ob.limit_lots(to_int(prices[i], self.multiplier), sides[i],
+                                                                sizes[i], trader_ids[i], self.time)
+                    if order_in_book is not None:
+                        order_id = (<object> order_id_hi[i] << 64) | order_id_lo[i]
+                        self.external_market_order_ids[order_id] = order_in_book[OIB_ID]
+                elif order_types[i] == OT_MARKET:
+                    if sizes[i] == -1:
+                        trades_ = self.ob.market_order_funds(funds[i]*self.multiplier, sides[i], trader_ids[i],
+                                                             self.time)
+                    else:
+                        trades_ = self.ob.market_order_lots(sizes[i], sides[i], trader_ids[i], self.time)
+                else:
+                    continue
+                if trades_:
+                    trades.extend(trades_)
+                    if self.bars is not None:
+                        self.bars.add_trades(trades_)
+            elif types[i] == M_DONE:
+                if reasons[i] == R_CANCELED:
+                    order_id = (<object> order_id_hi[i] << 64) | order_id_lo[i]
+                    try:
+                        self.ob.cancel(self.external_market_order_ids.pop(order_id))
+                    except (ValueError, KeyError):
+                        pass  # TODO Fix
+            elif types[i] == M_CHANGE:
+                order_id = self.external_market_order_ids.get((<object> order_id_hi[i] << 64) | order_id_lo[i])
+                if order_id is not None:
+                    self.ob.update_lots(order_id, sizes[i])
+
+        if timed and stop > 0:
+            latency[stop - 1] = now_ns() - start
+        return trades
+
     def fill_snap(self, snap):
+        if isinstance(snap['bids'], dict):
+            self.fill_binary_snap(snap)
+            return
+
         for message in snap['bids']:
 
             _, oib = self.ob.limit(to_int(float(message[SO_PRICE]), self.multiplier), BUY, float(message[SO_SIZE]), EXT_ID, self.time)
             if oib is not None:
-                self.external_market_order_ids[message[SO_EXT_ID]] = oib[OIB_ID]
+                self.external_market_order_ids[uuid_to_int(message[SO_EXT_ID])] = oib[OIB_ID]
 
         for message in snap['asks']:
 
@@ -722,9 +1266,305 @@ cdef class CyExternalMarket:
 
             _, oib = self.ob.limit(to_int(float(message[SO_PRICE]), self.multiplier), SELL, float(message[SO_SIZE]), EXT_ID, self.time)
             if oib is not None:
-                self.external_market_order_ids[message[SO_EXT_ID]] = oib[OIB_ID]
+                self.external_market_order_ids[uuid_to_int(message[SO_EXT_ID])] = oib[OIB_ID]
+
+    def fill_binary_snap(self, dict snap):
+        """ Fills the market from a binary snapshot, see :py:mod:`orderbookmdp.data_all.snapshots`. """
+        if snap['multiplier'] != self.multiplier or snap['lot_multiplier'] != self.ob.lot_multiplier:
+            raise ValueError('The tick or lot size of the snapshot differs from the market')
+        self.fill_binary_side(snap['bids'], BUY)
+        self.fill_binary_side(snap['asks'], SELL)
+
+    def get_binary_snap(self, long long sequence):
+        """ Returns the external orders in the book as a binary snapshot at sequence, in price and time priority,
+        see :py:mod:`orderbookmdp.data_all.snapshots`.
+        """
+        cdef CyListPriceLevels price_levels = self.ob.price_levels
+        cdef dict external_ids = {order_id: external_id for external_id, order_id
+                                  in self.external_market_order_ids.items()}
+        cdef dict snap = {'sequence': sequence, 'multiplier': self.multiplier,
+                          'lot_multiplier': int(self.ob.lot_multiplier)}
+        cdef list prices, sizes, order_id_hi, order_id_lo
+
+        for side, name in ((BUY, 'bids'), (SELL, 'asks')):
+            prices, sizes, order_id_hi, order_id_lo = [], [], [], []
+            for price in price_levels.get_prices(side):
+                for order in price_levels.get_level(side, price).orders:
+                    external_id = external_ids.get(order[O_ID])
+                    if external_id is not None:  # Orders of agents are not external orders
+                        prices.append(price)
+                        sizes.append(order[O_SIZE])
+                        order_id_hi.append(external_id >> 64)
+                        order_id_lo.append(external_id & 0xFFFFFFFFFFFFFFFF)
+            snap[name] = {'price': np.array(prices, dtype=np.int64), 'size': np.array(sizes, dtype=np.int64),
+                          'order_id_hi': np.array(order_id_hi, dtype=np.uint64),
+                          'order_id_lo': np.array(order_id_lo, dtype=np.uint64)}
+        return snap
+
+    def resync_snap(self, snap, dict stats=None):
+        """ Resyncs the external orders of the market to a snapshot, for example after a gap in the external messages,
+        by applying only the differences per external order id. Orders missing in the snapshot are canceled, orders
+        with a new size are updated and new orders, or orders that moved price, are added last in their price level.
+        Orders of agents are kept and the trades of added orders against them are returned.
+
+        The stats dict, if given, is updated with the number of orders 'added', 'canceled' and 'changed'.
+        """
+        cdef dict target = self.snap_orders(snap)
+        cdef dict orders = self.ob.orders
+        cdef list trades = []
+        cdef long long added = 0, canceled = 0, changed = 0
+        cdef tuple new
+        cdef list order
+
+        for external_id, order_id in list(self.external_market_order_ids.items()):
+            new = target.get(external_id)
+            order = orders.get(order_id)
+            if order is None:  # Already matched
+                del self.external_market_order_ids[external_id]
+            elif new is None or new[0] != order[O_SIDE] or new[1] != order[O_PRICE]:
+                self.ob.cancel(order_id)
+                del self.external_market_order_ids[external_id]
+                canceled += 1
+            else:
+                if new[2] != order[O_SIZE]:
+                    self.ob.update_lots(order_id, new[2])
+                    changed += 1
+                del target[external_id]
+
+        for external_id, new in target.items():  # In the order of the snapshot
+            trades_, oib = self.ob.limit_lots(new[1], new[0], new[2], EXT_ID, self.time)
+            if trades_:
+                trades.extend(trades_)
+            if oib is not None:
+                self.external_market_order_ids[external_id] = oib[OIB_ID]
+            added += 1
 
+        if stats is not None:
+            stats['added'] = stats.get('added', 0) + added
+            stats['canceled'] = stats.get('canceled', 0) + canceled
+            stats['changed'] = stats.get('changed', 0) + changed
+        return trades
+
+    cdef dict snap_orders(self, snap):
+        # External order id to (side, price, lots) of every order in a json or binary snapshot, in snapshot order
+        cdef dict target = {}
+        cdef const long long[:] prices
+        cdef const long long[:] sizes
+        cdef const unsigned long long[:] order_id_hi
+        cdef const unsigned long long[:] order_id_lo
+        cdef Py_ssize_t i
+
+        if isinstance(snap['bids'], dict):
+            if snap['multiplier'] != self.multiplier or snap['lot_multiplier'] != self.ob.lot_multiplier:
+                raise ValueError('The tick or lot size of the snapshot differs from the market')
+            for side, name in ((BUY, 'bids'), (SELL, 'asks')):
+                prices, sizes = snap[name]['price'], snap[name]['size']
+                order_id_hi, order_id_lo = snap[name]['order_id_hi'], snap[name]['order_id_lo']
+                for i in range(prices.shape[0]):
+                    target[(<object> order_id_hi[i] << 64) | order_id_lo[i]] = (side, prices[i], sizes[i])
+        else:
+            for side, name in ((BUY, 'bids'), (SELL, 'asks')):
+                for message in snap[name]:
+                    target[uuid_to_int(message[SO_EXT_ID])] = (side, to_int(float(message[SO_PRICE]), self.multiplier),
+                                                               to_lots(float(message[SO_SIZE]), self.ob.lot_multiplier))
+        return target
+
+    cdef fill_binary_side(self, dict orders, int side):
+        cdef const long long[:] prices = orders['price']
+        cdef const long long[:] sizes = orders['size']
+        cdef const unsigned long long[:] order_id_hi = orders['order_id_hi']
+        cdef const unsigned long long[:] order_id_lo = orders['order_id_lo']
+        cdef Py_ssize_t i
+
+        for i in range(prices.shape[0]):
+            _, oib = self.ob.limit_lots(prices[i], side, sizes[i], EXT_ID, self.time)
+            if oib is not None:
+                self.external_market_order_ids[(<object> order_id_hi[i] << 64) | order_id_lo[i]] = oib[OIB_ID]
 
 
+cdef class CyL2OrderBook:
+    """ A level 2 order book that only keeps the aggregated size of each price, without any orders.
 
+    The sizes are kept as integer lots in one array per side indexed by price. Levels are set to their new
+    aggregated size, as in level 2 updates, one at a time or in batches. Prices are integers, see
+    :py:func:`to_int`, and sizes returned by the queries are floats.
+    """
 
+    cdef public int max_price
+    cdef public int min_price
+    cdef int max_index
+    cdef int bid_index
+    cdef int ask_index
+    cdef public int multiplier
+    cdef public double lot_size
+    cdef public double lot_multiplier
+    cdef long long[:] bids
+    cdef long long[:] asks
+
+    def __init__(self, tick_size=0.01, max_price=13000, min_price=5000, lot_size=1e-8):
+        tick_dec = int(np.log10(1 / tick_size))
+        self.multiplier = 10**tick_dec
+        self.max_price = int(round(max_price*self.multiplier))
+        self.min_price = int(round(min_price*self.multiplier))
+        self.max_index = self.max_price - self.min_price
+        self.lot_size = lot_size
+        self.lot_multiplier = 10**int(round(np.log10(1 / lot_size)))
+        self.bids = np.zeros(self.max_index + 1, dtype=np.int64)
+        self.asks = np.zeros(self.max_index + 1, dtype=np.int64)
+        self.bid_index = -1
+        self.ask_index = self.max_index + 1
+
+    cpdef clear(self):
+        self.bids[:] = 0
+        self.asks[:] = 0
+        self.bid_index = -1
+        self.ask_index = self.max_index + 1
+
+    cdef inline void _update(self, int side, long int price, long long size) nogil:
+        cdef int index = price - self.min_price
+        if index < 0 or index > self.max_index:
+            return
+        if side == BUY:
+            self.bids[index] = size
+            if size > 0:
+                if index > self.bid_index:
+                    self.bid_index = index
+            elif index == self.bid_index:
+                while self.bid_index >= 0 and self.bids[self.bid_index] == 0:
+                    self.bid_index -= 1
+        else:
+            self.asks[index] = size
+            if size > 0:
+                if index < self.ask_index:
+                    self.ask_index = index
+            elif index == self.ask_index:
+                while self.ask_index <= self.max_index and self.asks[self.ask_index] == 0:
+                    self.ask_index += 1
+
+    cpdef update(self, int side, long int price, long long size):
+        """ Sets the aggregated size in lots of a price, a size of 0 removes the price level. """
+        self._update(side, price, size)
+
+    def update_levels(self, const signed char[:] sides, const long long[:] prices, const long long[:] sizes):
+        """ Sets the aggregated sizes in lots of a batch of price levels, in order. """
+        cdef Py_ssize_t i
+        with nogil:
+            for i in range(sides.shape[0]):
+                self._update(sides[i], prices[i], sizes[i])
+
+    def fill_snap(self, snap):
+        """ Fills the book from a level 2 snapshot, {'bids': [[price, size], ...], 'asks': [[price, size], ...]}. """
+        self.clear()
+        for price, size in snap['bids']:
+            self._update(BUY, to_int(float(price), self.multiplier), to_lots(float(size), self.lot_multiplier))
+        for price, size in snap['asks']:
+            self._update(SELL, to_int(float(price), self.multiplier), to_lots(float(size), self.lot_multiplier))
+
+    cpdef exist_buy_orders(self):
+        return self.bid_index >= 0
+
+    cpdef exist_sell_orders(self):
+        return self.ask_index <= self.max_index
+
+    cpdef int get_ask(self):
+        return self.ask_index + self.min_price
+
+    cpdef int get_bid(self):
+        return self.bid_index + self.min_price
+
+    cpdef double get_size(self, int side, long int price):
+        cdef int index = price - self.min_price
+        if index < 0 or index > self.max_index:
+            return 0
+        if side == BUY:
+            return self.bids[index] * self.lot_size
+        return self.asks[index] * self.lot_size
+
+    cpdef get_quotes(self):
+        ask_v = self.asks[self.ask_index] * self.lot_size if self.exist_sell_orders() else 0.0
+        bid_v = self.bids[self.bid_index] * self.lot_size if self.exist_buy_orders() else 0.0
+        return np.array([self.get_ask(), ask_v, self.get_bid(), bid_v])  # Quotes : (ask, ask_v, bid, bid_v)
+
+    def get_prices(self, int side):
+        cdef int index
+        if side == BUY:
+            for index in range(self.bid_index, -1, -1):
+                if self.bids[index] > 0:
+                    yield index + self.min_price
+        else:
+            for index in range(self.ask_index, self.max_index + 1):
+                if self.asks[index] > 0:
+                    yield index + self.min_price
+
+    cpdef tuple get_depth(self, int side, int n):
+        """ Returns the prices and float sizes of the n best price levels of a side as arrays. """
+        prices = np.empty(n, dtype=np.int64)
+        sizes = np.empty(n, dtype=np.float64)
+        cdef long long[:] prices_view = prices
+        cdef double[:] sizes_view = sizes
+        cdef int k = 0
+        cdef int index
+        if side == BUY:
+            index = self.bid_index
+            while index >= 0 and k < n:
+                if self.bids[index] > 0:
+                    prices_view[k] = index + self.min_price
+                    sizes_view[k] = self.bids[index] * self.lot_size
+                    k += 1
+                index -= 1
+        else:
+            index = self.ask_index
+            while index <= self.max_index and k < n:
+                if self.asks[index] > 0:
+                    prices_view[k] = index + self.min_price
+                    sizes_view[k] = self.asks[index] * self.lot_size
+                    k += 1
+                index += 1
+        return prices[:k], sizes[:k]
+
+    cpdef dict get_snap(self):
+        cdef dict snap = {'asks': {}, 'bids': {}}
+        for price in self.get_prices(BUY):
+            snap['bids'][price] = self.get_size(BUY, price)
+        for price in self.get_prices(SELL):
+            snap['asks'][price] = self.get_size(SELL, price)
+        return snap
+
+    cpdef tuple buy_impact(self, double funds):
+        """ Returns the size and the average price of buying for funds with a market order. """
+        cdef double size = 0, price, level_size, cost
+        cdef double spent = funds
+        cdef int index = self.ask_index
+        while index <= self.max_index and funds > 0:
+            if self.asks[index] > 0:
+                price = (index + self.min_price) / <double> self.multiplier
+                level_size = self.asks[index] * self.lot_size
+                cost = level_size * price
+                if cost >= funds:
+                    size += funds / price
+                    funds = 0
+                else:
+                    size += level_size
+                    funds -= cost
+            index += 1
+        spent -= funds
+        return size, spent / size if size > 0 else 0.0
+
+    cpdef tuple sell_impact(self, double size):
+        """ Returns the funds and the average price of selling size with a market order. """
+        cdef double funds = 0, price, level_size
+        cdef double sold = size
+        cdef int index = self.bid_index
+        while index >= 0 and size > 0:
+            if self.bids[index] > 0:
+                price = (index + self.min_price) / <double> self.multiplier
+                level_size = self.bids[index] * self.lot_size
+                if level_size >= size:
+                    funds += size * price
+                    size = 0
+                else:
+                    funds += level_size * price
+                    size -= level_size
+            index -= 1
+        sold -= size
+        return funds, funds / sold if sold > 0 else 0.0
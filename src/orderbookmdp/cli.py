@@ -15,21 +15,84 @@ Why does this file exist, and why not put this in __main__?
   Also see (1) from http://click.pocoo.org/5/setuptools/#setuptools-integration
 """
 import argparse
+import os
+
+import ujson
 
 from orderbookmdp.data_all.download_gdax import download
 from orderbookmdp.data_all.reformat_data import reformat
+from orderbookmdp.data_all.replay import replay
+from orderbookmdp.data_all.replay import replay_shards
+from orderbookmdp.data_all.replay import summarize
+from orderbookmdp.data_all.replay_server import ReplayServer
+from orderbookmdp.data_all.shards import is_sharded
+from orderbookmdp.data_all.shards import reformat_shards
+from orderbookmdp.data_all.shards import shard_raw_files
 
-parser = argparse.ArgumentParser(description='Either downloads or reformats data from a directory.')
+parser = argparse.ArgumentParser(description='Either downloads, reformats or replays data from a directory.')
 
-parser.add_argument('command', choices=['download', 'reformat'])
+parser.add_argument('command', choices=['download', 'reformat', 'serve', 'shard', 'replay'])
 parser.add_argument('--download_time', type=str, default='10000 days', help='Time to download')
 parser.add_argument('--dir', default='data', help='The directory to download or reformat')
-parser.add_argument('--product', default='BTC-USD', help='The product to download')
+parser.add_argument('--product', default='BTC-USD', help='The products, comma separated, a single product to shard or serve')
+parser.add_argument('--compression', default='zstd', help='Compression of downloaded files, zstd, lz4, gzip or none')
 parser.add_argument('--cores', default=1, type=int, help='Number of cores to use for reformating')
+parser.add_argument('--store', action='store_true', help='Reformat messages to memory-mapped message store files')
+parser.add_argument('--binary_snaps', action='store_true', help='Also reformat snapshots to binary snapshots')
+parser.add_argument('--checkpoint_messages', type=int, help='Save a checkpoint of the book every n messages')
+parser.add_argument('--checkpoint_seconds', type=float, help='Save a checkpoint of the book every n seconds')
+parser.add_argument('--time_strings', action='store_true', help='Keep the time of messages as the exchange string')
+parser.add_argument('--force', action='store_true', help='Reformat all files, not only new or changed files')
+parser.add_argument('--message_compression', default='lz4', help='Compression of reformatted messages, lz4, zstd or none')
+parser.add_argument('--message_level', type=int, help='Compression level of reformatted messages')
+parser.add_argument('--snap_compression', default='none', help='Compression of reformatted snapshots, zstd, lz4, gzip or none')
+parser.add_argument('--snap_level', type=int, help='Compression level of reformatted snapshots')
+parser.add_argument('--port', default=8765, type=int, help='Port to replay the downloaded messages on')
+parser.add_argument('--days', help='The days of the shards to serve, comma separated and consecutive, all days if not set')
+parser.add_argument('--speed', type=float, help='Replay speed relative to the message times, as fast as possible if not set')
+parser.add_argument('--engine', default='cy', choices=['cy', 'py'], help='The market to replay the reformatted messages through')
+parser.add_argument('--price_levels_type', help='Price levels of the py engine, sorted_dict, fast_rb, fast_avl or list')
+parser.add_argument('--price_level_type', help='Price level of the py engine, ordered_dict, deque or cydeque')
+parser.add_argument('--start', help='Replay the messages from this time')
+parser.add_argument('--end', help='Replay the messages before this time')
+parser.add_argument('--start_sequence', type=int, help='Replay the messages from this sequence')
+parser.add_argument('--end_sequence', type=int, help='Replay the messages before this sequence')
+parser.add_argument('--max_messages', type=int, help='Stop replaying after about this many messages')
 
 def main(args=None):
     args = parser.parse_args(args=args)
+    codecs = dict(message_compression=None if args.message_compression == 'none' else args.message_compression,
+                  message_level=args.message_level, snap_level=args.snap_level,
+                  snap_compression=None if args.snap_compression == 'none' else args.snap_compression)
     if args.command == 'download':
-        download(args.dir, args.download_time, args.product)
+        download(args.dir, args.download_time, args.product, None if args.compression == 'none' else args.compression)
+    elif args.command == 'reformat' and is_sharded(args.dir):
+        reformat_shards(args.dir, args.cores, args.store, args.binary_snaps, args.product.split(','),
+                        checkpoint_messages=args.checkpoint_messages, checkpoint_seconds=args.checkpoint_seconds,
+                        force=args.force, time_strings=args.time_strings, **codecs)
     elif args.command == 'reformat':
-        reformat(args.dir, args.cores)
+        reformat(args.dir, args.cores, args.store, args.binary_snaps, args.checkpoint_messages,
+                 args.checkpoint_seconds, args.force, args.time_strings, **codecs)
+    elif args.command in ('shard', 'serve') and ',' in args.product:
+        parser.error('{} takes a single --product'.format(args.command))
+    elif args.command == 'shard':
+        shard_raw_files(args.dir, args.product)
+    elif args.command == 'serve':
+        ReplayServer(args.dir, port=args.port, speed=args.speed, product=args.product,
+                     days=None if args.days is None else args.days.split(',')).run()
+    elif args.command == 'replay' and args.engine == 'cy' and (args.price_levels_type or args.price_level_type):
+        parser.error('--price_levels_type and --price_level_type are of the py engine, not of --engine cy')
+    elif args.command == 'replay':
+        time_range = None if args.start is None and args.end is None else (args.start, args.end)
+        sequence_range = None if args.start_sequence is None and args.end_sequence is None else \
+            (args.start_sequence, args.end_sequence)
+        replay_kwargs = dict(engine=args.engine, price_levels_type=args.price_levels_type,
+                             price_level_type=args.price_level_type, sequence_range=sequence_range,
+                             max_messages=args.max_messages)
+        if is_sharded(args.dir):
+            summary = replay_shards(args.dir, args.product.split(','), args.cores, time_range, **replay_kwargs)
+        else:
+            order_paths = os.path.join(args.dir, 'store' if args.store else 'feather') + '/'
+            snapshot_paths = os.path.join(args.dir, 'snap_bin' if args.binary_snaps else 'snap_json') + '/'
+            summary = summarize([replay(order_paths, snapshot_paths, time_range=time_range, **replay_kwargs)])
+        print(ujson.dumps(summary, indent=2))
@@ -0,0 +1,174 @@
+"""Checkpoints of the order book reconstructed from the messages.
+
+The exchange snapshots are only downloaded once in a while, see
+:py:class:`orderbookmdp.data_all.download_gdax.DownloadWebsocketClient`. :py:func:`write_checkpoints` replays the
+reformatted messages through a :py:class:`orderbookmdp._orderbookmdp.CyExternalMarket` and saves the book every
+every_messages messages or every_seconds seconds as a binary snapshot, see :py:mod:`orderbookmdp.data_all.snapshots`.
+Saved in the same directory as the binary exchange snapshots, the checkpoints are used by
+:py:func:`orderbookmdp.data_all.orderstream.orderstream` as any other snapshot.
+
+The book of the market only holds the prices within :py:func:`checkpoint_bounds` of the snapshot it was filled from.
+Once an order outside of them has been dropped the book is incomplete, and no checkpoint is saved until the replay
+continues from the next snapshot.
+
+"""
+
+import numpy as np
+
+from orderbookmdp._orderbookmdp import CyExternalMarket
+from orderbookmdp.data_all.orderstream import orderstream_batches
+from orderbookmdp.data_all.snapshots import SIDES
+from orderbookmdp.data_all.snapshots import binary_snap_name
+from orderbookmdp.data_all.snapshots import find_binary_snap
+from orderbookmdp.data_all.snapshots import save_binary_snap
+from orderbookmdp.order_book.constants import SO_PRICE
+from orderbookmdp.order_book.utils import to_nanoseconds
+
+# Number of price levels of the book of a checkpoint market, as many as the default book of a CyExternalMarket
+CHECKPOINT_LEVELS = 800000
+
+
+def checkpoint_bounds(snap: dict, tick_size=0.01, levels=CHECKPOINT_LEVELS) -> dict:
+    """
+    Returns the price range of a book of levels price levels for the orders of a snapshot, as the min_price and
+    max_price of a :py:class:`orderbookmdp._orderbookmdp.CyExternalMarket`. The range is centered on the prices of the
+    snapshot if they all fit in it, otherwise on the middle of its best bid and ask. It never goes below 0.
+
+    Parameters
+    ----------
+    snap: dict
+        A json or binary snapshot
+    tick_size: float
+    levels: int
+
+    Returns
+    -------
+    bounds: dict
+        'min_price' and 'max_price'
+
+    """
+    prices = {}
+    for side in SIDES:
+        if isinstance(snap[side], dict):
+            prices[side] = snap[side]['price'] / snap['multiplier']
+        else:
+            prices[side] = np.array([float(order[SO_PRICE]) for order in snap[side]])
+    all_prices = np.concatenate([prices[side] for side in SIDES])
+    if len(all_prices) == 0:
+        return {}
+    low, high = all_prices.min(), all_prices.max()
+    if (high - low) / tick_size >= levels - 2:
+        best = [prices[side].max() if side == 'bids' else prices[side].min() for side in SIDES if len(prices[side]) > 0]
+        low = high = sum(best) / len(best)
+    min_price = max(round((low + high) / 2 / tick_size) - levels // 2, 0) * tick_size
+    return {'min_price': min_price, 'max_price': min_price + levels * tick_size}
+
+
+def checkpoint_rows(n_messages, times, every_messages=None, every_seconds=None, prev_messages=0, prev_slot=None) -> list:
+    """
+    Returns the rows of a batch before which a checkpoint is due.
+
+    Parameters
+    ----------
+    n_messages: int
+        Number of messages in the batch
+    times: numpy.ndarray
+        The times of the messages in nanoseconds, only used with every_seconds
+    every_messages: int
+    every_seconds: float
+    prev_messages: int
+        Number of messages since the last checkpoint before the batch
+    prev_slot: int
+        The time slot of the last message before the batch
+
+    Returns
+    -------
+    rows: list
+
+    """
+    rows = set()
+    if every_messages is not None:
+        rows.update(range(every_messages - prev_messages, n_messages, every_messages))
+    if every_seconds is not None and n_messages > 0:
+        slots = times // int(every_seconds * 1e9)
+        prev_slots = np.empty_like(slots)
+        prev_slots[0] = slots[0] if prev_slot is None else prev_slot
+        prev_slots[1:] = slots[:-1]
+        rows.update(np.flatnonzero(slots != prev_slots).tolist())
+    return sorted(row for row in rows if row > 0 or prev_messages > 0)
+
+
+def write_checkpoints(order_paths, snapshot_paths, checkpoint_paths, every_messages=None, every_seconds=None,
+                      batch_size=65536, snap_compression=None, snap_level=None, levels=CHECKPOINT_LEVELS, stats=None,
+                      **market_kwargs) -> list:
+    """
+    Replays the orders from the first snapshot and saves a checkpoint of the book every every_messages messages
+    and every every_seconds seconds of message time. At a gap in the orders the replay continues from the next
+    snapshot. A checkpoint is not saved where there already is a snapshot with its sequence, or while the book is
+    missing orders outside of its price range.
+
+    Parameters
+    ----------
+    order_paths: str
+        Path to the orders
+    snapshot_paths: str
+        Path to the snapshots
+    checkpoint_paths: str
+        Path to save the checkpoints to, as snap_<sequence>.npz, with the extension of snap_compression
+    every_messages: int
+    every_seconds: float
+    batch_size: int
+        Number of messages replayed at a time
+    snap_compression: str
+        Compression of the checkpoints, see :py:func:`orderbookmdp.data_all.snapshots.save_binary_snap`
+    snap_level: int
+        Compression level
+    levels: int
+        Number of price levels of the book, see :py:func:`checkpoint_bounds`
+    stats: dict
+        Updated with the number of checkpoints 'skipped' because the book was missing orders
+    market_kwargs
+        Passed to the :py:class:`orderbookmdp._orderbookmdp.CyExternalMarket`
+
+    Returns
+    -------
+    checkpoints: list
+        The names of the checkpoints saved in checkpoint_paths
+
+    """
+    stats = {} if stats is None else stats
+    stats.setdefault('skipped', 0)
+    checkpoints = []
+    market, sequence, prev_messages, prev_slot = None, None, 0, None
+
+    for batch, snap in orderstream_batches(order_paths, snapshot_paths, batch_size=batch_size):
+        if snap is not None:
+            if sequence is not None and snap['sequence'] <= sequence:  # The stream starts over from the beginning
+                break
+            market = CyExternalMarket(**checkpoint_bounds(snap, market_kwargs.get('tick_size', 0.01), levels),
+                                      **market_kwargs)
+            market.fill_snap(snap)
+            sequence, prev_messages, prev_slot = snap['sequence'], 0, None
+            continue
+
+        n_messages = len(batch['sequence'])
+        times = to_nanoseconds(batch['time']) if every_seconds is not None else None
+        start = 0
+        for row in checkpoint_rows(n_messages, times, every_messages, every_seconds, prev_messages, prev_slot) + [None]:
+            market.send_messages({name: column[start:row] for name, column in batch.items()})
+            if row is None:
+                prev_messages += n_messages - start
+                break
+            sequence = int(batch['sequence'][row - 1]) if row > 0 else sequence
+            if market.ob.price_levels.dropped > 0:
+                stats['skipped'] += 1
+            elif find_binary_snap(checkpoint_paths, sequence) is None:
+                name = binary_snap_name(sequence, snap_compression)
+                save_binary_snap(market.get_binary_snap(sequence), checkpoint_paths + name, snap_level)
+                checkpoints.append(name)
+            start, prev_messages = row, 0
+        sequence = int(batch['sequence'][-1])
+        if every_seconds is not None:
+            prev_slot = times[-1] // int(every_seconds * 1e9)
+
+    return checkpoints
@@ -1,71 +1,119 @@
 import datetime
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import cbpro
 import pandas as pd
 import ujson
 
+from orderbookmdp.data_all.recorder import Recorder
+from orderbookmdp.data_all.recorder import open_raw
+from orderbookmdp.data_all.recorder import raw_compression
+from orderbookmdp.data_all.recorder import raw_extension
+from orderbookmdp.data_all.shards import shard_day
+from orderbookmdp.data_all.shards import shard_dir
 
-def save_snapshot(public_client, data_dir):
+
+def save_snapshot(public_client, data_dir, product, compression=None):
     logging.info('downloads snapshot')
-    snapshot = public_client.get_product_order_book('BTC-USD', level=3)
+    snapshot = public_client.get_product_order_book(product, level=3)
     date_time = datetime.datetime.now()
     dts = date_time.strftime('%d_%m_%Y_%H_%M_%S')
-    with open(data_dir + dts + '_snaps.json', 'w') as f:
-        ujson.dump(snapshot, f)
+    with open_raw(data_dir + dts + '_snaps.json' + raw_extension(compression), 'w') as f:
+        f.write(ujson.dumps(snapshot))
     logging.info('snapshot saved')
 
 
+def log_snapshot_error(future):
+    if future.exception() is not None:
+        logging.error('snapshot failed: {}'.format(future.exception()))
+
+
 class DownloadWebsocketClient(cbpro.WebsocketClient):
-    def __init__(self, data_dir, **kwargs):
-        super(DownloadWebsocketClient, self).__init__(**kwargs)
+    """
+    Downloads the messages of the products to their shards in data_dir, see :py:mod:`orderbookmdp.data_all.shards`.
+    The messages of each product are handed to a :py:class:`orderbookmdp.data_all.recorder.Recorder` of the day
+    which writes them in another thread. A snapshot of a product is saved in the background when its shard of the day
+    is started, every snapshot interval and when sequences of it are missed.
+
+    """
+    def __init__(self, data_dir, compression='zstd', url='wss://ws-feed.pro.coinbase.com/',
+                 api_url='https://api.pro.coinbase.com', **kwargs):
+        super(DownloadWebsocketClient, self).__init__(url=url, **kwargs)
         self.data_dir = data_dir
+        self.api_url = api_url
+        self.compression = raw_compression(compression)
         self.datetime = datetime.datetime.now()
         self.snapshot_time_delta = pd.to_timedelta('60minutes').to_pytimedelta()
-
-    def change_file(self, msg):
-        logging.info('changes file, messsage count: {}'.format(self.message_count))
-        if self.file:
-            self.file.close()
-        self.message_seq = msg['sequence']
-        date_time = pd.to_datetime(msg['time'])
-        dts = date_time.strftime('%d_%m_%Y_%H_%M_%S')
-        self.file = open(self.data_dir + dts + '_mess.json', 'w')
+        self.snapshots = ThreadPoolExecutor(max_workers=1)
+        self.snapshot_futures = {}
+        self.recorders = {}
+
+    def json_dir(self, product) -> str:
+        """ Returns the directory the product is recorded to today, see :py:func:`shard_dir`. """
+        return shard_dir(self.data_dir, product, self.recorders[product][0]) + 'json/'
+
+    def take_snapshot(self, product):
+        """ Saves a snapshot of product in the background, unless one is already waiting to be saved. """
+        future = self.snapshot_futures.get(product)
+        if future is not None and not future.running() and not future.done():
+            return
+        future = self.snapshots.submit(save_snapshot, self.public_client, self.json_dir(product), product,
+                                       self.compression)
+        future.add_done_callback(log_snapshot_error)
+        self.snapshot_futures[product] = future
+
+    def recorder(self, product, day) -> Recorder:
+        """ Returns the recorder of product on day, a new shard is started when the day changes. """
+        current = self.recorders.get(product)
+        if current is not None and current[0] == day:
+            return current[1]
+        if current is not None:
+            current[1].close()
+        json_dir = shard_dir(self.data_dir, product, day) + 'json/'
+        os.makedirs(json_dir, exist_ok=True)
+        logging.info('Records {} to {}'.format(product, json_dir))
+        self.recorders[product] = (day, Recorder(json_dir, self.compression))
+        self.take_snapshot(product)
+        return self.recorders[product][1]
 
     def on_open(self):
-        self.url = "wss://ws-feed.pro.coinbase.com/"
-        logging.info('Downloads product:{}'.format(self.products))
+        logging.info('Downloads products:{} from {}'.format(self.products, self.url))
         self.message_count = 0
-        self.file = None
-        self.public_client = cbpro.PublicClient()
-        save_snapshot(self.public_client, self.data_dir)
+        self.message_seqs = {}
+        self.public_client = cbpro.PublicClient(api_url=self.api_url)
 
     def on_message(self, msg):
+        if 'sequence' not in msg:  # Subscription messages
+            return
 
         if self.message_count % 10000 == 0:
             logging.info('message count: {}'.format(self.message_count))
 
-        if self.message_count % 5000000 == 0:
-            self.change_file(msg)
-        self.file.write(ujson.dumps(msg) + '\n')
+        product = msg['product_id']
+        self.recorder(product, shard_day(msg['time'])).write(msg)
         self.message_count += 1
 
         mess_seq = msg['sequence']
-        if mess_seq - self.message_seq > 1:
-            logging.info('missed sequences: {}'.format(mess_seq - self.message_seq))
-            save_snapshot()
+        message_seq = self.message_seqs.get(product)
+        if message_seq is not None and mess_seq - message_seq > 1:
+            logging.info('missed sequences of {}: {}'.format(product, mess_seq - message_seq))
+            self.take_snapshot(product)
 
-        if self.message_count % 1 == 0:
-            now = datetime.datetime.now()
-            if now - self.datetime > self.snapshot_time_delta:
-                logging.info('saves snapshot timedelta')
-                save_snapshot(self.public_client, self.data_dir)
-                self.datetime = now
+        now = datetime.datetime.now()
+        if now - self.datetime > self.snapshot_time_delta:
+            logging.info('saves snapshot timedelta')
+            for product_ in self.recorders:
+                self.take_snapshot(product_)
+            self.datetime = now
 
-        self.message_seq = mess_seq
+        self.message_seqs[product] = mess_seq
 
     def on_close(self):
+        for _, recorder in self.recorders.values():
+            recorder.close()
+        self.snapshots.shutdown(wait=True)
         logging.info("-- Goodbye! --")
 
     def on_error(self, e, data=None):
@@ -74,18 +122,21 @@ class DownloadWebsocketClient(cbpro.WebsocketClient):
         logging.info('{} - data: {}'.format(e, data))
 
 
-def download(dir, time_delta='1 min', product='BTC-USD'):
+def download(dir, time_delta='1 min', products=('BTC-USD',), compression='zstd', url='wss://ws-feed.pro.coinbase.com/',
+             api_url='https://api.pro.coinbase.com'):
+    """
+    Downloads the messages and snapshots of products, a list or comma separated, to per-product, per-day shards in
+    dir for time_delta, see :py:mod:`orderbookmdp.data_all.shards`.
 
+    """
     time_delta = pd.to_timedelta(time_delta)
     date_time = pd.datetime.now()
+    if isinstance(products, str):
+        products = products.split(',')
 
-    data_dir = dir + '/json/'
-    try:
-        os.makedirs(data_dir)
-    except FileExistsError:
-        pass
+    os.makedirs(dir, exist_ok=True)
 
-    print('Downloads to dir:' + data_dir)
+    print('Downloads {} to dir: {}'.format(', '.join(products), dir))
 
     logging.basicConfig(handlers=[
                             logging.FileHandler(dir + '/logs.log'),
@@ -96,7 +147,8 @@ def download(dir, time_delta='1 min', product='BTC-USD'):
     try:
         break_ = False
         while not break_:
-            wsClient = DownloadWebsocketClient(data_dir=data_dir, products=[product])
+            wsClient = DownloadWebsocketClient(data_dir=dir, compression=compression, url=url, api_url=api_url,
+                                               products=list(products))
             wsClient.start()
             while not wsClient.error:
                 if pd.datetime.now() - date_time > time_delta:
@@ -109,4 +161,4 @@ def download(dir, time_delta='1 min', product='BTC-USD'):
 
 
 if __name__ == '__main__':
-    download('../../../data')
+    download('../../../data', products=['BTC-USD'])
@@ -0,0 +1,252 @@
+"""Extracts features of the order books of historical data with reducers, one shard per process.
+
+:py:func:`extract` replays the orders of a data directory through an external market, see
+:py:func:`orderbookmdp.data_all.replay.market_batches`, and hands the market to a list of :py:class:`Reducer`. A reducer
+sees every message after it is applied, as a segment of columns in :py:meth:`Reducer.update`, and returns the
+features of an interval of message time at its end in :py:meth:`Reducer.sample`, which become one row of the result.
+Without an interval there is a single row at the end of the replay, for example the statistics of a day.
+
+:py:func:`extract_shards` extracts the features of every shard of a sharded data directory, see
+:py:mod:`orderbookmdp.data_all.shards`, in a pool of processes and writes them to out_dir/<product>/<day>.feather::
+
+    class MidPrice(Reducer):
+        def sample(self, market, time):
+            ask, _, bid, _ = market.ob.price_levels.get_quotes()
+            return {'mid': (ask + bid) / 2 / market.multiplier}
+
+    extract_shards('data', [Quotes(), OrderFlow(), MidPrice()], 'features', interval='1min', cores=4)
+
+The reducers are copied to every shard, so they should be passed unused.
+"""
+import os
+from copy import deepcopy
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather
+from custom_inherit import DocInheritMeta
+from joblib import Parallel
+from joblib import delayed
+
+from orderbookmdp.data_all.replay import get_engine
+from orderbookmdp.data_all.replay import market_batches
+from orderbookmdp.data_all.shards import ShardManifest
+from orderbookmdp.order_book.constants import BUY
+from orderbookmdp.order_book.constants import M_DONE
+from orderbookmdp.order_book.constants import M_RECEIVED
+from orderbookmdp.order_book.constants import R_CANCELED
+from orderbookmdp.order_book.constants import SELL
+from orderbookmdp.order_book.utils import to_nanoseconds
+
+
+class Reducer(metaclass=DocInheritMeta(style="numpy", abstract_base_class=True)):
+    """
+    Reduces the messages and order book of a replay to features, see :py:func:`extract`. Implementations override
+    :py:meth:`update`, :py:meth:`sample` or both.
+    """
+
+    def update(self, market, batch: dict):
+        """
+        Called with the messages that have just been applied to the market, in order.
+
+        Parameters
+        ----------
+        market: ExternalMarket or CyExternalMarket
+        batch: dict
+            Column name to numpy array, sizes are integer lots
+
+        """
+
+    def sample(self, market, time: int) -> dict:
+        """
+        Returns the features at the end of an interval, after its messages have been applied.
+
+        Parameters
+        ----------
+        market: ExternalMarket or CyExternalMarket
+        time: int
+            The end of the interval in epoch nanoseconds
+
+        Returns
+        -------
+        features: dict
+            Feature name to value
+
+        """
+        return {}
+
+
+class Quotes(Reducer):
+    """ The best bid and ask prices and sizes and the spread, NaN if a side of the book is empty. """
+
+    def sample(self, market, time: int) -> dict:
+        price_levels = market.ob.price_levels
+        ask, ask_size, bid, bid_size = np.nan, np.nan, np.nan, np.nan
+        if price_levels.exist_buy_orders() and price_levels.exist_sell_orders():
+            ask, ask_size, bid, bid_size = price_levels.get_quotes()
+            ask, bid = ask / market.multiplier, bid / market.multiplier
+        return {'bid': bid, 'ask': ask, 'bid_size': bid_size, 'ask_size': ask_size, 'spread': ask - bid}
+
+
+class Depth(Reducer):
+    """ The size of the bids and asks within pct of the best bid and ask. """
+
+    def __init__(self, pct=0.01):
+        self.pct = pct
+
+    def sample(self, market, time: int) -> dict:
+        snap = market.ob.price_levels.get_snap()
+        bid_depth, ask_depth = 0.0, 0.0
+        if snap['bids']:
+            low = max(snap['bids']) * (1 - self.pct)
+            bid_depth = float(sum(size for price, size in snap['bids'].items() if price >= low))
+        if snap['asks']:
+            high = min(snap['asks']) * (1 + self.pct)
+            ask_depth = float(sum(size for price, size in snap['asks'].items() if price <= high))
+        return {'bid_depth': bid_depth, 'ask_depth': ask_depth}
+
+
+class OrderFlow(Reducer):
+    """
+    The size of the received buy and sell orders of an interval, their imbalance, (buy - sell) / (buy + sell), the
+    number of canceled orders and of messages.
+    """
+
+    def __init__(self, lot_size=1e-8):
+        self.lot_size = lot_size
+        self.reset()
+
+    def reset(self):
+        self.buy_lots, self.sell_lots, self.cancels, self.messages = 0, 0, 0, 0
+
+    def update(self, market, batch: dict):
+        received = (batch['type'] == M_RECEIVED) & (batch['size'] > 0)
+        self.buy_lots += int(batch['size'][received & (batch['side'] == BUY)].sum())
+        self.sell_lots += int(batch['size'][received & (batch['side'] == SELL)].sum())
+        self.cancels += int(np.count_nonzero((batch['type'] == M_DONE) & (batch['reason'] == R_CANCELED)))
+        self.messages += len(batch['type'])
+
+    def sample(self, market, time: int) -> dict:
+        total = self.buy_lots + self.sell_lots
+        features = {'buy_volume': self.buy_lots * self.lot_size, 'sell_volume': self.sell_lots * self.lot_size,
+                    'imbalance': (self.buy_lots - self.sell_lots) / total if total > 0 else 0.0,
+                    'cancels': self.cancels, 'messages': self.messages}
+        self.reset()
+        return features
+
+
+def extract(order_paths, snapshot_paths, reducers, interval=None, engine='cy', time_range=None, sequence_range=None,
+            prefetch=1) -> dict:
+    """
+    Replays the orders once through a new market and reduces them to features.
+
+    Parameters
+    ----------
+    order_paths: str
+    snapshot_paths: str
+    reducers: list
+        :py:class:`Reducer`
+    interval: str
+        A pandas timedelta, for example '1min'. The intervals are aligned to multiples of it since the epoch. If None
+        the features are sampled once, at the last message
+    engine: str
+        See :py:func:`orderbookmdp.data_all.replay.get_engine`
+    time_range: tuple
+        See :py:func:`orderbookmdp.data_all.orderstream.orderstream_batches`
+    sequence_range: tuple
+    prefetch: int
+
+    Returns
+    -------
+    features: dict
+        Column name to numpy array, the 'time' at the end of each interval, the 'sequence' of its last message and
+        the features of the reducers
+
+    """
+    market = get_engine(engine)
+    step = None if interval is None else pd.to_timedelta(interval).value
+    rows = []
+    end, time, sequence = None, None, None
+
+    def apply(segment):
+        nonlocal sequence
+        if len(segment['sequence']) > 0:
+            market.send_messages(segment)
+            for reducer in reducers:
+                reducer.update(market, segment)
+            sequence = int(segment['sequence'][-1])
+
+    def sample(time):
+        row = {'time': time, 'sequence': sequence}
+        for reducer in reducers:
+            row.update(reducer.sample(market, time))
+        rows.append(row)
+
+    for batch in market_batches(market, order_paths, snapshot_paths, prefetch=prefetch, time_range=time_range,
+                                sequence_range=sequence_range):
+        times = np.maximum.accumulate(to_nanoseconds(batch['time']))  # Message times can step back slightly
+        time = int(times[-1])
+        if step is None:
+            apply(batch)
+            continue
+        if end is None:
+            end = (int(times[0]) // step + 1) * step
+        pos = 0
+        for end_ in range(end, time + 1, step):
+            row = int(np.searchsorted(times, end_))
+            apply({name: column[pos:row] for name, column in batch.items()})
+            sample(end_)
+            pos, end = row, end_ + step
+        apply({name: column[pos:] for name, column in batch.items()})
+
+    if time is not None:
+        sample(time if step is None else end)  # The last, partial interval
+    return {name: np.array([row.get(name) for row in rows]) for name in (rows[0] if rows else ['time', 'sequence'])}
+
+
+def write_features(features: dict, path: str):
+    """ Writes the columns of features to a feather file. """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    pyarrow.feather.write_feather(pa.table(features), path, compression='lz4')
+
+
+def extract_shard(shards: ShardManifest, entry: dict, reducers, out_dir, **extract_kwargs) -> str:
+    """ Extracts the features of a shard, see :py:func:`extract`, and returns the file they are written to. """
+    path = os.path.join(out_dir, entry['product'], entry['day'] + '.feather')
+    write_features(extract(*shards.paths(entry), deepcopy(reducers), **extract_kwargs), path)
+    return path
+
+
+def extract_shards(data_dir, reducers, out_dir, interval=None, products=None, cores=1, time_range=None,
+                   **extract_kwargs) -> list:
+    """
+    Extracts the features of the shards of products in a data directory with orders in the time range, cores shards
+    at a time in a pool of processes, and writes them to out_dir/<product>/<day>.feather.
+
+    Parameters
+    ----------
+    data_dir: str
+    reducers: list
+        :py:class:`Reducer`, copied to every shard
+    out_dir: str
+    interval: str
+        See :py:func:`extract`
+    products: list
+        All products if None
+    cores: int
+    time_range: tuple
+    extract_kwargs
+        Passed to :py:func:`extract`
+
+    Returns
+    -------
+    paths: list
+        The written files
+
+    """
+    shards = ShardManifest(data_dir)
+    entries = [entry for product in (products or shards.products) for entry in shards.shards(product, time_range)]
+    return Parallel(n_jobs=cores)(delayed(extract_shard)(shards, entry, reducers, out_dir, interval=interval,
+                                                         time_range=time_range, **extract_kwargs)
+                                  for entry in entries)
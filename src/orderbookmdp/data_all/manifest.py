@@ -0,0 +1,113 @@
+"""A manifest of the raw files that have been reformatted.
+
+:py:func:`orderbookmdp.data_all.reformat_data.reformat` records every raw file in data_dir/json/ it has converted
+together with its size and modification time, the options it was converted with and the hashes of the files it was
+converted to. A raw file is only converted again if it has changed, for example the file the downloader is still
+writing to, if it is converted with other options or if any of its outputs is missing or has changed. The manifest
+is saved after every converted file, so an interrupted reformat resumes with the files that were not converted.
+
+"""
+import hashlib
+import os
+
+import ujson
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def file_hash(path: str, chunk_size=2**20) -> str:
+    """ Returns the blake2b hash of the file at path. """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_entry(path: str) -> dict:
+    """ Returns the size and modification time of the raw file at path. """
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def output_entry(data_dir: str, outputs: list) -> dict:
+    """ Returns the hashes of the output files, given as paths relative to data_dir. """
+    return {output: file_hash(os.path.join(data_dir, output)) for output in outputs}
+
+
+class Manifest:
+    """
+    The manifest of a data directory, saved as data_dir/:py:data:`MANIFEST_FILE`.
+
+    The raw files are recorded per section, the directory they are converted to, as
+    {section: {raw file: {'size': int, 'mtime': int, 'options': dict, 'outputs': {output: hash}}}}.
+
+    Attributes
+    ----------
+    data_dir: str
+    path: str
+        Path of the manifest
+    entries: dict
+
+    """
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, MANIFEST_FILE)
+        self.entries = {}
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                self.entries = ujson.load(f)
+
+    def is_converted(self, section: str, name: str, verify=False, options=None) -> bool:
+        """
+        Returns True if the raw file name has been converted to section, with options if given and recorded, and
+        neither the raw file nor its outputs have changed since. The outputs are only checked to exist unless verify is
+        True, then they are hashed.
+
+        """
+        entry = self.entries.get(section, {}).get(name)
+        if entry is None or (options is not None and entry.get('options', options) != options):
+            return False
+        source = source_entry(os.path.join(self.data_dir, 'json', name))
+        if source['size'] != entry['size'] or source['mtime'] != entry['mtime']:
+            return False
+        for output, output_hash in entry['outputs'].items():
+            path = os.path.join(self.data_dir, output)
+            if not os.path.isfile(path) or (verify and file_hash(path) != output_hash):
+                return False
+        return True
+
+    def outputs(self, section: str, name: str) -> list:
+        """ Returns the outputs the raw file name was last converted to in section. """
+        entry = self.entries.get(section, {}).get(name)
+        return [] if entry is None else list(entry['outputs'])
+
+    def record(self, section: str, name: str, source: dict, outputs: dict, options=None):
+        """
+        Records that the raw file name was converted to the outputs in section and saves the manifest.
+
+        Parameters
+        ----------
+        section: str
+        name: str
+            Name of the raw file in data_dir/json/
+        source: dict
+            The size and modification time of the raw file before it was converted, see :py:func:`source_entry`
+        outputs: dict
+            The outputs and their hashes, see :py:func:`output_entry`
+        options: dict
+            The options the raw file was converted with
+
+        """
+        entry = dict(source, outputs=outputs)
+        if options is not None:
+            entry['options'] = options
+        self.entries.setdefault(section, {})[name] = entry
+        self.save()
+
+    def save(self):
+        """ Saves the manifest, the previous manifest is replaced only once the new one is written. """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            ujson.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,378 @@
+"""A columnar store of reformatted messages that is memory-mapped when read.
+
+Each order file is written as an uncompressed Arrow IPC file with the fixed width columns in :py:data:`COLUMNS`.
+The file is memory-mapped when it is opened, so reading a column within one row group is a zero copy view of the
+pages in the OS cache which is shared between all processes replaying the same file. Reading across row groups
+copies the rows into a new array, :py:meth:`MessageStore.batches` yields the views of each row group instead.
+Messages are sliced out as numpy arrays or yielded row by row as :py:class:`orderbookmdp.order_book.utils.Order`
+tuples without building a :py:class:`pandas.DataFrame`.
+:py:func:`read_messages` reads only some of the columns and only the row groups with messages in a time or sequence
+range.
+
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from orderbookmdp.order_book.constants import MESSAGE_TYPE_CODES
+from orderbookmdp.order_book.constants import ORDER_TYPE_CODES
+from orderbookmdp.order_book.constants import REASON_CODES
+from orderbookmdp.order_book.constants import SIDE_CODES
+from orderbookmdp.order_book.constants import UNKNOWN
+from orderbookmdp.order_book.utils import Order
+from orderbookmdp.order_book.utils import batch_rows
+from orderbookmdp.order_book.utils import time_bound
+from orderbookmdp.order_book.utils import to_nanoseconds
+
+EXTENSION = '.arrow'
+
+# Column name, numpy dtype and the value of missing entries
+COLUMNS = (('sequence', np.int64, -1),
+           ('type', np.int8, UNKNOWN),
+           ('order_type', np.int8, UNKNOWN),
+           ('reason', np.int8, UNKNOWN),
+           ('side', np.int8, UNKNOWN),
+           ('price', np.float64, np.nan),
+           ('size', np.int64, -1),
+           ('funds', np.float64, np.nan),
+           ('trader_id', np.int64, -1),
+           ('order_id_hi', np.uint64, 0),
+           ('order_id_lo', np.uint64, 0),
+           ('time', np.int64, -1))
+
+CODE_COLUMNS = (('type', MESSAGE_TYPE_CODES), ('order_type', ORDER_TYPE_CODES), ('reason', REASON_CODES),
+                ('side', SIDE_CODES))
+
+SCHEMA = pa.schema([(name, pa.from_numpy_dtype(dtype)) for name, dtype, _ in COLUMNS])
+# The schema of messages with the time kept as the exchange string
+STRING_TIME_SCHEMA = SCHEMA.set(SCHEMA.get_field_index('time'), pa.field('time', pa.string()))
+
+
+def range_mask(columns: dict, time_range=None, sequence_range=None) -> np.ndarray:
+    """
+    Returns which messages are in the time range [t0, t1) and the sequence range [s0, s1), None if no range is given.
+    Either bound of a range can be None.
+
+    Parameters
+    ----------
+    columns: dict
+        Column name to numpy array, with the 'time' column for a time range and the 'sequence' column for a sequence
+        range
+    time_range: tuple
+        (t0, t1), see :py:func:`orderbookmdp.order_book.utils.time_bound`
+    sequence_range: tuple
+        (s0, s1)
+
+    Returns
+    -------
+    mask: numpy.ndarray
+
+    """
+    bounds = []
+    if time_range is not None:
+        bounds.append((to_nanoseconds(columns['time']), time_bound(time_range[0]), time_bound(time_range[1])))
+    if sequence_range is not None:
+        bounds.append((np.asarray(columns['sequence']), sequence_range[0], sequence_range[1]))
+    if not bounds:
+        return None
+    mask = np.ones(len(bounds[0][0]), dtype=bool)
+    for values, low, high in bounds:
+        if low is not None:
+            mask &= values >= low
+        if high is not None:
+            mask &= values < high
+    return mask
+
+
+def store_columns(columns) -> list:
+    """ Returns the stored columns needed for columns, the order_id is stored as order_id_hi and order_id_lo. """
+    names = []
+    for name in columns:
+        for stored in (('order_id_hi', 'order_id_lo') if name == 'order_id' else (name,)):
+            if stored not in names:
+                names.append(stored)
+    return names
+
+
+def encode_message_codes(df: pd.DataFrame):
+    """
+    Encodes the type, order_type, reason and side columns of exchange messages as int8 codes in place,
+    see :py:mod:`orderbookmdp.order_book.constants`. Missing values and missing columns are set to UNKNOWN,
+    columns that already are integer codes are left as they are.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        The messages
+
+    """
+    for column, codes in CODE_COLUMNS:
+        if column not in df:
+            df[column] = np.int8(UNKNOWN)
+        elif not pd.api.types.is_integer_dtype(df[column]):
+            df[column] = df[column].map(codes).fillna(UNKNOWN).astype(np.int8)
+
+
+def split_order_ids(order_ids: pd.Series) -> (np.ndarray, np.ndarray):
+    """
+    Splits exchange order ids (UUID strings) into the high and low 64 bits of their 128-bit integer value.
+    Missing order ids are set to 0.
+
+    Parameters
+    ----------
+    order_ids: pandas.Series
+        The UUID strings of the orders
+
+    Returns
+    -------
+    order_id_hi, order_id_lo: numpy.ndarray
+        The high and low 64 bits as uint64
+
+    """
+    hexs = order_ids.fillna('0' * 32).str.replace('-', '', regex=False).values
+    order_id_hi = np.array([int(h[:16], 16) for h in hexs], dtype=np.uint64)
+    order_id_lo = np.array([int(h[16:], 16) for h in hexs], dtype=np.uint64)
+    return order_id_hi, order_id_lo
+
+
+def to_columns(df: pd.DataFrame, time_strings=False) -> dict:
+    """
+    Converts reformatted messages to the columns of the store. Missing columns and missing values are filled.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Reformatted messages, see :py:func:`orderbookmdp.data_all.reformat_data.reformat_messages`
+    time_strings: bool
+        If the time is kept as strings instead of parsed to epoch nanoseconds, see :py:func:`orderbookmdp.order_book.utils.to_nanoseconds`
+
+    Returns
+    -------
+    columns: dict
+        Column name to numpy array
+
+    """
+    columns = {}
+    for name, dtype, fill in COLUMNS:
+        if name == 'time' and time_strings:
+            times = df[name].fillna('') if name in df else pd.Series([''] * len(df))
+            columns[name] = times.astype(str).values.astype(object)
+        elif name not in df:
+            columns[name] = np.full(len(df), fill, dtype=dtype)
+        elif name == 'time':
+            columns[name] = to_nanoseconds(df[name].values)
+        else:
+            columns[name] = df[name].fillna(fill).values.astype(dtype)
+    return columns
+
+
+def write_messages(columns: dict, path: str):
+    """
+    Writes columns of messages to an uncompressed Arrow IPC file.
+
+    Parameters
+    ----------
+    columns: dict
+        Column name to numpy array, see :py:func:`to_columns`
+    path: str
+        Path of the file, should end with :py:data:`EXTENSION`
+
+    """
+    schema = STRING_TIME_SCHEMA if columns['time'].dtype == object else SCHEMA
+    with MessageWriter(path, schema=schema) as writer:
+        writer.write(columns)
+
+
+def read_messages(path: str, columns=None, time_range=None, sequence_range=None) -> dict:
+    """
+    Reads columns of the messages in the time range [t0, t1) and the sequence range [s0, s1) from an Arrow IPC file
+    of messages, uncompressed or compressed, see :py:class:`MessageWriter`. Only the columns asked for are read, and
+    the range columns are read first to skip the row groups without any message in the ranges, so the other columns
+    of those row groups are never read or decompressed. Columns of an uncompressed file are views of the
+    memory-mapped file only if all messages read are in a single row group and none of them are masked out, the row
+    groups are otherwise copied into new arrays.
+
+    Parameters
+    ----------
+    path: str
+    columns: list
+        The columns to read, all if None. 'order_id' reads order_id_hi and order_id_lo
+    time_range: tuple
+        (t0, t1), see :py:func:`range_mask`
+    sequence_range: tuple
+        (s0, s1)
+
+    Returns
+    -------
+    columns: dict
+        Column name to numpy array
+
+    """
+    source = pa.memory_map(path, 'r')
+    schema = pa.ipc.open_file(source).schema
+    names = schema.names if columns is None else store_columns(columns)
+    range_names = [name for name, bounds in (('time', time_range), ('sequence', sequence_range)) if bounds is not None]
+
+    def open_columns(column_names):
+        options = pa.ipc.IpcReadOptions(included_fields=[schema.get_field_index(name) for name in column_names])
+        return pa.ipc.open_file(source, options=options)
+
+    reader = open_columns(names)
+    range_reader = open_columns(range_names) if range_names else None
+    parts = []
+    for i in range(reader.num_record_batches):
+        mask = None
+        if range_reader is not None:
+            range_batch = range_reader.get_batch(i)
+            mask = range_mask({name: range_batch.column(name).to_numpy(zero_copy_only=False) for name in range_names},
+                              time_range, sequence_range)
+            if not mask.any():
+                continue
+        batch = reader.get_batch(i)
+        part = {name: batch.column(name).to_numpy(zero_copy_only=False) for name in names}
+        if mask is not None and not mask.all():
+            part = {name: column[mask] for name, column in part.items()}
+        parts.append(part)
+
+    if len(parts) == 1:
+        return parts[0]
+    if not parts:
+        return {name: np.empty(0, dtype=schema.field(name).type.to_pandas_dtype()) for name in names}
+    return {name: np.concatenate([part[name] for part in parts]) for name in names}
+
+
+class MessageWriter:
+    """
+    Writes messages to an Arrow IPC file with the schema :py:data:`SCHEMA`, or :py:data:`STRING_TIME_SCHEMA`, one row
+    group at a time, so that only the row group being written is held in memory.
+
+    Attributes
+    ----------
+    path: str
+        Path of the file
+    rows: int
+        Number of rows written
+    compression: str
+        Compression of the row groups, 'lz4' or 'zstd', None for uncompressed files that can be memory-mapped
+    compression_level: int
+        Level of the compression, the default of the codec if None
+
+    """
+    def __init__(self, path: str, compression=None, schema=SCHEMA, compression_level=None):
+        self.path = path
+        self.rows = 0
+        self.schema = schema
+        self.sink = pa.OSFile(path, 'wb')
+        codec = None if compression is None else pa.Codec(compression, compression_level=compression_level)
+        options = pa.ipc.IpcWriteOptions(compression=codec)
+        self.writer = pa.ipc.new_file(self.sink, schema, options=options)
+
+    def write(self, columns: dict):
+        """ Writes columns of messages, see :py:func:`to_columns`, as a row group. """
+        arrays = [pa.array(columns[field.name], type=field.type) for field in self.schema]
+        batch = pa.record_batch(arrays, schema=self.schema)
+        self.writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MessageStore:
+    """
+    A memory-mapped file of reformatted messages.
+
+    Attributes
+    ----------
+    path: str
+        Path of the file
+    table: pyarrow.Table
+        The messages, backed by the memory-mapped file
+    batch_starts: numpy.ndarray
+        The first row of each row group, followed by the number of rows
+
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.source = pa.memory_map(path, 'r')
+        self.table = pa.ipc.open_file(self.source).read_all()
+        self.batch_starts = np.cumsum([0] + [batch.num_rows for batch in self.table.to_batches()])
+
+    def __len__(self):
+        return self.table.num_rows
+
+    @property
+    def columns(self) -> list:
+        return self.table.column_names
+
+    def column(self, name: str, start=0, stop=None) -> np.ndarray:
+        """
+        Returns a column of the messages between row start and stop. Fixed width columns of rows within one row
+        group are returned as read only views of the memory-mapped file, rows across row groups are copied into a
+        new array.
+
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        chunks = self.table.column(name).slice(start, max(stop - start, 0))
+        array = chunks.chunk(0) if chunks.num_chunks == 1 else chunks.combine_chunks()
+        return array.to_numpy(zero_copy_only=False)
+
+    def slice(self, start=0, stop=None, columns=None) -> dict:
+        """
+        Returns the messages between row start and stop as column name to numpy array.
+
+        Parameters
+        ----------
+        start: int
+        stop: int
+        columns: list
+            The columns to return, all if None
+
+        Returns
+        -------
+        columns: dict
+
+        """
+        columns = self.columns if columns is None else columns
+        return {name: self.column(name, start, stop) for name in columns}
+
+    def batches(self, start=0, stop=None, columns=None):
+        """
+        Yields the messages between row start and stop one row group at a time, as column name to numpy array.
+        Fixed width columns are read only views of the memory-mapped file, none of the rows are copied.
+
+        Parameters
+        ----------
+        start: int
+        stop: int
+        columns: list
+            The columns to yield, all if None
+
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        batch_starts = self.batch_starts.tolist()
+        for batch_start, batch_stop in zip(batch_starts[:-1], batch_starts[1:]):
+            if batch_stop > start and batch_start < stop:
+                yield self.slice(max(start, batch_start), min(stop, batch_stop), columns)
+
+    def rows(self, start=0, stop=None, chunk_size=65536):
+        """
+        Yields the messages between row start and stop as :py:class:`orderbookmdp.order_book.utils.Order`. The columns are converted
+        chunk by chunk within each row group and the order ids are joined to their integer value.
+
+        """
+        names = [name for name in Order._fields if name != 'order_id'] + ['order_id_hi', 'order_id_lo']
+        for batch in self.batches(start, stop, names):
+            for chunk_start in range(0, len(batch['sequence']), chunk_size):
+                yield from batch_rows({name: column[chunk_start:chunk_start + chunk_size] for name, column in batch.items()})
+
+    def close(self):
+        self.table = None
+        self.source.close()
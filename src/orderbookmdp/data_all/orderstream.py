@@ -1,26 +1,65 @@
 import gc
-import os
+import logging
+import queue
 import random
-import re
+import threading
+import time
 from copy import deepcopy
+from functools import partial
 
 import numpy as np
-import pandas as pd
-import ujson
-from sortedcontainers.sortedlist import SortedList
+import pyarrow as pa
 import feather
 
-MESSAGE_TYPES = {'received', 'done', 'change'}
+from orderbookmdp.data_all.message_store import EXTENSION
+from orderbookmdp.data_all.message_store import MessageStore
+from orderbookmdp.data_all.message_store import encode_message_codes
+from orderbookmdp.data_all.message_store import range_mask
+from orderbookmdp.data_all.message_store import read_messages
+from orderbookmdp.data_all.message_store import split_order_ids
+from orderbookmdp.data_all.message_store import store_columns
+from orderbookmdp.data_all.message_store import to_columns
+from orderbookmdp.data_all.sequence_index import load_index
+from orderbookmdp.data_all.sequence_index import order_file_names
+from orderbookmdp.data_all.sequence_index import resume_snaps
+from orderbookmdp.data_all.sequence_index import sequence_gaps
+from orderbookmdp.data_all.sequence_index import snap_file_names
+from orderbookmdp.data_all.snapshots import is_binary_snap_path
+from orderbookmdp.data_all.snapshots import load_binary_snap
+from orderbookmdp.data_all.snapshots import load_json_snap
+from orderbookmdp.order_book.constants import M_CHANGE
+from orderbookmdp.order_book.constants import M_DONE
+from orderbookmdp.order_book.constants import M_RECEIVED
+from orderbookmdp.order_book.utils import batch_rows
+from orderbookmdp.order_book.utils import join_order_ids
 
+MESSAGE_TYPES = {M_RECEIVED, M_DONE, M_CHANGE}
 
-def load_orders(path):
+
+def is_message_file(path) -> bool:
+    """ Returns True if path is an Arrow IPC file with the columns of the message store, as written by reformat. """
+    with open(path, 'rb') as f:
+        if f.read(6) != b'ARROW1':
+            return False
+    return 'order_id_hi' in pa.ipc.open_file(pa.memory_map(path, 'r')).schema.names
+
+
+def load_orders(path, columns=None, time_range=None, sequence_range=None):
     """
-    Yields orders from a saved feather :py:class:`pandas.DataFrame`.
+    Yields orders from a saved feather :py:class:`pandas.DataFrame` or from a memory-mapped
+    :py:class:`orderbookmdp.data_all.message_store.MessageStore` if the path ends with its extension. The order ids
+    are joined back to their integer value, see :py:func:`join_order_ids`.
 
     Parameters
     ----------
     path: str
-        Path to the saved feather dataframe
+        Path to the saved feather dataframe or message store
+    columns: list
+        The columns to load, all if None, see :py:func:`load_columns`
+    time_range: tuple
+        Only the orders in the time range [t0, t1) are yielded
+    sequence_range: tuple
+        Only the orders in the sequence range [s0, s1) are yielded
 
     Yields
     -------
@@ -28,15 +67,399 @@ def load_orders(path):
         An external order from the dataframe
 
     """
+    if path.endswith(EXTENSION) and columns is None and time_range is None and sequence_range is None:
+        store = MessageStore(path)
+        yield from store.rows()
+        store.close()
+        return
+
+    if path.endswith(EXTENSION) or is_message_file(path):
+        yield from batch_rows(read_messages(path, columns, time_range, sequence_range))
+        return
 
-    # TODO, test appending multiple order dataframes for faster loading?
     df = feather.read_dataframe(path)
+    if 'order_id_hi' in df:
+        df['order_id'] = join_order_ids(df.pop('order_id_hi').values, df.pop('order_id_lo').values)
+    encode_message_codes(df)
+    mask = range_mask(df, time_range, sequence_range)
+    if mask is not None:
+        df = df[mask]
+    if columns is not None:
+        df = df[[column for column in columns if column in df]]
     for order in df.itertuples():
         yield order
 
 
+def load_columns(path, columns=None, time_range=None, sequence_range=None) -> dict:
+    """
+    Loads the orders of a saved feather :py:class:`pandas.DataFrame` or
+    :py:class:`orderbookmdp.data_all.message_store.MessageStore` as columns. Files written by reformat are read with
+    :py:func:`orderbookmdp.data_all.message_store.read_messages`, so only the columns asked for and the row groups
+    with orders in the ranges are read. Older feather dataframes are read whole and then selected from.
+
+    Parameters
+    ----------
+    path: str
+        Path to the saved feather dataframe or message store
+    columns: list
+        The columns to load, all if None. 'order_id' loads order_id_hi and order_id_lo
+    time_range: tuple
+        Only the orders in the time range [t0, t1) are loaded, see
+        :py:func:`orderbookmdp.data_all.message_store.range_mask`
+    sequence_range: tuple
+        Only the orders in the sequence range [s0, s1) are loaded
+
+    Returns
+    -------
+    columns: dict
+        Column name to numpy array, see :py:data:`orderbookmdp.data_all.message_store.COLUMNS`
+
+    """
+    if path.endswith(EXTENSION) or is_message_file(path):
+        return read_messages(path, columns, time_range, sequence_range)
+
+    df = feather.read_dataframe(path)
+    if 'order_id' in df:
+        df['order_id_hi'], df['order_id_lo'] = split_order_ids(df.pop('order_id'))
+    encode_message_codes(df)
+    all_columns = to_columns(df)
+    mask = range_mask(all_columns, time_range, sequence_range)
+    names = list(all_columns) if columns is None else store_columns(columns)
+    return {name: all_columns[name] if mask is None else all_columns[name][mask] for name in names}
+
+
+class Prefetcher:
+    """
+    Loads files in a background thread while the previously loaded files are consumed. At most buffer_size loaded
+    files are kept waiting in the buffer.
+
+    Attributes
+    ----------
+    stall_time: float
+        Total seconds the consumer has waited for a file to be loaded
+    files: int
+        Number of files consumed
+
+    """
+    _done = object()
+
+    def __init__(self, paths, load, buffer_size=1):
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.stopped = threading.Event()
+        self.stall_time = 0.0
+        self.files = 0
+        self.thread = threading.Thread(target=self._run, args=(list(paths), load), daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _run(self, paths, load):
+        try:
+            for path in paths:
+                if self.stopped.is_set():
+                    return
+                self._put((path, load(path)))
+        except Exception as e:  # Raised again in the consumer
+            self._put((None, e))
+        self._put((None, self._done))
+
+    def __iter__(self):
+        while True:
+            start = time.perf_counter()
+            path, data = self.queue.get()
+            self.stall_time += time.perf_counter() - start
+            if data is self._done:
+                return
+            if isinstance(data, Exception):
+                raise data
+            self.files += 1
+            yield path, data
+
+    def close(self):
+        self.stopped.set()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+
+def load_files(paths, load, prefetch=0, stats=None):
+    """
+    Yields the loaded files one by one, either loaded on demand or by a :py:class:`Prefetcher` buffering prefetch
+    files.
+
+    Parameters
+    ----------
+    paths: list
+        Paths to the files
+    load: callable
+        Loads a file from its path
+    prefetch: int
+        Number of files to load ahead in a background thread, 0 to load on demand
+    stats: dict
+        If given, 'stall_time', the total seconds waited for files, and 'files', the number of files, are updated
+
+    Yields
+    ------
+    path, data
+
+    """
+    if prefetch > 0:
+        prefetcher = Prefetcher(paths, load, prefetch)
+        stall_time = 0.0
+        try:
+            for path, data in prefetcher:
+                if stats is not None:
+                    stats['stall_time'] = stats.get('stall_time', 0.0) + prefetcher.stall_time - stall_time
+                    stats['files'] = stats.get('files', 0) + 1
+                logging.debug('Waited {:.3f}s for {}'.format(prefetcher.stall_time - stall_time, path))
+                stall_time = prefetcher.stall_time
+                yield path, data
+                del data
+        finally:
+            prefetcher.close()
+    else:
+        for path in paths:
+            start = time.perf_counter()
+            gc.collect()
+            data = load(path)
+            stall_time = time.perf_counter() - start
+            if stats is not None:
+                stats['stall_time'] = stats.get('stall_time', 0.0) + stall_time
+                stats['files'] = stats.get('files', 0) + 1
+            logging.debug('Waited {:.3f}s for {}'.format(stall_time, path))
+            yield path, data
+            del data
+
+
+def list_files(order_paths, snapshot_paths) -> (list, list, np.ndarray):
+    """
+    Lists the order files sorted by number and the snapshot files with their sequences.
+
+    Returns
+    -------
+    order_files, snap_files, snap_sequences
+
+    """
+    order_files = order_file_names(order_paths)
+    snap_files, snap_sequences = snap_file_names(snapshot_paths)
+    return order_files, snap_files, snap_sequences
+
+
+def file_sequences(order_file) -> (int, int):
+    """ Returns the first and last sequence of an order file from its name, number_first_last. """
+    _, first, last = order_file.split('.')[0].split('_')
+    return int(first), int(last)
+
+
+def time_range_sequences(order_paths, order_files, time_range) -> (int, int):
+    """
+    Returns the sequence range [s0, s1) of the orders in the time range [t0, t1), the first sequences at or after t0
+    and t1. Only the sequence and time columns of the order files up to t1 are read. A bound after the last order
+    is returned as the largest int64 and a bound that is None as None.
+
+    """
+    bounds, k = [], 0
+    for bound in time_range:
+        if bound is None:
+            bounds.append(None)
+            continue
+        sequence = np.iinfo(np.int64).max
+        for k in range(k, len(order_files)):
+            sequences = load_columns(order_paths + order_files[k], ['sequence'], time_range=(bound, None))['sequence']
+            if len(sequences) > 0:
+                sequence = int(sequences.min())
+                break
+        bounds.append(sequence)
+    return tuple(bounds)
+
+
+def stream_range(order_paths, order_files, time_range=None, sequence_range=None) -> (int, int):
+    """
+    Returns the sequence range [s0, s1) an order stream is limited to, the intersection of the sequence range and
+    the sequences of the time range, see :py:func:`time_range_sequences`, or None if neither is given. Episodes start
+    from the last snapshot at or before s0 so that the book is complete, and end before s1.
+
+    """
+    if time_range is None:
+        return None if sequence_range is None else tuple(sequence_range)
+    starts, stops = zip(*[bounds for bounds in (time_range_sequences(order_paths, order_files, time_range),
+                                                sequence_range) if bounds is not None])
+    starts = [start for start in starts if start is not None]
+    stops = [stop for stop in stops if stop is not None]
+    return max(starts) if starts else None, min(stops) if stops else None
+
+
+def episode_files(order_files, snap_files, snap_sequences, random_start, index=None,
+                  sequence_range=None) -> (str, list, int):
+    """
+    Returns the snapshot file to start an episode from, the order files to replay after it and the row to start
+    from in the first order file. Either the first snapshot or a random one is chosen. A random start seeks directly
+    to the first relevant order if the order files have a :py:class:`orderbookmdp.data_all.sequence_index.SequenceIndex`.
+
+    With a sequence range [s0, s1), either bound can be None, the episode starts from the last snapshot at or before
+    s0, or the first snapshot if there is none, or with random_start from a random snapshot in the range.
+
+    """
+    if sequence_range is not None:
+        return range_episode_files(order_files, snap_files, snap_sequences, random_start, index, sequence_range)
+
+    if random_start and index is not None:
+        snap_sequence = index.random_snap(snap_sequences)
+        k, start_row = index.locate_snap(snap_sequence)
+        snap_file = snap_files[int(np.flatnonzero(snap_sequences == snap_sequence)[0])]
+        return snap_file, index.files[k:], start_row
+
+    if random_start:
+        snap_file = random.choice(snap_files)
+        snap_seq = ''.join(filter(str.isdigit, snap_file))
+        order_files_ = []
+        for order_file in order_files:
+            max_order_file_seq = int(order_file.split('_')[2].split('.')[0])
+            if max_order_file_seq >= int(snap_seq):
+                order_files_.append(order_file)
+    else:
+        snap_file = snap_files[0]
+        order_files_ = deepcopy(order_files)
+    return snap_file, order_files_, 0
+
+
+def range_episode_files(order_files, snap_files, snap_sequences, random_start, index,
+                        sequence_range) -> (str, list, int):
+    """ Returns the files of an episode in a sequence range, see :py:func:`episode_files`. """
+    start, stop = sequence_range
+    if random_start:
+        in_range = np.ones(len(snap_sequences), dtype=bool)
+        if start is not None:
+            in_range &= snap_sequences >= start
+        if stop is not None:
+            in_range &= snap_sequences < stop
+        if not in_range.any():
+            raise ValueError('No snapshot in the sequence range {}'.format(sequence_range))
+        if index is not None:
+            snap_sequence = index.random_snap(snap_sequences[in_range])
+        else:
+            snap_sequence = int(random.choice(snap_sequences[in_range].tolist()))
+    else:
+        before = snap_sequences[snap_sequences <= start] if start is not None else snap_sequences[:0]
+        snap_sequence = int(before.max()) if len(before) > 0 else int(snap_sequences[0])
+    snap_file = snap_files[int(np.flatnonzero(snap_sequences == snap_sequence)[0])]
+
+    if index is not None:
+        k, start_row = index.locate_snap(snap_sequence)
+        return snap_file, index.files[k:] if k >= 0 else [], start_row
+    return snap_file, [order_file for order_file in order_files if file_sequences(order_file)[1] >= snap_sequence], 0
+
+
+def load_snap(path) -> dict:
+    """ Loads a level 3 json snapshot or a binary snapshot, see :py:mod:`orderbookmdp.data_all.snapshots`. """
+    if is_binary_snap_path(path):
+        return load_binary_snap(path)
+    return load_json_snap(path)
+
+
+def episode_segments(order_paths, order_files_, start_row, snap, snapshot_paths, snap_files, snap_sequences,
+                     max_sequence_skip=1, random_start=False, index=None, prefetch=0, stats=None, columns=None,
+                     stop_sequence=None):
+    """
+    Yields the orders of an episode as segments of columns without a gap larger than max_sequence_skip in their
+    sequence. At such a gap the snapshot to resume from is yielded, or the episode ends if it started at a random
+    snapshot or there is no later snapshot. The gaps are read from the
+    :py:class:`orderbookmdp.data_all.sequence_index.SequenceIndex` if the order files have one, otherwise they are
+    found when a file is loaded, so the orders are never compared one by one.
+
+    Parameters
+    ----------
+    order_paths: str
+        Path to the orders
+    order_files_: list
+        The order files of the episode, see :py:func:`episode_files`
+    start_row: int
+        The row to start from in the first order file
+    snap: dict
+        The snapshot the episode starts from
+    snapshot_paths: str
+        Path to the snapshots
+    snap_files: list
+    snap_sequences: numpy.ndarray
+    max_sequence_skip: int
+    random_start: bool
+    index: SequenceIndex
+    prefetch: int
+        Number of order files to load ahead in a background thread, see :py:func:`load_files`
+    stats: dict
+        Updated with the time waited for order files, see :py:func:`load_files`, and the number of 'gaps'
+    columns: list
+        The columns to load, see :py:func:`load_columns`, all if None. The sequence and type are always loaded
+    stop_sequence: int
+        The episode ends before the first order with at least stop_sequence, or at a gap with no snapshot before
+        it to resume from. The order files after it are not loaded and only the row groups before it are read from
+        the last one
+
+    Yields
+    -------
+        columns: dict, snapshot: dict
+            Either a segment of column name to numpy array, which can start with orders already in the snapshot,
+            with the snapshot as None or the snapshot to resume from with the columns as None.
+
+    """
+    snap_sequence = snap['sequence']
+    prev_sequence = snap_sequence
+    load = load_columns
+    if columns is not None or stop_sequence is not None:
+        load_names = None if columns is None else store_columns(['sequence', 'type'] + list(columns))
+        load = partial(load_columns, columns=load_names, sequence_range=None if stop_sequence is None else (None, stop_sequence))
+        if stop_sequence is not None:
+            order_files_ = [order_file for order_file in order_files_ if file_sequences(order_file)[0] < stop_sequence]
+    snap_file_sequences = dict(zip(snap_files, snap_sequences.tolist()))
+    paths = [order_paths + order_file for order_file in order_files_]
+    for n, (_, columns) in enumerate(load_files(paths, load, prefetch, stats)):
+        sequences = columns['sequence']
+        start = start_row if n == 0 else 0
+        k = None if index is None else index.file_numbers.get(order_files_[n])
+        if k is None:
+            rows, sizes = sequence_gaps(sequences, prev_sequence)
+            snaps, names = resume_snaps(sequences[rows], snap_sequences), snap_files
+        else:
+            (rows, sizes, snaps), names = index.gaps(k), index.snap_files
+            in_file = rows < len(sequences)  # The file can end early at stop_sequence
+            rows, sizes, snaps = rows[in_file], sizes[in_file], snaps[in_file]
+        resume_files = [names[snap_k] if snap_k >= 0 else None for snap_k in snaps.tolist()]
+        if n == 0 and start < len(sequences):  # The first order after the snapshot follows the snapshot
+            snap_k = resume_snaps(sequences[start:start + 1], snap_sequences)[0]
+            rows = np.append(start, rows)
+            sizes = np.append(sequences[start] - snap_sequence, sizes)
+            resume_files.insert(0, snap_files[snap_k] if snap_k >= 0 else None)
+
+        pos = start
+        for row, size, resume_file in zip(rows.tolist(), sizes.tolist(), resume_files):
+            sequence = int(sequences[row])
+            gap = sequence - max(sequence - size, snap_sequence)  # Orders up to the snapshot are not missed
+            if row < pos or sequence <= snap_sequence or gap <= max_sequence_skip:
+                continue
+            if row > pos:
+                yield {name: column[pos:row] for name, column in columns.items()}, None
+            logging.info('Gap of {} sequences before sequence {}'.format(gap, sequence))
+            if stats is not None:
+                stats['gaps'] = stats.get('gaps', 0) + 1
+            if random_start or resume_file is None or \
+                    (stop_sequence is not None and snap_file_sequences[resume_file] >= stop_sequence):
+                return
+            snap = load_snap(snapshot_paths + resume_file)
+            snap_sequence = snap['sequence']
+            yield None, snap
+            pos = row + 1
+        if pos < len(sequences):
+            yield {name: column[pos:] for name, column in columns.items()}, None
+        prev_sequence = sequences[-1] if len(sequences) > 0 else prev_sequence
+
+
 def orderstream(order_paths='../../../data/feather/', snapshot_paths='../../../data/snap_json/', max_sequence_skip=1,
-                random_start=False, **kwargs):
+                random_start=False, prefetch=0, stats=None, columns=None, time_range=None, sequence_range=None, **kwargs):
     """
     Generates a stream of orders, either a snapshot of the order book is returned when a disruption in the order stream
     happens or the next order is yielded.
@@ -47,6 +470,17 @@ def orderstream(order_paths='../../../data/feather/', snapshot_paths='../../../d
         Path to the orders
     snapshot_paths: str
         Path to the snapshots
+    prefetch: int
+        Number of order files to load ahead in a background thread, see :py:func:`load_files`
+    stats: dict
+        Updated with the time waited for order files and the number of gaps, see :py:func:`episode_segments`
+    columns: list
+        The columns to load, see :py:func:`load_columns`, the fields of other columns are None. A stream sent to a
+        market needs the columns of :py:func:`orderbookmdp.order_book.utils.market_columns`
+    time_range: tuple
+        Limits the episodes to the orders in the time range [t0, t1), see :py:func:`stream_range`
+    sequence_range: tuple
+        Limits the episodes to the orders in the sequence range [s0, s1)
 
     Yields
     -------
@@ -55,81 +489,150 @@ def orderstream(order_paths='../../../data/feather/', snapshot_paths='../../../d
 
 
     """
+    order_files, snap_files, snap_sequences = list_files(order_paths, snapshot_paths)
+    index = load_index(order_paths)
+    sequence_range = stream_range(order_paths, order_files, time_range, sequence_range)
+    stop_sequence = None if sequence_range is None else sequence_range[1]
 
-    order_paths = order_paths
-    snapshot_paths = snapshot_paths
-    order_files = os.listdir(order_paths)
-    snap_files = os.listdir(snapshot_paths)
+    while True:
+        snap_file, order_files_, start_row = episode_files(order_files, snap_files, snap_sequences, random_start, index,
+                                                           sequence_range)
 
-    order_files = SortedList(order_files, key=lambda x: int(x.split('_')[0]))
+        snap = load_snap(snapshot_paths + snap_file)
+        snap_sequence = snap['sequence']
+
+        yield None, snap
+
+        for batch, snap in episode_segments(order_paths, order_files_, start_row, snap, snapshot_paths, snap_files,
+                                            snap_sequences, max_sequence_skip, random_start, index, prefetch, stats,
+                                            columns, stop_sequence):
+            if snap is not None:
+                snap_sequence = snap['sequence']
+                yield None, snap
+                continue
+            for order in batch_rows(batch):
+                if order.sequence > snap_sequence and order.type in MESSAGE_TYPES:  # Else already in the snapshot
+                    yield order, None
 
-    snap_files = sorted(snap_files)
-    snap_files_ = []
-    min_order_files_seq = int(order_files[0].split('_')[1])
-    for snap_file in snap_files:
-        snap_seq_ = int(''.join(filter(str.isdigit, snap_file)))
-        if snap_seq_ > min_order_files_seq:
-            snap_files_.append(snap_file)
 
-    snap_files = snap_files
-    snap_sequences = np.array([int(re.search(r'\d+', snap_sequence).group()) for snap_sequence in snap_files])
+def orderstream_batches(order_paths='../../../data/feather/', snapshot_paths='../../../data/snap_json/',
+                        max_sequence_skip=1, random_start=False, batch_size=65536, prefetch=0, stats=None,
+                        columns=None, time_range=None, sequence_range=None, **kwargs):
+    """
+    Generates the same stream as :py:func:`orderstream` but in batches of orders given as columns, which can be sent
+    to a market with send_messages. A batch ends at every disruption in the order stream, where the snapshot is
+    yielded.
+
+    Parameters
+    ----------
+    order_paths: str
+        Path to the orders
+    snapshot_paths: str
+        Path to the snapshots
+    batch_size: int
+        Maximum number of orders in a batch
+    prefetch: int
+        Number of order files to load ahead in a background thread, see :py:func:`load_files`
+    stats: dict
+        Updated with the time waited for order files and the number of gaps, see :py:func:`episode_segments`
+    columns: list
+        The columns to load, see :py:func:`load_columns`, the sequence and type are always loaded. A stream sent to
+        a market needs the columns of :py:func:`orderbookmdp.order_book.utils.market_columns`
+    time_range: tuple
+        Limits the episodes to the orders in the time range [t0, t1), see :py:func:`stream_range`
+    sequence_range: tuple
+        Limits the episodes to the orders in the sequence range [s0, s1)
+
+    Yields
+    -------
+        batch: dict, snapshot: dict
+            The first yield will have a snapshot. Then batches of column name to numpy array will be yielded with
+            the snapshot as None.
 
-    random_start = random_start
-    max_seq_skip = max_sequence_skip
+    """
+    order_files, snap_files, snap_sequences = list_files(order_paths, snapshot_paths)
+    index = load_index(order_paths)
+    message_types = np.array(sorted(MESSAGE_TYPES), dtype=np.int8)
+    sequence_range = stream_range(order_paths, order_files, time_range, sequence_range)
+    stop_sequence = None if sequence_range is None else sequence_range[1]
 
     while True:
-        if random_start:
-            snap_file = random.choice(snap_files)
-            snap_seq = ''.join(filter(str.isdigit, snap_file))
-            order_files_ = []
-            for order_file in order_files:
-                max_order_file_seq = int(order_file.split('_')[2].split('.')[0])
-                if max_order_file_seq >= int(snap_seq):
-                    order_files_.append(order_file)
-            order_files_ = order_files_
-        else:
-            snap_file = snap_files[0]
-            order_files_ = deepcopy(order_files)
+        snap_file, order_files_, start_row = episode_files(order_files, snap_files, snap_sequences, random_start, index,
+                                                           sequence_range)
 
-        with open(snapshot_paths + snap_file) as f:
-            snap = ujson.load(f)
+        snap = load_snap(snapshot_paths + snap_file)
         snap_sequence = snap['sequence']
-        prev_order_seq = snap_sequence
 
         yield None, snap
 
-        break_ = False
-        for order_file in order_files_:
-            orders = load_orders(order_paths + order_file)
-            for order in orders:
-                if order.sequence < snap_sequence:
-                    pass
-                else:
-                    if order.sequence - prev_order_seq > max_seq_skip:
-                        print('To large gap', order.sequence - prev_order_seq)
-
-                        if random_start:
-                            break_ = True
-                            break
-                        else:
-                            snap_seq_k = (snap_sequences >= order.sequence).argmax()
-                            snap_file = snap_files[snap_seq_k]
-                            with open(snapshot_paths + snap_file) as f:
-                                snap = ujson.load(f)
-                            snap_sequence = snap['sequence']
-                            yield None, snap
-                    else:
-                        if order.type in MESSAGE_TYPES:
-                            yield order, None
-                prev_order_seq = order.sequence
-            gc.collect()
-            if break_:
+        for segment, snap in episode_segments(order_paths, order_files_, start_row, snap, snapshot_paths, snap_files,
+                                              snap_sequences, max_sequence_skip, random_start, index, prefetch, stats,
+                                              columns, stop_sequence):
+            if snap is not None:
+                snap_sequence = snap['sequence']
+                yield None, snap
+                continue
+            for start in range(0, len(segment['sequence']), batch_size):
+                batch = {name: column[start:start + batch_size] for name, column in segment.items()}
+                keep = (batch['sequence'] > snap_sequence) & np.isin(batch['type'], message_types)
+                if keep.any():
+                    yield {name: column[keep] for name, column in batch.items()}, None
+
+
+def fast_forward(market, batches, until_time=None, until_sequence=None, stats=None):
+    """
+    Applies the batches of a stream from :py:func:`orderstream_batches` to an external market up to the first order
+    at or after until_time or until_sequence, without trades or quote checks, see the fast_forward method of the
+    external markets. The market is resynced to the snapshots in the stream, see resync_snap, which also fills an
+    empty market from the first one.
+
+    Parameters
+    ----------
+    market: ExternalMarket or CyExternalMarket
+    batches: generator
+        The stream, which is continued from the returned item
+    until_time
+        See :py:func:`orderbookmdp.order_book.utils.stop_row`
+    until_sequence: int
+    stats: dict
+        Updated with the number of 'messages' applied and the 'seconds' it took
+
+    Returns
+    -------
+    item: tuple
+        The (batch, snapshot) to continue the stream with, the rest of the batch with the bound, a snapshot at or
+        after until_sequence or the snapshot of the next episode of the stream, or None if the stream ended
+
+    """
+    item = None
+    sequence = None
+    messages = 0
+    t = time.perf_counter()
+    for batch, snap in batches:
+        if snap is not None:
+            if (sequence is not None and snap['sequence'] <= sequence) or \
+                    (until_sequence is not None and snap['sequence'] >= until_sequence):
+                item = None, snap
                 break
+            market.resync_snap(snap)
+            sequence = snap['sequence']
+            continue
+        stop = market.fast_forward(batch, until_time, until_sequence)
+        messages += stop
+        if stop < len(batch['sequence']):
+            item = {name: column[stop:] for name, column in batch.items()}, None
+            break
+        sequence = batch['sequence'][-1]
+    seconds = time.perf_counter() - t
 
+    logging.info('Fast forwarded {} messages, {:.0f} messages/s'.format(messages, messages / max(seconds, 1e-9)))
+    if stats is not None:
+        stats['messages'] = stats.get('messages', 0) + messages
+        stats['seconds'] = stats.get('seconds', 0) + seconds
+    return item
 
-if __name__ == '__main__':
-    import time
 
+if __name__ == '__main__':
     start_order_id = None
     start_order_type = None
     start_order_init = False
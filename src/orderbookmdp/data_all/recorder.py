@@ -0,0 +1,201 @@
+"""Recording of the raw exchange messages.
+
+The websocket thread of :py:class:`orderbookmdp.data_all.download_gdax.DownloadWebsocketClient` only hands each message
+to a :py:class:`Recorder` through a bounded queue. A writer thread serializes the messages and writes them in blocks
+to compressed files in data_dir/json/, which :py:func:`orderbookmdp.data_all.reformat_data.reformat` reads with
+:py:func:`open_raw`. The compression is done by pyarrow, zstd is preferred and lz4 or gzip are fallen back to if
+pyarrow is built without it.
+
+"""
+import io
+import logging
+import queue
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+import ujson
+
+COMPRESSION_EXTENSIONS = {'zstd': '.zst', 'lz4': '.lz4', 'gzip': '.gz', 'bz2': '.bz2'}
+FALLBACK_COMPRESSIONS = ('zstd', 'lz4', 'gzip')
+
+
+def raw_compression(compression='zstd'):
+    """ Returns compression if pyarrow supports it, else the first supported fallback, None for no compression. """
+    if compression is None:
+        return None
+    for codec in (compression,) + FALLBACK_COMPRESSIONS:
+        if codec in COMPRESSION_EXTENSIONS and pa.Codec.is_available(codec):
+            return codec
+    return None
+
+
+def raw_extension(compression) -> str:
+    """ Returns the extension added to raw files compressed with compression. """
+    return COMPRESSION_EXTENSIONS[compression] if compression is not None else ''
+
+
+def path_compression(path: str) -> str:
+    """ Returns the compression of a file by its extension, None if it is not compressed. """
+    return next((codec for codec, ext in COMPRESSION_EXTENSIONS.items() if path.endswith(ext)), None)
+
+
+def write_compressed(path: str, data: bytes, level=None):
+    """ Writes data to path compressed at level by the compression of its extension, see :py:func:`path_compression`. """
+    compression = path_compression(path)
+    if compression is not None:
+        data = pa.Codec(compression, compression_level=level).compress(data, asbytes=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def read_compressed(path: str) -> bytes:
+    """ Reads a file written by :py:func:`write_compressed` or :py:func:`open_raw` and returns its data. """
+    compression = path_compression(path)
+    if compression is None:
+        with open(path, 'rb') as f:
+            return f.read()
+    with pa.input_stream(path, compression=compression) as f:
+        return f.read()
+
+
+def open_raw(path: str, mode='r'):
+    """
+    Opens a raw file of messages or snapshots as text, compressed or not depending on its extension.
+
+    Parameters
+    ----------
+    path: str
+    mode: str
+        'r' or 'w'
+
+    Returns
+    -------
+    file: io.TextIOWrapper
+
+    """
+    compression = path_compression(path)
+    if compression is None:
+        return open(path, mode)
+    if mode == 'r':
+        return io.TextIOWrapper(pa.input_stream(path, compression=compression), encoding='utf-8')
+    return io.TextIOWrapper(pa.output_stream(path, compression=compression), encoding='utf-8')
+
+
+def raw_file_time(name: str) -> pd.Timestamp:
+    """ Returns the time a raw file was started from its name, day_month_year_hour_minute_second_(mess|snaps).json. """
+    return pd.to_datetime('_'.join(name.split('_')[:6]), format='%d_%m_%Y_%H_%M_%S')
+
+
+class Recorder:
+    """
+    Writes messages to compressed files in a writer thread. The messages are written in blocks of about block_size
+    bytes, or after flush_interval seconds without messages, and a new file is started every rotate_messages
+    messages, named by the time of its first message.
+
+    Attributes
+    ----------
+    data_dir: str
+    compression: str
+        The compression used, see :py:func:`raw_compression`
+    messages: int
+        Number of messages written
+    bytes: int
+        Number of uncompressed bytes written
+    stall_time: float
+        Total seconds :py:meth:`write` has waited for room in the queue
+    files: list
+        Names of the files written
+
+    """
+    _stop = object()
+
+    def __init__(self, data_dir, compression='zstd', queue_size=100000, block_size=2**20, rotate_messages=5000000,
+                 flush_interval=1.0):
+        self.data_dir = data_dir
+        self.compression = raw_compression(compression)
+        self.block_size = block_size
+        self.rotate_messages = rotate_messages
+        self.flush_interval = flush_interval
+        self.messages = 0
+        self.bytes = 0
+        self.stall_time = 0.0
+        self.files = []
+        self.error = None
+        self.file = None
+        self.file_messages = 0
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, msg: dict):
+        """ Queues a message to be written, waits if the queue is full. """
+        if self.error is not None:
+            raise self.error
+        try:
+            self.queue.put_nowait(msg)
+        except queue.Full:
+            start = time.perf_counter()
+            while True:
+                try:
+                    self.queue.put(msg, timeout=0.1)
+                    break
+                except queue.Full:
+                    if self.error is not None:
+                        raise self.error
+            self.stall_time += time.perf_counter() - start
+
+    def close(self):
+        """ Writes the queued messages and closes the file. """
+        if self.thread.is_alive():
+            self.queue.put(self._stop)
+            self.thread.join()
+
+    def _rotate(self, msg):
+        if self.file is not None:
+            self.file.close()
+        name = pd.to_datetime(msg['time']).strftime('%d_%m_%Y_%H_%M_%S') + '_mess.json' + raw_extension(self.compression)
+        logging.info('changes file to {}, message count: {}'.format(name, self.messages))
+        self.file = open_raw(self.data_dir + name, 'w')
+        self.files.append(name)
+        self.file_messages = 0
+
+    def _flush(self, lines):
+        if lines:
+            self.file.write(''.join(lines))
+            self.file.flush()
+
+    def _run(self):
+        lines, size = [], 0
+        try:
+            while True:
+                try:
+                    msg = self.queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    self._flush(lines)
+                    lines, size = [], 0
+                    continue
+                if msg is self._stop:
+                    break
+                if self.file is None or self.file_messages == self.rotate_messages:
+                    if self.file is not None:
+                        self._flush(lines)
+                        lines, size = [], 0
+                    self._rotate(msg)
+                line = ujson.dumps(msg) + '\n'
+                lines.append(line)
+                size += len(line)
+                self.file_messages += 1
+                self.messages += 1
+                self.bytes += len(line)
+                if size >= self.block_size:
+                    self._flush(lines)
+                    lines, size = [], 0
+            self._flush(lines)
+        except Exception as e:  # Raised again in the websocket thread
+            logging.exception('recorder failed')
+            self.error = e
+        finally:
+            if self.file is not None:
+                self.file.close()
@@ -1,7 +1,5 @@
-import gc
 import os
 
-import feather
 import numpy as np
 import pandas as pd
 import ujson
@@ -9,33 +7,116 @@ from sortedcontainers.sortedlist import SortedList
 from tqdm import tqdm
 from joblib import Parallel, delayed
 
+from orderbookmdp.data_all.checkpoints import write_checkpoints
+from orderbookmdp.data_all.manifest import Manifest
+from orderbookmdp.data_all.manifest import output_entry
+from orderbookmdp.data_all.manifest import source_entry
+from orderbookmdp.data_all.message_store import EXTENSION
+from orderbookmdp.data_all.message_store import SCHEMA
+from orderbookmdp.data_all.message_store import STRING_TIME_SCHEMA
+from orderbookmdp.data_all.message_store import MessageWriter
+from orderbookmdp.data_all.message_store import encode_message_codes
+from orderbookmdp.data_all.message_store import split_order_ids
+from orderbookmdp.data_all.message_store import to_columns
+from orderbookmdp.data_all.recorder import open_raw
+from orderbookmdp.data_all.recorder import raw_extension
+from orderbookmdp.data_all.recorder import raw_file_time
+from orderbookmdp.data_all.sequence_index import build_index
+from orderbookmdp.data_all.snapshots import binary_snap_name
+from orderbookmdp.data_all.snapshots import save_binary_snap
+from orderbookmdp.data_all.snapshots import save_json_snap
+from orderbookmdp.data_all.snapshots import snap_to_arrays
 
-def save_snaps_from_file_path(data_dir, snapfile):
-    with open(data_dir + '/json/' + snapfile, 'r') as f:
-        snaps = f.readlines()
-        for snap in snaps:
+MESSAGE_KEYS = {'order_type', 'reason', 'sequence', 'side', 'size', 'new_size', 'type', 'price', 'funds', 'order_id',
+                'time'}
+
+
+def save_snaps_from_file_path(data_dir, snapfile, binary=False, price_dec=2, lot_dec=8, compression=None,
+                              level=None) -> list:
+    """
+    Saves the snapshots in data_dir/json/snapfile, compressed with compression at level, see
+    :py:mod:`orderbookmdp.data_all.snapshots`, and returns their paths relative to data_dir.
+
+    """
+    outputs = []
+    with open_raw(data_dir + '/json/' + snapfile) as f:
+        for snap in f:
             snap = ujson.loads(snap)
             try:
                 seq = snap['sequence']
-                path = data_dir + '/snap_json/snap_' + str(seq) + '.json'
-                if not os.path.isfile(path):
-                    with open(path, 'w') as snapf:
-                        ujson.dump(snap, snapf)
+                output = 'snap_json/snap_' + str(seq) + '.json' + raw_extension(compression)
+                if not os.path.isfile(data_dir + '/' + output):
+                    save_json_snap(snap, data_dir + '/' + output, level)
+                outputs.append(output)
+                output = 'snap_bin/' + binary_snap_name(seq, compression)
+                if binary:
+                    if not os.path.isfile(data_dir + '/' + output):
+                        save_binary_snap(snap_to_arrays(snap, price_dec, lot_dec), data_dir + '/' + output, level)
+                    outputs.append(output)
             except:  # noqa
                 pass
+    return outputs
 
 
-def reformat_messages(data_dir, k, keys, price_dec, messfile):
-    messages = []
-    with open(data_dir + '/json/' + messfile, 'r') as f:
-        mess = f.readlines()
-        for m in mess:
-            ms = ujson.loads(m)
-            ms = {k: v for k, v in ms.items() if k in keys}
-            messages.append(ms)
+def convert(function, data_dir, name, *args) -> (str, dict, dict):
+    """
+    Converts the raw file data_dir/json/name with function(data_dir, *args), which returns the paths of its outputs
+    relative to data_dir. Returns name, the size and modification time of the raw file before it was converted and
+    the hashes of the outputs, see :py:class:`orderbookmdp.data_all.manifest.Manifest`.
+
+    """
+    source = source_entry(data_dir + '/json/' + name)
+    outputs = function(data_dir, *args)
+    return name, source, output_entry(data_dir, outputs)
+
+
+def to_lots(sizes: pd.Series, lot_dec: int) -> np.ndarray:
+    """
+    Converts sizes to integer lots of 10**-lot_dec. Missing sizes are set to -1.
+
+    Parameters
+    ----------
+    sizes: pandas.Series
+        The sizes as strings or floats
+    lot_dec: int
+        Number of decimals in the lot size
+
+    Returns
+    -------
+    lots: numpy.ndarray
+        The sizes as int64 lots
 
+    """
+    lots = np.round(sizes.astype(float).values * 10**lot_dec)
+    lots[np.isnan(lots)] = -1
+    return lots.astype(np.int64)
+
+
+def messages_to_columns(messages: list, price_dec=2, lot_dec=8, time_strings=False) -> dict:
+    """
+    Converts parsed exchange messages to the columns of the message store, see
+    :py:func:`orderbookmdp.data_all.message_store.to_columns`.
+
+    Parameters
+    ----------
+    messages: list
+        The messages as dicts
+    price_dec: int
+        Number of decimals in the tick size
+    lot_dec: int
+        Number of decimals in the lot size
+    time_strings: bool
+        If the time is kept as the exchange string instead of parsed to epoch nanoseconds
+
+    Returns
+    -------
+    columns: dict
+        Column name to numpy array
+
+    """
     df = pd.DataFrame(messages)
-    del messages
+    if 'new_size' in df:  # Change messages carry the new size of the order as new_size
+        df['size'] = df['size'].fillna(df.pop('new_size')) if 'size' in df else df.pop('new_size')
     try:
         df['funds'] = df['funds'].astype(float)
     except KeyError:
@@ -45,54 +126,223 @@ def reformat_messages(data_dir, k, keys, price_dec, messfile):
     except KeyError:
         pass
     try:
-        df['size'] = df['size'].astype(float)
+        df['size'] = to_lots(df['size'], lot_dec)
     except KeyError:
         pass
 
-    df.replace('sell', 1, inplace=True)
-    df.replace('buy', 0, inplace=True)
-    df.side = df.side.fillna(-1)
-    df.side = df.side.astype(int)
+    encode_message_codes(df)
     df['trader_id'] = -1
-    # df.time = pd.to_datetime(df.time)
-    df.loc[df['size'].isnull(), 'size'] = -1
+    if 'order_id' in df:
+        df['order_id_hi'], df['order_id_lo'] = split_order_ids(df.pop('order_id'))
+    return to_columns(df, time_strings)
 
-    start_seq = df['sequence'].values[0]
-    end_seq = df['sequence'].values[-1]
-    save_str = str(k) + '_' + str(int(start_seq)) + '_' + str(int(end_seq)) + '.feather'
-    feather.write_dataframe(df, data_dir + '/feather/' + save_str)
-    del df
-    gc.collect()
 
+def write_row_group(writer: MessageWriter, messages: list, price_dec: int, lot_dec: int, time_strings=False) -> (int, int):
+    """ Writes messages as a row group and returns their first and last sequence. """
+    columns = messages_to_columns(messages, price_dec, lot_dec, time_strings)
+    writer.write(columns)
+    return int(columns['sequence'][0]), int(columns['sequence'][-1])
 
-def reformat(data_dir='../../../data', cores=1):
-    print('Reformats data from:', data_dir)
-    files = os.listdir(data_dir + '/json/')  # noqa
-    snap_files = SortedList([filename for filename in files if 'snaps' in filename],
-                            key=lambda fn: pd.to_datetime(fn[:-11], format='%d_%m_%Y_%H_%M_%S'))
 
-    try:
-        os.makedirs(data_dir + '/snap_json/')
-    except FileExistsError:
-        pass
+def reformat_messages(data_dir, k, keys, price_dec, messfile, lot_dec=8, store=False, row_group_size=65536,
+                      time_strings=False, compression='lz4', compression_level=None) -> list:
+    """
+    Reformats the messages in data_dir/json/messfile to data_dir/feather/ or data_dir/store/, named by k and the first
+    and last sequence. The file is read line by line and every row_group_size messages are converted and written as a
+    row group, so the memory used does not grow with the size of the file.
 
-    Parallel(n_jobs=cores)(delayed(save_snaps_from_file_path)(data_dir, snapfile) for snapfile in tqdm(snap_files))
+    Parameters
+    ----------
+    data_dir: str
+    k: int
+        Number of the file
+    keys: set
+        The keys of the messages that are kept
+    price_dec: int
+        Number of decimals in the tick size
+    messfile: str
+    lot_dec: int
+        Number of decimals in the lot size
+    store: bool
+        If the messages are saved as a memory-mapped message store file, else as a feather file
+    row_group_size: int
+        Number of messages per row group
+    time_strings: bool
+        If the time is kept as the exchange string instead of parsed to epoch nanoseconds
+    compression: str
+        Compression of the feather file, 'lz4', 'zstd' or None, message store files are never compressed
+    compression_level: int
+        Level of the compression, the default of the codec if None
 
+    Returns
+    -------
+    outputs: list
+        The path of the reformatted file relative to data_dir, empty if there were no messages
+
+    """
+    save_dir = 'store/' if store else 'feather/'
+    tmp_path = data_dir + '/' + save_dir + str(k) + '.tmp'
+    sequences = []
+    messages = []
+    schema = STRING_TIME_SCHEMA if time_strings else SCHEMA
+    with open_raw(data_dir + '/json/' + messfile) as f, \
+            MessageWriter(tmp_path, None if store else compression, schema, compression_level) as writer:
+        for m in f:
+            ms = ujson.loads(m)
+            messages.append({key: v for key, v in ms.items() if key in keys})
+            if len(messages) == row_group_size:
+                sequences.append(write_row_group(writer, messages, price_dec, lot_dec, time_strings))
+                messages = []
+        if messages:
+            sequences.append(write_row_group(writer, messages, price_dec, lot_dec, time_strings))
+
+    if not sequences:
+        os.remove(tmp_path)
+        return []
+    start_seq, end_seq = sequences[0][0], sequences[-1][1]
+    save_str = str(k) + '_' + str(int(start_seq)) + '_' + str(int(end_seq))
+    output = save_dir + save_str + (EXTENSION if store else '.feather')
+    os.replace(tmp_path, data_dir + '/' + output)
+    return [output]
+
+
+def reformat(data_dir='../../../data', cores=1, store=False, binary_snaps=False, checkpoint_messages=None,
+             checkpoint_seconds=None, force=False, time_strings=False, message_compression='lz4', message_level=None,
+             snap_compression=None, snap_level=None):
+    """
+    Reformats the downloaded messages and snapshots in data_dir/json/, which can be compressed, see
+    :py:func:`orderbookmdp.data_all.recorder.open_raw`. The snapshots are saved to data_dir/snap_json/,
+    and if binary_snaps is True also to data_dir/snap_bin/, see :py:mod:`orderbookmdp.data_all.snapshots`. The
+    messages are saved to feather files in data_dir/feather/, compressed with message_compression, or if store is True
+    to uncompressed memory-mapped message store files in data_dir/store/, see
+    :py:mod:`orderbookmdp.data_all.message_store`. The snapshots are compressed with snap_compression. A
+    :py:class:`orderbookmdp.data_all.sequence_index.SequenceIndex` of the messages and snapshots is saved with them.
+    If checkpoint_messages or checkpoint_seconds is given, checkpoints of the book are saved with the binary
+    snapshots, see :py:mod:`orderbookmdp.data_all.checkpoints`.
+
+    Only the raw files that are new or have changed since they were last reformatted are reformatted, see
+    :py:mod:`orderbookmdp.data_all.manifest`. The checkpoints are recorded in the manifest too and all saved again if
+    any file was reformatted or the checkpoint options have changed.
+
+    The shards of a data directory with several products, see :py:mod:`orderbookmdp.data_all.shards`, are each
+    reformatted as a data_dir of its own by :py:func:`orderbookmdp.data_all.shards.reformat_shards`.
+
+    Parameters
+    ----------
+    data_dir: str
+    cores: int
+        Number of processes to reformat with
+    store: bool
+        If the messages are saved as message store files
+    binary_snaps: bool
+        If the snapshots are also saved as binary snapshots
+    checkpoint_messages: int
+        Number of messages between checkpoints
+    checkpoint_seconds: float
+        Seconds between checkpoints
+    force: bool
+        If all raw files are reformatted
+    time_strings: bool
+        If the time of the messages is kept as the exchange string instead of parsed to epoch nanoseconds
+    message_compression: str
+        Compression of the feather files, 'lz4', 'zstd' or None for uncompressed files that are memory-mapped
+    message_level: int
+        Level of the message compression, the default of the codec if None
+    snap_compression: str
+        Compression of the snapshots, 'zstd', 'lz4', 'gzip' or None
+    snap_level: int
+        Level of the snapshot compression
+
+    """
+    print('Reformats data from:', data_dir)
+    if checkpoint_messages is not None or checkpoint_seconds is not None:
+        binary_snaps = True
+    manifest = Manifest(data_dir)
     files = os.listdir(data_dir + '/json/')  # noqa
-    mess_files = SortedList([filename for filename in files if 'mess' in filename],
-                            key=lambda fn: pd.to_datetime(fn[:-10], format='%d_%m_%Y_%H_%M_%S'))
+    snap_files = SortedList([filename for filename in files if 'snaps' in filename], key=raw_file_time)
+
+    for snap_dir in ('/snap_json/', '/snap_bin/') if binary_snaps else ('/snap_json/',):
+        try:
+            os.makedirs(data_dir + snap_dir)
+        except FileExistsError:
+            pass
 
-    keys = {'order_type', 'reason', 'sequence', 'side', 'size', 'type', 'price', 'funds', 'order_id', 'time'}
     price_tick = 0.01
     price_dec = int(np.log10(1 / price_tick))
+    lot_size = 1e-8
+    lot_dec = int(np.log10(1 / lot_size))
+
+    snap_section = 'snap_bin' if binary_snaps else 'snap_json'
+    snap_options = {'compression': snap_compression, 'level': snap_level}
+    snap_files = [snapfile for snapfile in snap_files
+                  if force or not manifest.is_converted(snap_section, snapfile, options=snap_options)]
+
+    files = os.listdir(data_dir + '/json/')  # noqa
+    mess_files = SortedList([filename for filename in files if 'mess' in filename], key=raw_file_time)
+
+    # A file is numbered by its position among the raw files, it is reformatted again if its number has changed
+    mess_section = 'store' if store else 'feather'
+    mess_options = {} if store else {'compression': message_compression, 'level': message_level}
+    mess_files = [(k, messfile) for k, messfile in enumerate(mess_files)
+                  if force or not manifest.is_converted(mess_section, messfile, options=mess_options)
+                  or any(os.path.basename(output).split('_')[0] != str(k)
+                         for output in manifest.outputs(mess_section, messfile))]
+
+    # The checkpoints are all replaced if any file is reformatted, as the book at any of them may have changed. They
+    # are removed first, so that they do not take the place of the reformatted snapshots with the same sequence.
+    checkpoint_options = {'messages': checkpoint_messages, 'seconds': checkpoint_seconds,
+                          'compression': snap_compression, 'level': snap_level}
+    checkpoint_entry = manifest.entries.get('checkpoints', {}).get(snap_section)
+    checkpoint = checkpoint_messages is not None or checkpoint_seconds is not None
+    if checkpoint_entry is not None and (snap_files or mess_files or
+                                         (checkpoint and checkpoint_entry.get('options') != checkpoint_options)):
+        for output in manifest.outputs('checkpoints', snap_section):
+            if os.path.isfile(data_dir + '/' + output):
+                os.remove(data_dir + '/' + output)
+        del manifest.entries['checkpoints'][snap_section]
+        manifest.save()
+        checkpoint_entry = None
+
+    for snapfile in snap_files:
+        for output in manifest.outputs(snap_section, snapfile):
+            if os.path.isfile(data_dir + '/' + output):
+                os.remove(data_dir + '/' + output)
+    print('Snapshot files to reformat:', len(snap_files))
+    for name, source, outputs in tqdm(Parallel(n_jobs=cores, return_as='generator')(
+            delayed(convert)(save_snaps_from_file_path, data_dir, snapfile, snapfile, binary_snaps, price_dec, lot_dec,
+                             snap_compression, snap_level)
+            for snapfile in snap_files), total=len(snap_files)):
+        manifest.record(snap_section, name, source, outputs, snap_options)
+
+    keys = MESSAGE_KEYS
 
     try:
-        os.makedirs(data_dir + '/feather/')
+        os.makedirs(data_dir + ('/store/' if store else '/feather/'))
     except FileExistsError:
         pass
 
-    Parallel(n_jobs=cores)(delayed(reformat_messages)(
-        data_dir, k, keys, price_dec, messfile) for k, messfile in tqdm(enumerate(list((mess_files)))))
+    for k, messfile in mess_files:
+        for output in manifest.outputs(mess_section, messfile):
+            if os.path.isfile(data_dir + '/' + output):
+                os.remove(data_dir + '/' + output)
+    print('Message files to reformat:', len(mess_files))
+    for name, source, outputs in tqdm(Parallel(n_jobs=cores, return_as='generator')(
+            delayed(convert)(reformat_messages, data_dir, messfile, k, keys, price_dec, messfile, lot_dec, store,
+                             65536, time_strings, message_compression, message_level)
+            for k, messfile in mess_files), total=len(mess_files)):
+        manifest.record(mess_section, name, source, outputs, mess_options)
+
+    order_dir = data_dir + ('/store/' if store else '/feather/')
+    snap_dir = data_dir + ('/snap_bin/' if binary_snaps else '/snap_json/')
+    if checkpoint and checkpoint_entry is None:
+        stats = {}
+        checkpoints = write_checkpoints(order_dir, snap_dir, snap_dir, checkpoint_messages, checkpoint_seconds,
+                                        snap_compression=snap_compression, snap_level=snap_level, stats=stats,
+                                        tick_size=price_tick, lot_size=lot_size)
+        outputs = [snap_section + '/' + name for name in checkpoints]
+        manifest.record('checkpoints', snap_section, {}, output_entry(data_dir, outputs), checkpoint_options)
+        print('Saved checkpoints:', len(checkpoints), 'skipped with orders outside of the book:', stats['skipped'])
+    build_index(order_dir, snap_dir)
 
 
 if __name__ == '__main__':
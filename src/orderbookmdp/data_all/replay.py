@@ -0,0 +1,242 @@
+"""Replays reformatted data through an external market and measures the hot path.
+
+:py:func:`replay` sends the batches of :py:func:`orderbookmdp.data_all.orderstream.orderstream_batches` to a market of
+an engine, see :py:func:`get_engine`, and measures the messages per second, the latency of every message by its type,
+the peak resident memory of the process and the number of price levels and orders in the book.
+:py:func:`replay_shards` replays the shards of a data directory, see :py:mod:`orderbookmdp.data_all.shards`, in a pool
+of processes. Both return the metrics summarized by :py:func:`summarize`, which the command line app prints::
+
+    orderbookmdp replay --dir data --store --engine cy
+
+The latencies are counted in log spaced bins of :py:data:`LATENCY_BINS`, so that the replays of many shards can be
+merged, which gives the percentiles within about 2.3%.
+"""
+import resource
+import sys
+import time
+
+import numpy as np
+from joblib import Parallel
+from joblib import delayed
+
+from orderbookmdp._orderbookmdp import CyExternalMarket
+from orderbookmdp.data_all.orderstream import orderstream_batches
+from orderbookmdp.data_all.shards import ShardManifest
+from orderbookmdp.order_book.constants import MESSAGE_TYPE_CODES
+from orderbookmdp.order_book.market import ExternalMarket
+from orderbookmdp.order_book.utils import market_columns
+
+# 100 bins per decade from 10 nanoseconds to 10 seconds
+LATENCY_BINS = np.geomspace(1e1, 1e10, 901)
+
+
+def get_engine(engine='cy', price_levels_type=None, price_level_type=None, tick_size=0.01, lot_size=1e-8):
+    """
+    Returns an empty external market of an engine.
+
+    Parameters
+    ----------
+    engine: str
+        'cy' for a :py:class:`orderbookmdp._orderbookmdp.CyExternalMarket`, which always has cylist price levels of
+        cylots, or 'py' for a :py:class:`orderbookmdp.order_book.market.ExternalMarket`, other engines raise a
+        ValueError
+    price_levels_type: str
+        The price levels of the python market, sorted_dict if None. Raises a ValueError with the cython market
+    price_level_type: str
+        The price level of the python market, ordered_dict if None. Raises a ValueError with the cython market
+    tick_size: float
+    lot_size: float
+
+    Returns
+    -------
+    market: ExternalMarket or CyExternalMarket
+
+    """
+    if engine == 'cy':
+        if price_levels_type is not None or price_level_type is not None:
+            raise ValueError('The cy engine has no price_levels_type or price_level_type to choose, use the py engine')
+        return CyExternalMarket(tick_size=tick_size, lot_size=lot_size)
+    elif engine == 'py':
+        return ExternalMarket(tick_size, 'py', price_level_type or 'ordered_dict', price_levels_type or 'sorted_dict',
+                              lot_size)
+    else:
+        raise ValueError("engine is 'cy' or 'py', not {!r}".format(engine))
+
+
+def peak_rss() -> int:
+    """ Returns the peak resident memory of the process in bytes, ru_maxrss is in bytes on macOS and kilobytes on Linux. """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def market_batches(market, order_paths, snapshot_paths, stats=None, **stream_kwargs):
+    """
+    Yields the batches of one pass of :py:func:`orderbookmdp.data_all.orderstream.orderstream_batches`, to be sent to
+    the market. The market is filled from the first snapshot and resynced to the snapshots at gaps in the orders,
+    the pass ends where the stream starts over.
+
+    Parameters
+    ----------
+    market: ExternalMarket or CyExternalMarket
+    order_paths: str
+    snapshot_paths: str
+    stats: dict
+        Updated with the number of 'resyncs' and the stream stats
+    stream_kwargs
+        Passed to :py:func:`orderbookmdp.data_all.orderstream.orderstream_batches`. The columns a market needs are
+        added to a projection, see :py:func:`orderbookmdp.order_book.utils.market_columns`
+
+    Yields
+    ------
+    batch: dict
+
+    """
+    stats = {} if stats is None else stats
+    stats.setdefault('resyncs', 0)
+    sequence = None
+    stream_kwargs['columns'] = market_columns(stream_kwargs.get('columns'))
+    for batch, snap in orderstream_batches(order_paths, snapshot_paths, stats=stats, **stream_kwargs):
+        if snap is not None:
+            if sequence is None:
+                market.fill_snap(snap)
+            elif snap['sequence'] <= sequence:  # The stream starts over
+                return
+            else:
+                market.resync_snap(snap)
+                stats['resyncs'] += 1
+            sequence = snap['sequence']
+            continue
+        yield batch
+        sequence = batch['sequence'][-1]
+
+
+def replay(order_paths, snapshot_paths, engine='cy', price_levels_type=None, price_level_type=None, time_range=None,
+           sequence_range=None, max_messages=None, prefetch=1) -> dict:
+    """
+    Replays the orders once, from the first snapshot of the range to its end, through a new market of an engine.
+    The market is resynced to the snapshots at gaps in the orders.
+
+    Parameters
+    ----------
+    order_paths: str
+    snapshot_paths: str
+    engine: str
+        See :py:func:`get_engine`
+    price_levels_type: str
+    price_level_type: str
+    time_range: tuple
+        See :py:func:`orderbookmdp.data_all.orderstream.orderstream_batches`
+    sequence_range: tuple
+    max_messages: int
+        Stops after the batch with at least max_messages messages
+    prefetch: int
+        Number of order files to load ahead in a background thread
+
+    Returns
+    -------
+    metrics: dict
+        The 'messages' sent and the 'seconds' spent in the market, the 'latencies', message type to a histogram of
+        :py:data:`LATENCY_BINS`, the 'peak_rss', 'resyncs', 'stall_time' waiting for order files, the 'bid_levels',
+        'ask_levels' and 'orders' in the book at the end and the 'peak_orders' at the end of a batch
+
+    """
+    market = get_engine(engine, price_levels_type, price_level_type)
+    stats = {}
+    latencies = {}
+    metrics = {'messages': 0, 'seconds': 0.0, 'peak_orders': 0}
+    for batch in market_batches(market, order_paths, snapshot_paths, stats, prefetch=prefetch, time_range=time_range,
+                                sequence_range=sequence_range):
+        batch_latencies = np.empty(len(batch['sequence']), dtype=np.int64)
+        t = time.perf_counter()
+        market.send_messages(batch, batch_latencies)
+        metrics['seconds'] += time.perf_counter() - t
+
+        batch_latencies = np.clip(batch_latencies, LATENCY_BINS[0], LATENCY_BINS[-1])
+        for name, code in MESSAGE_TYPE_CODES.items():
+            of_type = batch['type'] == code
+            if of_type.any():
+                histogram = np.histogram(batch_latencies[of_type], LATENCY_BINS)[0]
+                latencies[name] = latencies.get(name, 0) + histogram
+        metrics['messages'] += len(batch_latencies)
+        metrics['peak_orders'] = max(metrics['peak_orders'], len(market.ob.orders))
+        if max_messages is not None and metrics['messages'] >= max_messages:
+            break
+
+    levels = market.ob.price_levels.get_snap()
+    metrics.update(latencies=latencies, peak_rss=peak_rss(), resyncs=stats['resyncs'], stall_time=stats.get('stall_time', 0.0),
+                   bid_levels=len(levels['bids']), ask_levels=len(levels['asks']), orders=len(market.ob.orders))
+    return metrics
+
+
+def replay_shards(data_dir, products=None, cores=1, time_range=None, **replay_kwargs) -> dict:
+    """
+    Replays the shards of products in a data directory with orders in the time range, cores shards at a time in a
+    pool of processes, and returns the summary of their metrics, see :py:func:`summarize`.
+
+    Parameters
+    ----------
+    data_dir: str
+    products: list
+        All products if None
+    cores: int
+    time_range: tuple
+    replay_kwargs
+        Passed to :py:func:`replay`
+
+    Returns
+    -------
+    summary: dict
+
+    """
+    shards = ShardManifest(data_dir)
+    entries = [entry for product in (products or shards.products) for entry in shards.shards(product, time_range)]
+    t = time.perf_counter()
+    results = Parallel(n_jobs=cores)(delayed(replay)(*shards.paths(entry), time_range=time_range, **replay_kwargs)
+                                     for entry in entries)
+    return summarize(results, time.perf_counter() - t)
+
+
+def latency_percentile(histogram: np.ndarray, q: float) -> float:
+    """ Returns the q-th percentile in nanoseconds of a histogram of :py:data:`LATENCY_BINS`, the center of its bin. """
+    k = int(np.searchsorted(np.cumsum(histogram), q / 100 * histogram.sum()))
+    return float(np.sqrt(LATENCY_BINS[k] * LATENCY_BINS[k + 1]))
+
+
+def summarize(results: list, wall_seconds=None) -> dict:
+    """
+    Merges the metrics of replays into a summary.
+
+    Parameters
+    ----------
+    results: list
+        Metrics of :py:func:`replay`
+    wall_seconds: float
+        The time all the replays took, the seconds in the markets if None
+
+    Returns
+    -------
+    summary: dict
+        The 'replays', the 'messages', the 'seconds' in the markets, 'messages_per_second' of a market and
+        'wall_messages_per_second' of all replays, the 'p50' and 'p99' latency in nanoseconds and 'count' of each
+        message type in 'latency', the largest 'peak_rss_mb', 'bid_levels', 'ask_levels', 'orders' and
+        'peak_orders' of a replay and the total 'resyncs' and 'stall_time'
+
+    """
+    messages = sum(result['messages'] for result in results)
+    seconds = sum(result['seconds'] for result in results)
+    wall_seconds = seconds if wall_seconds is None else wall_seconds
+    histograms = {}
+    for result in results:
+        for name, histogram in result['latencies'].items():
+            histograms[name] = histograms.get(name, 0) + histogram
+    summary = {'replays': len(results), 'messages': messages, 'seconds': seconds,
+               'messages_per_second': messages / seconds if seconds > 0 else 0.0,
+               'wall_messages_per_second': messages / wall_seconds if wall_seconds > 0 else 0.0,
+               'latency': {name: {'p50': latency_percentile(histogram, 50), 'p99': latency_percentile(histogram, 99),
+                                  'count': int(histogram.sum())} for name, histogram in sorted(histograms.items())},
+               'peak_rss_mb': max([result['peak_rss'] for result in results], default=peak_rss()) / 1e6}
+    for name in ('bid_levels', 'ask_levels', 'orders', 'peak_orders'):
+        summary[name] = max([result[name] for result in results], default=0)
+    for name in ('resyncs', 'stall_time'):
+        summary[name] = sum(result[name] for result in results)
+    return summary
@@ -0,0 +1,418 @@
+"""A local replay of the exchange feed for offline end-to-end and load tests.
+
+:py:class:`ReplayServer` serves the messages recorded in the shards of a product on one or consecutive days, see
+:py:mod:`orderbookmdp.data_all.shards`, or in data_dir/json/ of data recorded before it was sharded, see
+:py:mod:`orderbookmdp.data_all.recorder`, on a websocket as the exchange feed would, and the recorded level 3
+snapshots on the REST book endpoint, both on the same port. The messages are replayed at a multiple of the recorded
+speed or as fast as possible. Subscribing to the 'level2' channel replays a level 2 snapshot followed by l2update
+messages derived from the level 3 messages, as used by :py:class:`orderbookmdp.rl.gdax_envs.GdaxOrderBook`, any other
+channel replays the recorded messages as they are.
+
+Only the python standard library is used, so the server and the client :py:func:`consume` run without any websocket
+package installed::
+
+    server = ReplayServer('data', speed=None, product='BTC-USD', days=['2018-08-01', '2018-08-02'])
+    server.start()
+    client = DownloadWebsocketClient('out', url=server.url, api_url=server.api_url, products=['BTC-USD'])
+
+The client records the replay to the shards of the days in the message times, out/BTC-USD/2018-08-01/json/ and so
+on, which a :py:class:`ReplayServer` of 'out' serves in turn.
+
+"""
+import asyncio
+import base64
+import datetime
+import hashlib
+import logging
+import os
+import re
+import struct
+import threading
+import time
+from decimal import Decimal
+from urllib.parse import urlparse
+
+import ujson
+
+from orderbookmdp.data_all.recorder import open_raw
+from orderbookmdp.data_all.recorder import raw_file_time
+from orderbookmdp.data_all.shards import is_sharded
+from orderbookmdp.data_all.shards import list_shards
+from orderbookmdp.data_all.shards import shard_dir
+from orderbookmdp.order_book.utils import time_to_ns
+
+SEQUENCE = re.compile(r'"sequence"\s*:\s*(\d+)')
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+OP_TEXT, OP_CLOSE, OP_PING, OP_PONG = 0x1, 0x8, 0x9, 0xA
+
+
+def ws_frame(payload: bytes, opcode=OP_TEXT, mask=False) -> bytes:
+    """ Returns payload as a single websocket frame, clients have to mask their frames. """
+    n = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if n < 126:
+        head = struct.pack('!BB', 0x80 | opcode, mask_bit | n)
+    elif n < 2**16:
+        head = struct.pack('!BBH', 0x80 | opcode, mask_bit | 126, n)
+    else:
+        head = struct.pack('!BBQ', 0x80 | opcode, mask_bit | 127, n)
+    if mask:
+        key = os.urandom(4)
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+        head += key
+    return head + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> (int, bytes):
+    """ Reads a websocket frame and returns its opcode and unmasked payload. """
+    first, second = await reader.readexactly(2)
+    length = second & 0x7f
+    if length == 126:
+        length, = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('!Q', await reader.readexactly(8))
+    key = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if key is not None:
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    return first & 0x0f, payload
+
+
+async def read_request(reader: asyncio.StreamReader) -> (str, dict):
+    """ Reads an HTTP request and returns its path and lower case headers. """
+    lines = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    path = lines[0].split(' ')[1]
+    headers = dict((key.strip().lower(), value.strip()) for key, value in
+                   (line.split(':', 1) for line in lines[1:] if ':' in line))
+    return path, headers
+
+
+def json_dirs(data_dir: str, product: str, days=None) -> list:
+    """
+    Returns the directories of the raw files to replay, the json/ directories of the shards of product on days in a
+    sharded data_dir, see :py:mod:`orderbookmdp.data_all.shards`, else data_dir/json/.
+
+    Parameters
+    ----------
+    data_dir: str
+    product: str
+    days: list
+        One or consecutive days, YYYY-MM-DD, all days of the product if None. Ignored if data_dir is not sharded
+
+    Returns
+    -------
+    json_dirs: list
+        In the order of the days
+
+    """
+    if not is_sharded(data_dir):
+        return [os.path.join(data_dir, 'json') + '/']
+    product_days = [day for product_, day in list_shards(data_dir) if product_ == product]
+    days = product_days if days is None else sorted(days)
+    missing = [day for day in days if day not in product_days]
+    if not days or missing:
+        raise ValueError('{} has no shards of {} on {}'.format(data_dir, product, ', '.join(missing) or 'any day'))
+    dates = [datetime.date.fromisoformat(day) for day in days]
+    if any((date - previous).days != 1 for previous, date in zip(dates, dates[1:])):
+        raise ValueError('The days {} of {} are not consecutive, replay one day or consecutive days'
+                         .format(', '.join(days), product))
+    return [shard_dir(data_dir, product, day) + 'json/' for day in days]
+
+
+def raw_files(json_dirs: list, kind: str) -> list:
+    """ Returns the paths of the raw files of kind, 'mess' or 'snaps', in the directories in the order recorded. """
+    paths = []
+    for json_dir in json_dirs:
+        names = [name for name in os.listdir(json_dir) if '_' + kind + '.json' in name]
+        paths.extend(json_dir + name for name in sorted(names, key=raw_file_time))
+    return paths
+
+
+def line_sequence(line: str) -> int:
+    """ Returns the sequence of a raw message without parsing all of it, -1 if it has none. """
+    match = SEQUENCE.search(line)
+    return int(match.group(1)) if match is not None else -1
+
+
+def read_snapshot(path: str) -> dict:
+    with open_raw(path) as f:
+        return ujson.loads(f.read())
+
+
+class L2Book:
+    """
+    Derives level 2 updates from level 3 messages. The size of each order on the book is kept in lots, so that the
+    aggregated size of a price level is exact.
+
+    """
+    def __init__(self, snap: dict, lot_dec=8):
+        self.lot_multiplier = 10**lot_dec
+        self.lot_dec = lot_dec
+        self.orders = {}
+        self.levels = {'buy': {}, 'sell': {}}
+        for side, key in (('buy', 'bids'), ('sell', 'asks')):
+            for price, size, order_id in snap[key]:
+                self._add(order_id, side, Decimal(price), self.lots(size))
+
+    def lots(self, size) -> int:
+        return int(round(float(size) * self.lot_multiplier))
+
+    def _add(self, order_id, side, price, lots):
+        self.orders[order_id] = [side, price, lots]
+        self.levels[side][price] = self.levels[side].get(price, 0) + lots
+
+    def _change(self, order_id, lots) -> tuple:
+        side, price, order_lots = self.orders[order_id]
+        lots = min(lots, order_lots)
+        self.orders[order_id][2] -= lots
+        self.levels[side][price] -= lots
+        if self.orders[order_id][2] <= 0:
+            del self.orders[order_id]
+        if self.levels[side][price] <= 0:
+            del self.levels[side][price]
+        return side, price
+
+    def change(self, side, price) -> list:
+        return [side, str(price), '{:.{}f}'.format(self.levels[side].get(price, 0) / self.lot_multiplier, self.lot_dec)]
+
+    def snapshot_message(self, product: str) -> dict:
+        bids = sorted(self.levels['buy'].items(), reverse=True)
+        asks = sorted(self.levels['sell'].items())
+        return {'type': 'snapshot', 'product_id': product,
+                'bids': [self.change('buy', price)[1:] for price, _ in bids],
+                'asks': [self.change('sell', price)[1:] for price, _ in asks]}
+
+    def update(self, msg: dict) -> list:
+        """ Applies a level 3 message and returns the changed levels as [side, price, size]. """
+        msg_type = msg.get('type')
+        if msg_type == 'open':
+            price = Decimal(msg['price'])
+            self._add(msg['order_id'], msg['side'], price, self.lots(msg['remaining_size']))
+            return [self.change(msg['side'], price)]
+        if msg_type == 'done' and msg['order_id'] in self.orders:
+            side, price = self._change(msg['order_id'], self.orders[msg['order_id']][2])
+            return [self.change(side, price)]
+        if msg_type == 'match' and msg['maker_order_id'] in self.orders:
+            side, price = self._change(msg['maker_order_id'], self.lots(msg['size']))
+            return [self.change(side, price)]
+        if msg_type == 'change' and msg['order_id'] in self.orders and 'new_size' in msg:
+            side, price, order_lots = self.orders[msg['order_id']]
+            self._change(msg['order_id'], order_lots)
+            self._add(msg['order_id'], side, price, self.lots(msg['new_size']))
+            return [self.change(side, price)]
+        return []
+
+
+class ReplayServer:
+    """
+    Replays the recorded feed of product in data_dir on ws://host:port and serves the last recorded level 3 snapshot
+    at or before the replayed sequence on http://host:port/products/<product>/book. Every websocket connection
+    replays the feed from the start.
+
+    Attributes
+    ----------
+    data_dir: str
+    speed: float
+        Multiple of the recorded speed to replay at, None to replay as fast as possible
+    product: str
+    json_dirs: list
+        The directories of the raw files replayed, the shards of product on days, see :py:func:`json_dirs`
+    port: int
+        The port listened on, chosen by the system if 0 is given
+    messages: int
+        Number of messages sent on all connections
+    sequence: int
+        The latest sequence sent
+
+    """
+    def __init__(self, data_dir, host='127.0.0.1', port=0, speed=None, product='BTC-USD', days=None, drain_every=256):
+        self.data_dir = data_dir
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.product = product
+        self.json_dirs = json_dirs(data_dir, product, days)
+        self.drain_every = drain_every
+        self.messages = 0
+        self.sequence = -1
+        self.loop = None
+        self.server = None
+        self._started = threading.Event()
+        self.snapshots = []
+        for path in raw_files(self.json_dirs, 'snaps'):
+            with open_raw(path) as f:
+                sequence = line_sequence(f.read())
+            if sequence >= 0:
+                self.snapshots.append((sequence, path))
+        self.snapshots.sort()
+
+    @property
+    def url(self) -> str:
+        return 'ws://{}:{}'.format(self.host, self.port)
+
+    @property
+    def api_url(self) -> str:
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logging.info('Replays {} on {}'.format(self.data_dir, self.url))
+        self._started.set()
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def run(self):
+        """ Serves until interrupted. """
+        asyncio.run(self.serve())
+
+    def start(self):
+        """ Serves in a background thread and returns once the server listens. """
+        threading.Thread(target=self.run, daemon=True).start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        if self.loop is not None and self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+    async def handle(self, reader, writer):
+        try:
+            path, headers = await read_request(reader)
+            if headers.get('upgrade', '').lower() == 'websocket':
+                await self.websocket(reader, writer, headers)
+            else:
+                await self.rest(writer, path)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def rest(self, writer, path):
+        if urlparse(path).path.rstrip('/') == '/products/{}/book'.format(self.product) and self.snapshots:
+            snapshots = [snapshot for snapshot in self.snapshots if snapshot[0] <= self.sequence]
+            with open_raw((snapshots or self.snapshots)[-1][1]) as f:
+                body, status = f.read().encode(), '200 OK'
+        else:
+            body, status = b'{"message": "NotFound"}', '404 Not Found'
+        writer.write('HTTP/1.1 {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'
+                     .format(status, len(body)).encode() + body)
+        await writer.drain()
+
+    async def websocket(self, reader, writer, headers):
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + WS_GUID).encode()).digest()).decode()
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                      'Sec-WebSocket-Accept: {}\r\n\r\n').format(accept).encode())
+        opcode, payload = await read_frame(reader)
+        subscribe = ujson.loads(payload) if opcode == OP_TEXT else {}
+        channels = [channel if isinstance(channel, str) else channel.get('name')
+                    for channel in subscribe.get('channels', ['full'])]
+
+        closed = asyncio.Event()
+        control = asyncio.ensure_future(self.control(reader, writer, closed))
+        start, sent = time.perf_counter(), 0
+        try:
+            sent = await self.replay(writer, 'level2' in channels, closed)
+            writer.write(ws_frame(b'', OP_CLOSE))
+            await writer.drain()
+        finally:
+            control.cancel()
+        elapsed = time.perf_counter() - start
+        logging.info('Replayed {} messages in {:.2f}s, {:.0f} messages/s'.format(sent, elapsed, sent / max(elapsed, 1e-9)))
+
+    async def control(self, reader, writer, closed):
+        """ Answers pings and notes when the client closes the connection. """
+        try:
+            while True:
+                opcode, payload = await read_frame(reader)
+                if opcode == OP_PING:
+                    writer.write(ws_frame(payload, OP_PONG))
+                elif opcode == OP_CLOSE:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        closed.set()
+
+    async def replay(self, writer, level2, closed) -> int:
+        """ Sends the recorded messages, or the level 2 updates derived from them, and returns how many were sent. """
+        book, snap_sequence = None, -1
+        if level2 and not self.snapshots:
+            logging.info('No level 3 snapshot to replay level 2 from')
+            return 0
+        if level2:
+            snap_sequence, path = self.snapshots[0]
+            book = L2Book(read_snapshot(path))
+            writer.write(ws_frame(ujson.dumps(book.snapshot_message(self.product)).encode()))
+
+        sent, start, first_time = 0, time.perf_counter(), None
+        for path in raw_files(self.json_dirs, 'mess'):
+            with open_raw(path) as f:
+                for line in f:
+                    if closed.is_set():
+                        return sent
+                    msg = ujson.loads(line) if level2 or self.speed is not None else None
+                    if self.speed is not None:
+                        msg_time = time_to_ns(msg['time']) / 1e9
+                        first_time = msg_time if first_time is None else first_time
+                        delay = (msg_time - first_time) / self.speed - (time.perf_counter() - start)
+                        if delay > 0:
+                            await writer.drain()
+                            await asyncio.sleep(delay)
+                    if level2:
+                        if msg.get('sequence', -1) <= snap_sequence:
+                            continue
+                        changes = book.update(msg)
+                        if not changes:
+                            continue
+                        sequence = msg['sequence']
+                        line = ujson.dumps({'type': 'l2update', 'product_id': self.product, 'time': msg['time'],
+                                            'changes': changes})
+                    writer.write(ws_frame(line.rstrip('\n').encode()))
+                    sent += 1
+                    self.messages += 1
+                    if sent % self.drain_every == 0:
+                        self.sequence = max(self.sequence, sequence if level2 else line_sequence(line))
+                        await writer.drain()
+        await writer.drain()
+        return sent
+
+
+async def consume(url, channels=('full',), product='BTC-USD', on_message=None, max_messages=None) -> int:
+    """
+    Subscribes to a websocket feed such as :py:class:`ReplayServer` and passes every message, parsed, to on_message
+    until the feed is closed or max_messages have been received.
+
+    Returns
+    -------
+    messages: int
+        Number of messages received
+
+    """
+    parsed = urlparse(url)
+    reader, writer = await asyncio.open_connection(parsed.hostname, parsed.port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write(('GET {} HTTP/1.1\r\nHost: {}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                  'Sec-WebSocket-Key: {}\r\nSec-WebSocket-Version: 13\r\n\r\n')
+                 .format(parsed.path or '/', parsed.netloc, key).encode())
+    await read_request(reader)
+    subscribe = {'type': 'subscribe', 'product_ids': [product], 'channels': list(channels)}
+    writer.write(ws_frame(ujson.dumps(subscribe).encode(), mask=True))
+
+    messages = 0
+    try:
+        while max_messages is None or messages < max_messages:
+            opcode, payload = await read_frame(reader)
+            if opcode == OP_CLOSE:
+                break
+            messages += 1
+            if on_message is not None:
+                on_message(ujson.loads(payload))
+        writer.write(ws_frame(b'', OP_CLOSE, mask=True))
+    except asyncio.IncompleteReadError:
+        pass
+    writer.close()
+    return messages
@@ -0,0 +1,190 @@
+"""A persistent index of the sequences in reformatted order files.
+
+The index is built by :py:func:`orderbookmdp.data_all.reformat_data.reformat` and saved next to the order files. It
+maps the sequence of every snapshot to the order file and row where replay after the snapshot starts, so that an
+episode starts without reading the order files before it. It also keeps every gap in the sequence of the orders
+together with the snapshot replay resumes from after the gap, so that replay does not have to look for gaps.
+
+"""
+import os
+import random
+import re
+
+import feather
+import numpy as np
+
+from orderbookmdp.data_all.message_store import EXTENSION
+from orderbookmdp.data_all.message_store import MessageStore
+
+INDEX_FILE = 'index.npz'
+ORDER_FILE_EXTENSIONS = ('.feather', EXTENSION)
+
+
+def order_file_names(order_paths) -> list:
+    """ Returns the names of the order files in order_paths sorted by their number. """
+    names = [name for name in os.listdir(order_paths) if name.endswith(ORDER_FILE_EXTENSIONS)]
+    return sorted(names, key=lambda x: int(x.split('_')[0]))
+
+
+def snap_file_names(snapshot_paths) -> (list, np.ndarray):
+    """ Returns the names of the snapshot files in snapshot_paths and their sequences. """
+    names = sorted(os.listdir(snapshot_paths))
+    return names, np.array([int(re.search(r'\d+', name).group()) for name in names], dtype=np.int64)
+
+
+def load_sequences(path) -> np.ndarray:
+    """ Loads only the sequence column of an order file. """
+    if path.endswith(EXTENSION):
+        store = MessageStore(path)
+        sequences = np.array(store.column('sequence'))
+        store.close()
+        return sequences
+    return feather.read_dataframe(path, columns=['sequence'])['sequence'].values.astype(np.int64)
+
+
+def sequence_gaps(sequences: np.ndarray, prev_sequence=None) -> (np.ndarray, np.ndarray):
+    """
+    Returns the rows where the sequence increases by more than one from the previous row and by how much.
+
+    Parameters
+    ----------
+    sequences: numpy.ndarray
+        The sequences of an order file
+    prev_sequence: int
+        The sequence before the first row, if None the first row is not a gap
+
+    Returns
+    -------
+    rows, sizes: numpy.ndarray
+
+    """
+    if len(sequences) == 0:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    prev_sequences = np.empty_like(sequences)
+    prev_sequences[0] = sequences[0] if prev_sequence is None else prev_sequence
+    prev_sequences[1:] = sequences[:-1]
+    sizes = sequences - prev_sequences
+    rows = np.flatnonzero(sizes > 1)
+    return rows, sizes[rows].astype(np.int64)
+
+
+def resume_snaps(sequences: np.ndarray, snap_sequences: np.ndarray) -> np.ndarray:
+    """ Returns the position in snap_sequences of the first snapshot at or after each sequence, -1 if there is none. """
+    order = np.argsort(snap_sequences, kind='stable')
+    k = np.searchsorted(snap_sequences[order], sequences, side='left')
+    snaps = np.full(len(sequences), -1, dtype=np.int64)
+    found = k < len(order)
+    snaps[found] = order[k[found]]
+    return snaps
+
+
+def build_index(order_paths, snapshot_paths):
+    """
+    Builds the index of the order files in order_paths and the snapshots in snapshot_paths and saves it to
+    order_paths + :py:data:`INDEX_FILE`.
+
+    Parameters
+    ----------
+    order_paths: str
+        Path to the orders
+    snapshot_paths: str
+        Path to the snapshots
+
+    """
+    files = order_file_names(order_paths)
+    snap_files, snap_sequences = snap_file_names(snapshot_paths)
+
+    start_sequences = np.empty(len(files), dtype=np.int64)
+    end_sequences = np.empty(len(files), dtype=np.int64)
+    rows = np.empty(len(files), dtype=np.int64)
+    snap_file_k = np.full(len(snap_files), -1, dtype=np.int64)
+    snap_rows = np.zeros(len(snap_files), dtype=np.int64)
+    gap_files, gap_rows, gap_sequences, gap_sizes = [], [], [], []
+
+    for k, name in enumerate(files):
+        sequences = load_sequences(order_paths + name)
+        gap_rows_k, gap_sizes_k = sequence_gaps(sequences, end_sequences[k - 1] if k > 0 else None)
+        gap_files.append(np.full(len(gap_rows_k), k, dtype=np.int64))
+        gap_rows.append(gap_rows_k)
+        gap_sequences.append(sequences[gap_rows_k].astype(np.int64))
+        gap_sizes.append(gap_sizes_k)
+        start_sequences[k], end_sequences[k], rows[k] = sequences[0], sequences[-1], len(sequences)
+
+        # Replay after a snapshot starts at the first order after the snapshot sequence
+        located = (snap_file_k == -1) & (snap_sequences < sequences[-1])
+        snap_file_k[located] = k
+        snap_rows[located] = np.searchsorted(sequences, snap_sequences[located], side='right')
+
+    gap_files, gap_rows, gap_sequences, gap_sizes = (np.concatenate(gaps) if files else np.empty(0, np.int64)
+                                                     for gaps in (gap_files, gap_rows, gap_sequences, gap_sizes))
+    np.savez(order_paths + INDEX_FILE, files=np.array(files, dtype=str), start_sequences=start_sequences,
+             end_sequences=end_sequences, rows=rows,
+             snap_files=np.array(snap_files, dtype=str), snap_sequences=snap_sequences, snap_file_k=snap_file_k,
+             snap_rows=snap_rows, gap_files=gap_files, gap_rows=gap_rows, gap_sequences=gap_sequences,
+             gap_sizes=gap_sizes, gap_snaps=resume_snaps(gap_sequences, snap_sequences))
+
+
+def load_index(order_paths):
+    """ Returns the :py:class:`SequenceIndex` of order_paths or None if it has not been built or is outdated. """
+    path = order_paths + INDEX_FILE
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as index:
+        if 'gap_files' not in index:
+            return None
+    return SequenceIndex(path)
+
+
+class SequenceIndex:
+    """
+    The index of a directory of order files, see :py:func:`build_index`.
+
+    Attributes
+    ----------
+    files: list
+        The order files sorted by number
+    start_sequences, end_sequences, rows: numpy.ndarray
+        The first and last sequence and the number of rows of each order file
+    snap_files: list
+        The snapshot files
+    snap_sequences, snap_file_k, snap_rows: numpy.ndarray
+        The sequence of each snapshot and the order file and row of the first order after it, -1 if no order file
+        has orders after the snapshot
+    gap_files, gap_rows, gap_sequences, gap_sizes, gap_snaps: numpy.ndarray
+        The order file, row, sequence and size of each gap in the sequence of the orders, see :py:func:`sequence_gaps`,
+        and the position among snap_files of the snapshot to resume from, -1 if there is none
+
+    """
+    def __init__(self, path):
+        with np.load(path) as index:
+            self.files = index['files'].tolist()
+            self.start_sequences = index['start_sequences']
+            self.end_sequences = index['end_sequences']
+            self.rows = index['rows']
+            self.snap_files = index['snap_files'].tolist()
+            self.snap_sequences = index['snap_sequences']
+            self.snap_file_k = index['snap_file_k']
+            self.snap_rows = index['snap_rows']
+            self.gap_files = index['gap_files']
+            self.gap_rows = index['gap_rows']
+            self.gap_sequences = index['gap_sequences']
+            self.gap_sizes = index['gap_sizes']
+            self.gap_snaps = index['gap_snaps']
+        self.file_numbers = {name: k for k, name in enumerate(self.files)}
+
+    def locate_snap(self, snap_sequence) -> (int, int):
+        """ Returns the order file and the row replay starts from after the snapshot with snap_sequence. """
+        k = int(np.flatnonzero(self.snap_sequences == snap_sequence)[0])
+        return int(self.snap_file_k[k]), int(self.snap_rows[k])
+
+    def random_snap(self, snap_sequences=None) -> int:
+        """ Returns the sequence of a random snapshot that has orders after it, among snap_sequences if given. """
+        located = self.snap_file_k >= 0
+        if snap_sequences is not None:
+            located &= np.isin(self.snap_sequences, snap_sequences)
+        return int(random.choice(self.snap_sequences[located]))
+
+    def gaps(self, k) -> (np.ndarray, np.ndarray, np.ndarray):
+        """ Returns the rows, sizes and snapshots to resume from of the gaps in order file k. """
+        start, stop = np.searchsorted(self.gap_files, [k, k + 1])
+        return self.gap_rows[start:stop], self.gap_sizes[start:stop], self.gap_snaps[start:stop]
@@ -0,0 +1,212 @@
+"""Per-product, per-day shards of the downloaded data.
+
+:py:func:`orderbookmdp.data_all.download_gdax.download` records every product to its own directory and starts a new
+shard every day, data_dir/<product>/<day>/json/, see :py:func:`shard_dir`. Each shard is a data directory of its own,
+reformatted with :py:func:`orderbookmdp.data_all.reformat_data.reformat` to the order files and snapshots that
+:py:func:`orderbookmdp.data_all.orderstream.orderstream` replays. :py:func:`reformat_shards` reformats the shards in
+parallel and records each one in the manifest data_dir/:py:data:`SHARDS_FILE` with its row count, sequence and time
+range and the positions of its snapshots, so that loaders and episode samplers can select shards without listing or
+reading the directories::
+
+    shards = ShardManifest('data')
+    shard = shards.sample('BTC-USD')
+    stream = orderstream(*shards.paths(shard), random_start=True)
+
+"""
+import os
+import random
+import shutil
+
+import ujson
+from joblib import Parallel
+from joblib import delayed
+
+from orderbookmdp.data_all.orderstream import load_columns
+from orderbookmdp.data_all.recorder import raw_file_time
+from orderbookmdp.data_all.reformat_data import reformat
+from orderbookmdp.data_all.sequence_index import load_index
+from orderbookmdp.order_book.utils import time_bound
+from orderbookmdp.order_book.utils import to_nanoseconds
+
+SHARDS_FILE = 'shards.json'
+
+
+def shard_day(time: str) -> str:
+    """ Returns the day of an ISO 8601 message time, the name of the shard it is recorded to. """
+    return time[:10]
+
+
+def shard_dir(data_dir: str, product: str, day: str) -> str:
+    """ Returns the directory of the shard of product on day, YYYY-MM-DD. """
+    return os.path.join(data_dir, product, day) + '/'
+
+
+def list_shards(data_dir: str) -> list:
+    """ Returns the (product, day) of every shard with raw files in data_dir. """
+    shards = []
+    for product in sorted(os.listdir(data_dir)):
+        product_dir = os.path.join(data_dir, product)
+        if not os.path.isdir(product_dir):
+            continue
+        for day in sorted(os.listdir(product_dir)):
+            if os.path.isdir(os.path.join(product_dir, day, 'json')):
+                shards.append((product, day))
+    return shards
+
+
+def is_sharded(data_dir: str) -> bool:
+    """ Returns True if data_dir has shards and not the raw files of a single product in data_dir/json/. """
+    return not os.path.isdir(os.path.join(data_dir, 'json')) and len(list_shards(data_dir)) > 0
+
+
+def shard_raw_files(data_dir: str, product: str) -> list:
+    """
+    Moves the raw files of product in data_dir/json/, as downloaded before the data was sharded, to the shards of the
+    days they were started on, removes data_dir/json/ and returns the shards. The raw files are of a single product.
+
+    """
+    if ',' in product:
+        raise ValueError('The raw files in {} are of a single product, not {}'.format(os.path.join(data_dir, 'json'), product))
+    shards = set()
+    for name in os.listdir(os.path.join(data_dir, 'json')):
+        day = raw_file_time(name).strftime('%Y-%m-%d')
+        json_dir = shard_dir(data_dir, product, day) + 'json/'
+        os.makedirs(json_dir, exist_ok=True)
+        shutil.move(os.path.join(data_dir, 'json', name), json_dir + name)
+        shards.add((product, day))
+    os.rmdir(os.path.join(data_dir, 'json'))
+    return sorted(shards)
+
+
+def shard_entry(data_dir: str, product: str, day: str, store=False, binary_snaps=False) -> dict:
+    """
+    Returns the manifest entry of a reformatted shard.
+
+    Returns
+    -------
+    entry: dict
+        'product', 'day', 'path', the shard relative to data_dir, 'orders' and 'snapshots', the directories of the
+        order files and snapshots in the shard, 'rows', 'first_sequence', 'last_sequence', 'first_time' and
+        'last_time', in epoch nanoseconds, of the orders, and 'snaps', the [sequence, order file, row] where replay
+        starts after each snapshot, see :py:class:`orderbookmdp.data_all.sequence_index.SequenceIndex`
+
+    """
+    path = os.path.join(product, day)
+    orders, snapshots = 'store' if store else 'feather', 'snap_bin' if binary_snaps else 'snap_json'
+    order_paths = os.path.join(data_dir, path, orders) + '/'
+    index = load_index(order_paths)
+    entry = {'product': product, 'day': day, 'path': path, 'orders': orders, 'snapshots': snapshots, 'rows': 0,
+             'first_sequence': None, 'last_sequence': None, 'first_time': None, 'last_time': None, 'snaps': []}
+    if index is None or len(index.files) == 0:
+        return entry
+
+    times = [to_nanoseconds(load_columns(order_paths + index.files[k], ['time'])['time']) for k in (0, -1)]
+    times = [time[time >= 0] for time in times]
+    entry.update(rows=int(index.rows.sum()), first_sequence=int(index.start_sequences[0]),
+                 last_sequence=int(index.end_sequences[-1]),
+                 first_time=int(times[0].min()) if len(times[0]) > 0 else None,
+                 last_time=int(times[1].max()) if len(times[1]) > 0 else None,
+                 snaps=[[int(sequence), int(k), int(row)] for sequence, k, row in
+                        sorted(zip(index.snap_sequences, index.snap_file_k, index.snap_rows))])
+    return entry
+
+
+def reformat_shard(data_dir, product, day, store=False, binary_snaps=False, **reformat_kwargs) -> dict:
+    """ Reformats a shard, see :py:func:`orderbookmdp.data_all.reformat_data.reformat`, and returns its entry. """
+    reformat(shard_dir(data_dir, product, day), 1, store, binary_snaps, **reformat_kwargs)
+    return shard_entry(data_dir, product, day, store, binary_snaps)
+
+
+def reformat_shards(data_dir, cores=1, store=False, binary_snaps=False, products=None, **reformat_kwargs):
+    """
+    Reformats the shards in data_dir, cores shards at a time, and records them in the shard manifest. Only the raw
+    files of a shard that are new or have changed are reformatted, see :py:mod:`orderbookmdp.data_all.manifest`.
+
+    Parameters
+    ----------
+    data_dir: str
+    cores: int
+        Number of shards to reformat at a time
+    store: bool
+    binary_snaps: bool
+    products: list
+        The products to reformat, all if None
+    reformat_kwargs
+        Passed to :py:func:`orderbookmdp.data_all.reformat_data.reformat`
+
+    """
+    if reformat_kwargs.get('checkpoint_messages') is not None or reformat_kwargs.get('checkpoint_seconds') is not None:
+        binary_snaps = True
+    shards = [(product, day) for product, day in list_shards(data_dir) if products is None or product in products]
+    manifest = ShardManifest(data_dir)
+    for entry in Parallel(n_jobs=cores, return_as='generator')(
+            delayed(reformat_shard)(data_dir, product, day, store, binary_snaps, **reformat_kwargs)
+            for product, day in shards):
+        manifest.record(entry)
+    manifest.save()
+
+
+class ShardManifest:
+    """
+    The manifest of the shards in a data directory, saved as data_dir/:py:data:`SHARDS_FILE`.
+
+    Attributes
+    ----------
+    data_dir: str
+    path: str
+        Path of the manifest
+    entries: dict
+        {product: {day: entry}}, see :py:func:`shard_entry`
+
+    """
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, SHARDS_FILE)
+        self.entries = {}
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                self.entries = ujson.load(f)
+
+    @property
+    def products(self) -> list:
+        return sorted(self.entries)
+
+    def record(self, entry: dict):
+        self.entries.setdefault(entry['product'], {})[entry['day']] = entry
+
+    def shards(self, product=None, time_range=None) -> list:
+        """
+        Returns the entries of the shards with orders, of product or all products, ordered by product and day. With a
+        time range [t0, t1), see :py:func:`orderbookmdp.order_book.utils.time_bound`, only the shards with orders in it are returned.
+
+        """
+        start, stop = (None, None) if time_range is None else (time_bound(time_range[0]), time_bound(time_range[1]))
+        shards = []
+        for product_ in ([product] if product is not None else self.products):
+            for day, entry in sorted(self.entries.get(product_, {}).items()):
+                if entry['rows'] == 0:
+                    continue
+                if entry['first_time'] is not None and ((stop is not None and entry['first_time'] >= stop) or
+                                                        (start is not None and entry['last_time'] < start)):
+                    continue
+                shards.append(entry)
+        return shards
+
+    def paths(self, entry: dict) -> (str, str):
+        """ Returns the order paths and snapshot paths of a shard, as taken by orderstream. """
+        shard = os.path.join(self.data_dir, entry['path'])
+        return os.path.join(shard, entry['orders']) + '/', os.path.join(shard, entry['snapshots']) + '/'
+
+    def sample(self, product=None, time_range=None, rng=random) -> dict:
+        """ Returns a random shard with orders after a snapshot, each chosen with a probability by its rows. """
+        shards = [entry for entry in self.shards(product, time_range) if any(k >= 0 for _, k, _ in entry['snaps'])]
+        if not shards:
+            raise ValueError('No shard to sample of product {}'.format(product))
+        return rng.choices(shards, weights=[entry['rows'] for entry in shards])[0]
+
+    def save(self):
+        """ Saves the manifest, the previous manifest is replaced only once the new one is written. """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            ujson.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,129 @@
+"""A binary format of level 3 snapshots.
+
+A snapshot is saved as numpy arrays per side of integer prices, integer lot sizes and the high and low 64 bits of the
+order ids, in the order of the level 3 snapshot, together with its sequence. Loading it parses nothing and the arrays
+are sent straight to the fill_snap of a market.
+
+Binary and json snapshots can be compressed, with a codec given by the extension added to their name, see
+:py:func:`orderbookmdp.data_all.recorder.write_compressed`.
+
+"""
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import ujson
+
+from orderbookmdp.data_all.message_store import split_order_ids
+from orderbookmdp.data_all.recorder import COMPRESSION_EXTENSIONS
+from orderbookmdp.data_all.recorder import path_compression
+from orderbookmdp.data_all.recorder import raw_extension
+from orderbookmdp.data_all.recorder import read_compressed
+from orderbookmdp.data_all.recorder import write_compressed
+from orderbookmdp.order_book.constants import SO_EXT_ID
+from orderbookmdp.order_book.constants import SO_PRICE
+from orderbookmdp.order_book.constants import SO_SIZE
+
+SNAP_EXTENSION = '.npz'
+SIDES = ('bids', 'asks')
+SIDE_COLUMNS = ('price', 'size', 'order_id_hi', 'order_id_lo')
+
+
+def snap_to_arrays(snap: dict, price_dec=2, lot_dec=8) -> dict:
+    """
+    Converts a level 3 snapshot to arrays.
+
+    Parameters
+    ----------
+    snap: dict
+        Format: {'sequence': int, 'asks':[order1, order2, ...], 'bids': [order1, order2, ...]}
+    price_dec: int
+        Number of decimals in the tick size
+    lot_dec: int
+        Number of decimals in the lot size
+
+    Returns
+    -------
+    snap: dict
+        Format: {'sequence': int, 'multiplier': int, 'lot_multiplier': int, 'bids': {'price': numpy.ndarray,
+        'size': numpy.ndarray, 'order_id_hi': numpy.ndarray, 'order_id_lo': numpy.ndarray}, 'asks': {...}}
+
+    """
+    arrays = {'sequence': int(snap['sequence']), 'multiplier': 10**price_dec, 'lot_multiplier': 10**lot_dec}
+    for side in SIDES:
+        orders = snap[side]
+        prices = np.array([float(order[SO_PRICE]) for order in orders], dtype=np.float64)
+        sizes = np.array([float(order[SO_SIZE]) for order in orders], dtype=np.float64)
+        order_ids = [order[SO_EXT_ID] for order in orders]
+        order_id_hi, order_id_lo = split_order_ids(pd.Series(order_ids, dtype=object))
+        arrays[side] = {'price': np.round(prices * 10**price_dec).astype(np.int64),
+                        'size': np.round(sizes * 10**lot_dec).astype(np.int64),
+                        'order_id_hi': order_id_hi, 'order_id_lo': order_id_lo}
+    return arrays
+
+
+def binary_snap_name(sequence: int, compression=None) -> str:
+    """ Returns the name of the binary snapshot with sequence, compressed with compression. """
+    return 'snap_' + str(sequence) + SNAP_EXTENSION + raw_extension(compression)
+
+
+def is_binary_snap_path(path: str) -> bool:
+    """ Returns True if path is a binary snapshot, compressed or not. """
+    return SNAP_EXTENSION in os.path.basename(path)
+
+
+def find_binary_snap(snap_dir: str, sequence: int) -> str:
+    """ Returns the path of the binary snapshot with sequence in snap_dir with any compression, None if there is none. """
+    for compression in (None,) + tuple(COMPRESSION_EXTENSIONS):
+        path = snap_dir + binary_snap_name(sequence, compression)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def save_binary_snap(snap: dict, path: str, level=None):
+    """
+    Saves a snapshot converted by :py:func:`snap_to_arrays` to path, compressed at level if path has the extension of
+    a compression.
+
+    """
+    arrays = {'sequence': snap['sequence'], 'multiplier': snap['multiplier'], 'lot_multiplier': snap['lot_multiplier']}
+    for side in SIDES:
+        for column in SIDE_COLUMNS:
+            arrays[side + '_' + column] = snap[side][column]
+    if path_compression(path) is None:
+        np.savez(path, **arrays)
+        return
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    write_compressed(path, buffer.getvalue(), level)
+
+
+def load_binary_snap(path: str) -> dict:
+    """
+    Loads a snapshot saved by :py:func:`save_binary_snap`, in the format of :py:func:`snap_to_arrays`.
+
+    """
+    source = path if path_compression(path) is None else io.BytesIO(read_compressed(path))
+    with np.load(source) as arrays:
+        snap = {'sequence': int(arrays['sequence']), 'multiplier': int(arrays['multiplier']),
+                'lot_multiplier': int(arrays['lot_multiplier'])}
+        for side in SIDES:
+            snap[side] = {column: arrays[side + '_' + column] for column in SIDE_COLUMNS}
+    return snap
+
+
+def is_binary_snap(snap: dict) -> bool:
+    """ Returns True if the snapshot is in the format of :py:func:`snap_to_arrays`. """
+    return isinstance(snap['bids'], dict)
+
+
+def save_json_snap(snap: dict, path: str, level=None):
+    """ Saves a level 3 snapshot as json to path, compressed at level if path has the extension of a compression. """
+    write_compressed(path, ujson.dumps(snap).encode(), level)
+
+
+def load_json_snap(path: str) -> dict:
+    """ Loads a level 3 snapshot saved by :py:func:`save_json_snap`. """
+    return ujson.loads(read_compressed(path))
@@ -11,6 +11,10 @@ Order in Book : (order_id, size, side, price)
 Quotes : (ask, ask_v, bid, bid_v)
 External Trader = -1
 Snapshot Order : [price, size, external_market_order_id]
+Message Types : RECEIVED = 0, OPEN = 1, DONE = 2, MATCH = 3, CHANGE = 4
+Order Types : LIMIT = 0, MARKET = 1
+Done Reasons : FILLED = 0, CANCELED = 1
+Unknown Code = -1
 
 """
 BUY = 0
@@ -45,3 +49,22 @@ EXT_ID = -1
 SO_PRICE = 0
 SO_SIZE = 1
 SO_EXT_ID = 2
+# Message Types
+M_RECEIVED = 0
+M_OPEN = 1
+M_DONE = 2
+M_MATCH = 3
+M_CHANGE = 4
+# Order Types
+OT_LIMIT = 0
+OT_MARKET = 1
+# Done Reasons
+R_FILLED = 0
+R_CANCELED = 1
+# Unknown Code, for example the side of a message without a side
+UNKNOWN = -1
+# Codes of the exchange strings
+MESSAGE_TYPE_CODES = {'received': M_RECEIVED, 'open': M_OPEN, 'done': M_DONE, 'match': M_MATCH, 'change': M_CHANGE}
+ORDER_TYPE_CODES = {'limit': OT_LIMIT, 'market': OT_MARKET}
+REASON_CODES = {'filled': R_FILLED, 'canceled': R_CANCELED}
+SIDE_CODES = {'buy': BUY, 'sell': SELL}
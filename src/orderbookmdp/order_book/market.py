@@ -13,6 +13,7 @@ messages can be sent.
 """
 
 import abc
+import time
 
 import numpy as np
 from custom_inherit import DocInheritMeta
@@ -20,17 +21,35 @@ from custom_inherit import DocInheritMeta
 from orderbookmdp._orderbookmdp import CyOrderBook
 from orderbookmdp.order_book.constants import BUY
 from orderbookmdp.order_book.constants import EXT_ID
+from orderbookmdp.order_book.constants import M_CHANGE
+from orderbookmdp.order_book.constants import M_DONE
+from orderbookmdp.order_book.constants import M_RECEIVED
+from orderbookmdp.order_book.constants import MESSAGE_TYPE_CODES
+from orderbookmdp.order_book.constants import O_PRICE
+from orderbookmdp.order_book.constants import O_SIDE
+from orderbookmdp.order_book.constants import O_SIZE
 from orderbookmdp.order_book.constants import OIB_ID
+from orderbookmdp.order_book.constants import ORDER_TYPE_CODES
+from orderbookmdp.order_book.constants import OT_LIMIT
+from orderbookmdp.order_book.constants import OT_MARKET
+from orderbookmdp.order_book.constants import R_CANCELED
+from orderbookmdp.order_book.constants import REASON_CODES
 from orderbookmdp.order_book.constants import SELL
 from orderbookmdp.order_book.constants import SO_EXT_ID
 from orderbookmdp.order_book.constants import SO_PRICE
 from orderbookmdp.order_book.constants import SO_SIZE
 from orderbookmdp.order_book.order_books import OrderBook
 from orderbookmdp.order_book.order_books import PyOrderBook
+from orderbookmdp.order_book.utils import batch_rows
+from orderbookmdp.order_book.utils import check_market_batch
+from orderbookmdp.order_book.utils import join_order_ids
+from orderbookmdp.order_book.utils import stop_row
+from orderbookmdp.order_book.utils import to_code
 from orderbookmdp.order_book.utils import to_int
+from orderbookmdp.order_book.utils import uuid_to_int
 
 
-def get_ob(ob_type: str, price_levels_type: str, price_level_type: str) -> OrderBook:
+def get_ob(ob_type: str, price_levels_type: str, price_level_type: str, lot_size=1e-8) -> OrderBook:
     """
     Returns an order book depending on the parameters
 
@@ -42,6 +61,8 @@ def get_ob(ob_type: str, price_levels_type: str, price_level_type: str) -> Order
         Type or price levels for the order book.
     price_level_type: str
         Type of order level for the price levels
+    lot_size: float
+        The minimum multiple of size in a market. The cython order book keeps sizes as integer multiples of it.
 
     Returns
     -------
@@ -49,9 +70,9 @@ def get_ob(ob_type: str, price_levels_type: str, price_level_type: str) -> Order
 
     """
     if ob_type == 'py':
-        return PyOrderBook(price_levels_type, price_level_type)
+        return PyOrderBook(price_level_type=price_level_type, price_levels_type=price_levels_type)
     if ob_type == 'cy':
-        return CyOrderBook(price_levels_type, price_level_type)
+        return CyOrderBook(price_level_type=price_level_type, price_levels_type=price_levels_type, lot_size=lot_size)
     else:
         raise NotImplementedError(ob_type)
 
@@ -71,11 +92,15 @@ class Market(metaclass=DocInheritMeta(style="numpy", abstract_base_class=True)):
         Number of decimals in tick_size
     multipler: int
         10**tick_dec. Used to multiply price to int
+    lot_size: float
+        The minimum multiple of size in a market.
+    lot_multiplier: int
+        1/lot_size. Used to convert integer lot sizes of reformatted data to float sizes
 
     """
 
     def __init__(self, tick_size=0.01, ob_type='py', price_level_type='ordered_dict',
-                 price_levels_type='sorted_dict'):
+                 price_levels_type='sorted_dict', lot_size=1e-8):
         """
         Parameters
         ----------
@@ -87,11 +112,15 @@ class Market(metaclass=DocInheritMeta(style="numpy", abstract_base_class=True)):
             Type or price levels for the order book.
         price_level_type: str
             Type of order level for the price levels
+        lot_size: float
+            The minimum multiple of size in a market.
         """
-        self.ob = get_ob(ob_type, price_level_type, price_levels_type)
+        self.ob = get_ob(ob_type, price_levels_type=price_levels_type, price_level_type=price_level_type, lot_size=lot_size)
         self.tick_size = tick_size
         self.tick_dec = int(np.log10(1 / tick_size))
         self.multiplier = 10**self.tick_dec
+        self.lot_size = lot_size
+        self.lot_multiplier = 10**int(round(np.log10(1 / lot_size)))
 
     @abc.abstractmethod
     def send_message(self, message: dict) -> (list, tuple):
@@ -99,9 +128,10 @@ class Market(metaclass=DocInheritMeta(style="numpy", abstract_base_class=True)):
 
         Parameters
         ----------
-        message: SimpleNamespace
+        message: Message
             Can for example be a limit order, market order, cancelation message etc.
-            See :py:mod:`OrderBookRL.order_book.order_types` for different types
+            See :py:mod:`OrderBookRL.order_book.order_types` for different types. Any object with the same
+            attributes, such as a :py:class:`types.SimpleNamespace`, is also accepted.
 
         Returns
         -------
@@ -124,57 +154,69 @@ class ExternalMarket(Market):
     ----------
     external_market_order_ids : dict
         Keeps track of the external order ids if for example a cancellation or update of an external order occurs.
-    time : str
-        The current time of the market
+        Keyed by the 128-bit integer value of the external order id, see
+        :py:func:`orderbookmdp.order_book.utils.uuid_to_int`.
+    time : int or str
+        The current time of the market, the time of the last message in epoch nanoseconds or as an exchange string
+    bars : BarBuilder
+        If set, the trades of every message are aggregated to bars, see
+        :py:class:`orderbookmdp._orderbookmdp.BarBuilder`
 
     """
     def __init__(self, tick_size=0.01, ob_type='py', price_level_type='ordered_dict',
-                 price_levels_type='sorted_dict',):
-        super(ExternalMarket, self).__init__(tick_size, ob_type, price_level_type, price_levels_type)
+                 price_levels_type='sorted_dict', lot_size=1e-8):
+        super(ExternalMarket, self).__init__(tick_size, ob_type, price_level_type, price_levels_type, lot_size)
         self.external_market_order_ids = {}
         self.time = '2000-1-1 00:00'
+        self.bars = None
 
-    def send_message(self, mess: dict, external=False) -> (list, tuple):
+    def send_message(self, mess: dict, external=False, lots=False) -> (list, tuple):
         """
 
         Parameters
         ----------
         mess
+            The type, order_type and reason of the message are integer codes, see
+            :py:mod:`orderbookmdp.order_book.constants`. Raw exchange strings are also accepted.
         external: bool
             If the message is an external message
+        lots: bool
+            If the size of an external message is in integer lots, as in reformatted data, else it is a float size
+            as in raw exchange messages
 
         """
 
         trades, order_in_book = [], None
-        mess_type = mess.type
+        mess_type = to_code(mess.type, MESSAGE_TYPE_CODES)
 
         if external:
             self.time = mess.time
 
-        if mess_type == 'received':
-            order_type = mess.order_type
-            if order_type == 'limit':
+        if mess_type == M_RECEIVED:
+            order_type = to_code(mess.order_type, ORDER_TYPE_CODES)
+            if order_type == OT_LIMIT:
 
                 if external:
-                    trades, order_in_book = self.ob.limit(to_int(mess.price, self.multiplier),
-                                                          mess.side, mess.size, mess.trader_id, self.time)
+                    trades, order_in_book = self.ob.limit(to_int(mess.price, self.multiplier), mess.side,
+                                                          self.external_size(mess.size, lots), mess.trader_id, self.time)
                 else:
                     trades, order_in_book = self.ob.limit(mess.price,
                                                           mess.side, mess.size, mess.trader_id, self.time)
 
                 if external and order_in_book is not None:
-                    self.external_market_order_ids[mess.order_id] = order_in_book[OIB_ID]
-            elif order_type == 'market':
+                    self.external_market_order_ids[self.external_order_id(mess.order_id)] = order_in_book[OIB_ID]
+            elif order_type == OT_MARKET:
                 if mess.size != -1:
-                    trades = self.ob.market_order(mess.size, mess.side, mess.trader_id, self.time)
+                    size = self.external_size(mess.size, lots) if external else mess.size
+                    trades = self.ob.market_order(size, mess.side, mess.trader_id, self.time)
                 else:
                     trades = self.ob.market_order_funds(mess.funds*self.multiplier, mess.side,
                                                         mess.trader_id, self.time)
-        elif mess_type == 'done':
-            if mess.reason == 'canceled':
+        elif mess_type == M_DONE:
+            if to_code(mess.reason, REASON_CODES) == R_CANCELED:
                 if external:
                     try:
-                        order_id = self.external_market_order_ids.pop(mess.order_id)
+                        order_id = self.external_market_order_ids.pop(self.external_order_id(mess.order_id))
                         self.ob.cancel(order_id)
                     except (ValueError, KeyError) as e:
                         # TODO Fix
@@ -188,15 +230,122 @@ class ExternalMarket(Market):
                         # TODO Fix
                         pass
 
-        elif mess_type == 'change':
+        elif mess_type == M_CHANGE:
             if external:
-                order_id = self.external_market_order_ids[mess.order_id]
-                self.ob.update(order_id, mess.size)
+                order_id = self.external_market_order_ids[self.external_order_id(mess.order_id)]
+                self.ob.update(order_id, self.external_size(mess.size, lots))
             else:
                 self.ob.update(mess.order_id, mess.size)
 
+        if trades and self.bars is not None:
+            self.bars.add_trades(trades)
         return trades, order_in_book
 
+    def send_messages(self, batch: dict, latencies=None) -> list:
+        """
+        Sends a batch of external messages given as columns, see
+        :py:func:`orderbookmdp.data_all.orderstream.orderstream_batches`. The sizes are integer lots if the size
+        column has an integer dtype, else float sizes.
+
+        Parameters
+        ----------
+        batch: dict
+            Column name to numpy array
+        latencies: numpy.ndarray
+            If given, the nanoseconds each message took is written to it
+
+        Returns
+        -------
+        trades: list
+            The trades of all the messages
+
+        Raises
+        ------
+        ValueError
+            If the batch misses a column of :py:data:`orderbookmdp.order_book.utils.MARKET_COLUMNS`
+
+        """
+        check_market_batch(batch)
+        trades = []
+        lots = np.issubdtype(batch['size'].dtype, np.integer)
+        for k, mess in enumerate(batch_rows(batch)):
+            if latencies is not None:
+                start = time.perf_counter_ns()
+            trades_, _ = self.send_message(mess, external=True, lots=lots)
+            if trades_:
+                trades.extend(trades_)
+            if latencies is not None:
+                latencies[k] = time.perf_counter_ns() - start
+        return trades
+
+    def fast_forward(self, batch: dict, until_time=None, until_sequence=None) -> int:
+        """
+        Applies the external messages of a batch before until_time and until_sequence, for example to position the
+        market at the start of an episode, and discards their trades, which are not added to the bars either. The
+        cython market applies them in a compiled loop, see
+        :py:meth:`orderbookmdp._orderbookmdp.CyExternalMarket.fast_forward`.
+
+        Parameters
+        ----------
+        batch: dict
+            Column name to numpy array
+        until_time
+            See :py:func:`orderbookmdp.order_book.utils.stop_row`
+        until_sequence: int
+
+        Returns
+        -------
+        stop: int
+            The number of messages applied, the rest of the batch is to be sent after them
+
+        """
+        stop = stop_row(batch, until_time, until_sequence)
+        bars, self.bars = self.bars, None
+        try:
+            self.send_messages({name: column[:stop] for name, column in batch.items()})
+        finally:
+            self.bars = bars
+        return stop
+
+    @staticmethod
+    def external_order_id(order_id) -> int:
+        """
+        Returns the key of an external order id. Reformatted data already carries the integer value of the order
+        id, raw exchange messages carry the UUID string.
+
+        Parameters
+        ----------
+        order_id: int or str
+
+        Returns
+        -------
+        order_id: int
+
+        """
+        if type(order_id) is str:
+            return uuid_to_int(order_id)
+        return order_id
+
+    def external_size(self, size, lots=False) -> float:
+        """
+        Returns the float size of an external message. Reformatted data has integer lot sizes, raw exchange
+        messages have float sizes.
+
+        Parameters
+        ----------
+        size: int or float
+        lots: bool
+            If size is in integer lots
+
+        Returns
+        -------
+        size: float
+
+        """
+        if lots:
+            return size / self.lot_multiplier
+        return size
+
     def fill_snap(self, snap: dict):
         """
         Fills the market with orders from a snapshot. The snapshot contains all limit orders in a market
@@ -207,15 +356,112 @@ class ExternalMarket(Market):
         snap: dict
             Contains all the limit orders in the market.
             Format: {'asks':[order1, order2, ...], 'bids': [order1, order2, ...]
+            or a binary snapshot, see :py:meth:`fill_binary_snap`.
 
         """
+        if isinstance(snap['bids'], dict):
+            self.fill_binary_snap(snap)
+            return
+
         for message in snap['bids']:
             _, oib = self.ob.limit(to_int(float(message[SO_PRICE]), self.multiplier), BUY, float(message[SO_SIZE]),
                                    EXT_ID, self.time)
             if oib is not None:
-                self.external_market_order_ids[message[SO_EXT_ID]] = oib[OIB_ID]
+                self.external_market_order_ids[uuid_to_int(message[SO_EXT_ID])] = oib[OIB_ID]
         for message in snap['asks']:
             _, oib = self.ob.limit(to_int(float(message[SO_PRICE]), self.multiplier), SELL, float(message[SO_SIZE]),
                                    EXT_ID, self.time)
             if oib is not None:
-                self.external_market_order_ids[message[SO_EXT_ID]] = oib[OIB_ID]
+                self.external_market_order_ids[uuid_to_int(message[SO_EXT_ID])] = oib[OIB_ID]
+
+    def fill_binary_snap(self, snap: dict):
+        """
+        Fills the market with orders from a binary snapshot, see :py:mod:`orderbookmdp.data_all.snapshots`.
+
+        Parameters
+        ----------
+        snap: dict
+            Contains the prices, lot sizes and order ids of all the limit orders in the market as arrays.
+
+        """
+        if snap['multiplier'] != self.multiplier:
+            raise ValueError('The tick size of the snapshot differs from the market')
+        for side, orders in ((BUY, snap['bids']), (SELL, snap['asks'])):
+            sizes = orders['size'] / snap['lot_multiplier']
+            order_ids = join_order_ids(orders['order_id_hi'], orders['order_id_lo'])
+            for price, size, order_id in zip(orders['price'].tolist(), sizes.tolist(), order_ids):
+                _, oib = self.ob.limit(price, side, size, EXT_ID, self.time)
+                if oib is not None:
+                    self.external_market_order_ids[order_id] = oib[OIB_ID]
+
+    def resync_snap(self, snap: dict, stats=None) -> list:
+        """
+        Resyncs the external orders of the market to a snapshot, for example after a gap in the external messages,
+        by applying only the differences per external order id instead of filling a new market. Orders missing in
+        the snapshot are canceled, orders with a new size are updated and new orders, or orders that moved price,
+        are added last in their price level. Orders of agents are kept.
+
+        Parameters
+        ----------
+        snap: dict
+            A level 3 or binary snapshot, see :py:meth:`fill_snap`
+        stats: dict
+            Updated with the number of orders 'added', 'canceled' and 'changed'
+
+        Returns
+        -------
+        trades: list
+            The trades of added orders against orders of agents
+
+        """
+        target = self.snap_orders(snap)
+        lots = isinstance(self.ob, CyOrderBook)
+        trades = []
+        added, canceled, changed = 0, 0, 0
+        for external_id, order_id in list(self.external_market_order_ids.items()):
+            new = target.get(external_id)
+            order = self.ob.orders.get(order_id)
+            if order is None:  # Already matched
+                del self.external_market_order_ids[external_id]
+            elif new is None or new[0] != order[O_SIDE] or new[1] != order[O_PRICE]:
+                self.ob.cancel(order_id)
+                del self.external_market_order_ids[external_id]
+                canceled += 1
+            else:
+                size = order[O_SIZE] / self.lot_multiplier if lots else order[O_SIZE]
+                if new[2] != size:
+                    self.ob.update(order_id, new[2])
+                    changed += 1
+                del target[external_id]
+
+        for external_id, (side, price, size) in target.items():  # In the order of the snapshot
+            trades_, oib = self.ob.limit(price, side, size, EXT_ID, self.time)
+            if trades_:
+                trades.extend(trades_)
+            if oib is not None:
+                self.external_market_order_ids[external_id] = oib[OIB_ID]
+            added += 1
+
+        if stats is not None:
+            stats['added'] = stats.get('added', 0) + added
+            stats['canceled'] = stats.get('canceled', 0) + canceled
+            stats['changed'] = stats.get('changed', 0) + changed
+        return trades
+
+    def snap_orders(self, snap: dict) -> dict:
+        """ Returns the external order id to (side, price, size) of every order in a snapshot, in snapshot order. """
+        orders = {}
+        if isinstance(snap['bids'], dict):
+            if snap['multiplier'] != self.multiplier:
+                raise ValueError('The tick size of the snapshot differs from the market')
+            for side, side_orders in ((BUY, snap['bids']), (SELL, snap['asks'])):
+                sizes = side_orders['size'] / snap['lot_multiplier']
+                order_ids = join_order_ids(side_orders['order_id_hi'], side_orders['order_id_lo'])
+                for price, size, order_id in zip(side_orders['price'].tolist(), sizes.tolist(), order_ids):
+                    orders[order_id] = (side, price, size)
+        else:
+            for side, side_orders in ((BUY, snap['bids']), (SELL, snap['asks'])):
+                for message in side_orders:
+                    orders[uuid_to_int(message[SO_EXT_ID])] = (side, to_int(float(message[SO_PRICE]), self.multiplier),
+                                                               float(message[SO_SIZE]))
+        return orders
@@ -69,7 +69,7 @@ class OrderBook(metaclass=DocInheritMeta(style="numpy", abstract_base_class=True
         self.order_id = 0
 
     @abc.abstractmethod
-    def limit(self, price: int, side: int, size: float, trader_id: int, time: str) -> (list, tuple):
+    def limit(self, price: int, side: int, size: float, trader_id: int, time) -> (list, tuple):
         """
         Handles a limit order sent to the order book. Matches the limit order if possible,
         otherwise puts it in the order book.
@@ -84,7 +84,7 @@ class OrderBook(metaclass=DocInheritMeta(style="numpy", abstract_base_class=True
             Size of the order.
         trader_id: int
             Id of the trader sending the order
-        time: str
+        time: int or str
 
         Returns
         -------
@@ -98,7 +98,7 @@ class OrderBook(metaclass=DocInheritMeta(style="numpy", abstract_base_class=True
         """
 
     @abc.abstractmethod
-    def market_order(self, size: float, side: int, trader_id: int, time: str) -> list:
+    def market_order(self, size: float, side: int, trader_id: int, time) -> list:
         """
         Handles a market order sent to the order book. Matches the market order if possible.
 
@@ -110,7 +110,7 @@ class OrderBook(metaclass=DocInheritMeta(style="numpy", abstract_base_class=True
             Size of the order.
         trader_id: int
             Id of the trader sending the order
-        time: str
+        time: int or str
 
         Returns
         -------
@@ -120,7 +120,7 @@ class OrderBook(metaclass=DocInheritMeta(style="numpy", abstract_base_class=True
         """
 
     @abc.abstractmethod
-    def market_order_funds(self, funds: float, side: int, trader_id: int, time: str) -> list:
+    def market_order_funds(self, funds: float, side: int, trader_id: int, time) -> list:
         """
         Handles a market order sent to the order book. Matches the market order if possible.
 
@@ -132,7 +132,7 @@ class OrderBook(metaclass=DocInheritMeta(style="numpy", abstract_base_class=True
             BUY or SELL, see :py:mod:´OrderBookRL.order_book.constants´
         trader_id: int
             Id of the trader sending the order
-        time: str
+        time: int or str
 
         Returns
         -------
@@ -171,7 +171,7 @@ class OrderBook(metaclass=DocInheritMeta(style="numpy", abstract_base_class=True
 class PyOrderBook(OrderBook):
     """An implementation of the abstract class :py:class:`OrderBook`.
     """
-    def limit(self, price: int, side: int, size: float, trader_id: int, time: str) -> (list, tuple):
+    def limit(self, price: int, side: int, size: float, trader_id: int, time) -> (list, tuple):
         trades = []
         if side == BUY:
             if self.price_levels.exist_sell_orders():
@@ -273,7 +273,7 @@ class PyOrderBook(OrderBook):
             price_level = self.price_levels.get_level(order[O_SIDE], order[O_PRICE])
             price_level.update(order, size - order[O_SIZE])
 
-    def market_order(self, size: float, side: int, trader_id: int, time: str) -> list:
+    def market_order(self, size: float, side: int, trader_id: int, time) -> list:
         trades = []
         if side == BUY:
             while (size > 0) and self.price_levels.exist_sell_orders():
@@ -325,7 +325,7 @@ class PyOrderBook(OrderBook):
                 self.price_levels.remove_level(BUY, bid)
         return trades
 
-    def market_order_funds(self, funds: float, side: int, trader_id: int, time: str) -> list:
+    def market_order_funds(self, funds: float, side: int, trader_id: int, time) -> list:
         trades = []
         if side == BUY:
             while (funds > 0) and self.price_levels.exist_sell_orders():
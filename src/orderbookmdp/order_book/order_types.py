@@ -1,7 +1,20 @@
-from types import SimpleNamespace
+"""Messages that can be sent to a market, see :py:meth:`orderbookmdp.order_book.market.Market.send_message`.
 
+The messages are :py:class:`Message` objects, a compact record with typed fields where the message type, order type
+and reason are integer codes from :py:mod:`orderbookmdp.order_book.constants`. The markets also accept any object with
+the same attributes, such as a :py:class:`types.SimpleNamespace` or a row of a reformatted dataframe.
 
-def limit_message(side: int, size: float, price: float, trader_id: int) -> SimpleNamespace:
+"""
+from orderbookmdp._orderbookmdp import Message
+from orderbookmdp.order_book.constants import M_CHANGE
+from orderbookmdp.order_book.constants import M_DONE
+from orderbookmdp.order_book.constants import M_RECEIVED
+from orderbookmdp.order_book.constants import OT_LIMIT
+from orderbookmdp.order_book.constants import OT_MARKET
+from orderbookmdp.order_book.constants import R_CANCELED
+
+
+def limit_message(side: int, size: float, price: float, trader_id: int) -> Message:
     """
     Returns a limit order message
 
@@ -18,12 +31,12 @@ def limit_message(side: int, size: float, price: float, trader_id: int) -> Simpl
 
     Returns
     -------
-    message: SimpleNamespace
+    message: Message
         The limit order message
 
     """
-    return SimpleNamespace(side=side, size=size, price=price, trader_id=trader_id,
-                           order_type='limit', type='received')
+    return Message(side=side, size=size, price=price, trader_id=trader_id,
+                   order_type=OT_LIMIT, type=M_RECEIVED)
 
 
 def market_message(side: int, size: float, trader_id: int, funds=None):
@@ -43,19 +56,19 @@ def market_message(side: int, size: float, trader_id: int, funds=None):
 
     Returns
     -------
-    message: SimpleNamespace
+    message: Message
         The market order message
 
     """
     if funds:
-        return SimpleNamespace(side=side, trader_id=trader_id, funds=funds, size=-1,
-                               type='received', order_type='market')
+        return Message(side=side, trader_id=trader_id, funds=funds, size=-1,
+                       type=M_RECEIVED, order_type=OT_MARKET)
     else:
-        return SimpleNamespace(side=side, size=size, trader_id=trader_id,
-                               type='received', order_type='market')
+        return Message(side=side, size=size, trader_id=trader_id,
+                       type=M_RECEIVED, order_type=OT_MARKET)
 
 
-def cancel_message(order_id: int) -> SimpleNamespace:
+def cancel_message(order_id: int) -> Message:
     """
     Returns a cancellation message
 
@@ -66,14 +79,14 @@ def cancel_message(order_id: int) -> SimpleNamespace:
 
     Returns
     -------
-    message: SimpleNamespace
+    message: Message
         The cancellation message
 
     """
-    return SimpleNamespace(order_id=order_id, type='done', reason='canceled')
+    return Message(order_id=order_id, type=M_DONE, reason=R_CANCELED)
 
 
-def change_message(order_id: int, size: float) -> SimpleNamespace:
+def change_message(order_id: int, size: float) -> Message:
     """
     Returns a order change message
 
@@ -86,8 +99,8 @@ def change_message(order_id: int, size: float) -> SimpleNamespace:
 
     Returns
     -------
-    message: SimpleNamespace
+    message: Message
         The order change message
 
     """
-    return SimpleNamespace(order_id=order_id, size=size, type='change')
+    return Message(order_id=order_id, size=size, type=M_CHANGE)
@@ -1,3 +1,13 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# A message of reformatted data, see :py:func:`batch_rows`
+Order = namedtuple('Order', ['sequence', 'type', 'order_type', 'reason', 'side', 'price', 'size', 'funds', 'trader_id',
+                             'order_id', 'time'])
+# The fields of an Order an external market reads
+MARKET_COLUMNS = ('type', 'order_type', 'reason', 'side', 'price', 'size', 'funds', 'trader_id', 'order_id', 'time')
 
 
 def to_int(price: float, multiplier: int):
@@ -35,3 +45,208 @@ def to_float(price: int, tick_dec: int, multiplier: int):
 
     """
     return round(price/float(multiplier), tick_dec)
+
+
+def to_lots(size: float, lot_multiplier: int):
+    """ Converts a size to an integer number of lots.
+
+    :math:`size_{lots} = round(size_{float}*multiplier)`
+
+    Parameters
+    ----------
+    size : float
+    lot_multiplier : int
+
+    Returns
+    -------
+    size : int
+
+    """
+    return int(round(size*lot_multiplier))
+
+
+def to_code(value, codes: dict) -> int:
+    """ Returns the integer code of a message field such as the message type. Raw exchange strings are looked up
+    in codes, integer codes are returned as they are. A field missing from a projection, None, raises a ValueError.
+
+    Parameters
+    ----------
+    value : int or str
+    codes : dict
+        For example :py:data:`orderbookmdp.order_book.constants.MESSAGE_TYPE_CODES`
+
+    Returns
+    -------
+    code : int
+
+    """
+    if type(value) is str:
+        return codes[value]
+    if value is None:
+        raise ValueError('A field of the message is None, a market needs the fields of MARKET_COLUMNS')
+    return value
+
+
+def uuid_to_int(order_id: str) -> int:
+    """ Converts an exchange order id (an UUID string) to its 128-bit integer value.
+
+    Parameters
+    ----------
+    order_id : str
+        For example '6d9cab8e-9c30-45d4-b4a5-d1c7b4e0c3f5'
+
+    Returns
+    -------
+    order_id : int
+
+    """
+    return int(order_id.replace('-', ''), 16)
+
+
+def time_to_ns(time) -> int:
+    """ Converts the time of a message to epoch nanoseconds. Reformatted messages already carry the time in
+    nanoseconds, exchange messages carry it as an ISO 8601 string.
+
+    Parameters
+    ----------
+    time : int or str
+        For example 1533117600000001000 or '2018-08-01T10:00:00.000001Z'
+
+    Returns
+    -------
+    time : int
+
+    """
+    if isinstance(time, str):
+        return pd.Timestamp(time).value
+    return int(time)
+
+
+def time_bound(time) -> int:
+    """ Returns a bound of a time range, an ISO 8601 string, a timestamp or epoch nanoseconds, as nanoseconds. """
+    return None if time is None else pd.Timestamp(time).value
+
+
+def to_nanoseconds(times: np.ndarray) -> np.ndarray:
+    """
+    Parses message times, ISO 8601 strings as sent by the exchange, to int64 epoch nanoseconds. Times that already are
+    integers are returned as they are and missing times are set to -1.
+
+    """
+    times = np.asarray(times)
+    if np.issubdtype(times.dtype, np.integer):
+        return times.astype(np.int64)
+    if np.issubdtype(times.dtype, np.datetime64):
+        return times.astype('datetime64[ns]').astype(np.int64)
+    parsed = pd.to_datetime(pd.Series(times), utc=True, format='ISO8601')
+    nanoseconds = parsed.dt.tz_localize(None).values.astype('datetime64[ns]').astype(np.int64)
+    nanoseconds[parsed.isna().values] = -1
+    return nanoseconds
+
+
+def market_columns(columns):
+    """
+    Returns the columns of a projection with the columns an external market needs, see :py:data:`MARKET_COLUMNS`,
+    appended. All columns are loaded if columns is None.
+
+    Parameters
+    ----------
+    columns: list
+
+    Returns
+    -------
+    columns: list
+
+    """
+    if columns is None:
+        return None
+    return list(columns) + [name for name in MARKET_COLUMNS if name not in columns]
+
+
+def check_market_batch(batch: dict):
+    """
+    Raises a ValueError if a batch of columns misses a column an external market needs, see :py:data:`MARKET_COLUMNS`.
+    The order ids are split in 'order_id_hi' and 'order_id_lo'.
+
+    Parameters
+    ----------
+    batch: dict
+        Column name to numpy array
+
+    """
+    names = [name for name in MARKET_COLUMNS if name != 'order_id'] + ['order_id_hi', 'order_id_lo']
+    missing = [name for name in names if name not in batch]
+    if missing:
+        raise ValueError('The batch has no {} column, load the stream with market_columns'.format(', '.join(missing)))
+
+
+def stop_row(columns: dict, until_time=None, until_sequence=None) -> int:
+    """
+    Returns the number of messages before the first one at or after until_time or until_sequence, the row where a
+    replay up to the bound stops. The sequences of the messages are increasing.
+
+    Parameters
+    ----------
+    columns: dict
+        Column name to numpy array, with the 'sequence' column and the 'time' column for until_time
+    until_time
+        See :py:func:`time_bound`
+    until_sequence: int
+
+    Returns
+    -------
+    stop: int
+
+    """
+    stop = len(columns['sequence'])
+    if until_sequence is not None:
+        stop = int(np.searchsorted(columns['sequence'], until_sequence))
+    if until_time is not None:
+        late = np.flatnonzero(to_nanoseconds(columns['time'][:stop]) >= time_bound(until_time))
+        if len(late) > 0:
+            stop = int(late[0])
+    return stop
+
+
+def join_order_ids(order_id_hi: np.ndarray, order_id_lo: np.ndarray) -> list:
+    """
+    Joins the high and low 64 bits of reformatted order ids to their 128-bit integer value.
+
+    Parameters
+    ----------
+    order_id_hi: numpy.ndarray
+    order_id_lo: numpy.ndarray
+
+    Returns
+    -------
+    order_ids: list
+        The order ids as python ints
+
+    """
+    return [(hi << 64) | lo for hi, lo in zip(order_id_hi.tolist(), order_id_lo.tolist())]
+
+
+def batch_rows(batch: dict):
+    """
+    Yields the messages of a batch of columns as :py:class:`Order` with the order ids joined to their integer value.
+    Fields of columns missing from the batch are None.
+
+    Parameters
+    ----------
+    batch: dict
+        Column name to numpy array, see :py:data:`orderbookmdp.data_all.message_store.COLUMNS`
+
+    Yields
+    ------
+    order: Order
+
+    """
+    n_rows = len(next(iter(batch.values()))) if batch else 0
+    values = []
+    for name in Order._fields:
+        if name == 'order_id' and 'order_id_hi' in batch:
+            values.append(join_order_ids(batch['order_id_hi'], batch['order_id_lo']))
+        else:
+            values.append(batch[name].tolist() if name in batch else [None] * n_rows)
+    for row in zip(*values):
+        yield Order._make(row)
@@ -10,6 +10,8 @@ from orderbookmdp.order_book.constants import O_SIZE
 from orderbookmdp.order_book.constants import T_OID
 from orderbookmdp.order_book.constants import T_SIZE
 from orderbookmdp.order_book.order_books import get_price_levels
+from orderbookmdp.order_book.utils import market_columns
+from orderbookmdp.order_book.utils import time_to_ns
 from orderbookmdp.rl.env_utils import quote_differs  # noqa
 from orderbookmdp.rl.env_utils import quote_differs_pct
 from orderbookmdp.rl.market_env import MarketEnv
@@ -86,18 +88,33 @@ class ExternalMarketEnv(MarketEnv):
     Attributes
     ----------
     os : orderstream
-        The orderstream that gives messages from the external market
+        The orderstream that gives messages from the external market. A projection of its columns gets the columns
+        the market needs, see :py:func:`orderbookmdp.order_book.utils.market_columns`
     filled : bool
         If the env has been filled by a snapshot
+    max_resync_gap : int
+        At a gap in the order stream of at most max_resync_gap sequences the market is resynced to the snapshot
+        after it, see :py:meth:`orderbookmdp._orderbookmdp.CyExternalMarket.resync_snap`, and the episode goes on.
+        At larger gaps, or a new episode of the order stream, the episode ends and the market is filled from the
+        snapshot on reset.
+    sequence : int
+        The sequence of the last external message
+    resync_stats : dict
+        The number of 'resyncs' and of orders 'added', 'canceled' and 'changed' by them
     """
 
     def __init__(self, max_episode_time='10days', order_paths='../../../data/feather/',
-                 snapshot_paths='../../../data/snap_json/', taker_fee=0.002, min_capital_pct=0.00, **kwargs):
+                 snapshot_paths='../../../data/snap_json/', taker_fee=0.002, min_capital_pct=0.00,
+                 max_resync_gap=10000, **kwargs):
         super(ExternalMarketEnv, self).__init__(**kwargs)
+        kwargs['columns'] = market_columns(kwargs.get('columns'))
         self.os = orderstream(order_paths, snapshot_paths, **kwargs)
         self.filled = False
         self.snap = None
-        self.max_episode_time_delta = pd.to_timedelta(max_episode_time).to_timedelta64()
+        self.max_resync_gap = max_resync_gap
+        self.sequence = None
+        self.resync_stats = {}
+        self.max_episode_time_delta = pd.to_timedelta(max_episode_time).value
         self.check_time_k = 10
         self.check_k = 0
         self.episode_time_reset = False
@@ -118,13 +135,18 @@ class ExternalMarketEnv(MarketEnv):
         trades = []
         self.prev_quotes = self.market.ob.price_levels.get_quotes()
         for mess, snap in self.os:
-            if snap is not None:  # Should return done and save snap to next reset
+            if snap is not None:
+                if self.can_resync(snap):
+                    trades.extend(self.resync(snap))
+                    continue
+                # Should return done and save snap to next reset
                 self.snap = snap
                 #logging.info('cap/init_cap:{:.2f} bp/init_bp:{:.2f}'.format(self.capital / self.initial_funds,
                 #                                                       self.prev_buying_power / self.init_buying_power))
                 return [], True
             else:
-                trades_, oib = self.market.send_message(mess, external=True)
+                trades_, oib = self.market.send_message(mess, external=True, lots=True)
+                self.sequence = mess.sequence
                 if len(trades_) > 0:
                     trades.extend(trades_)
                 self.check_k += 1
@@ -136,7 +158,7 @@ class ExternalMarketEnv(MarketEnv):
                             #logging.info('cap/init_cap:{:.2f} bp/init_bp:{:.2f}'.format(self.capital / self.initial_funds,
                             #                                                     self.prev_buying_power/self.init_buying_power))
                             return trades, True
-                        elif np.datetime64(self.market.time) - self.start_time >= self.max_episode_time_delta:
+                        elif time_to_ns(self.market.time) - self.start_time >= self.max_episode_time_delta:
                             self.episode_time_reset = True
                             #logging.info('cap/init_cap:{:.2f} bp/init_bp:{:.2f}'.format(self.capital / self.initial_funds,
                             #                                                     self.prev_buying_power/self.init_buying_power))
@@ -147,6 +169,26 @@ class ExternalMarketEnv(MarketEnv):
                 except ZeroDivisionError as e:  # TODO why zero in quotes?
                     return trades, False
 
+    def can_resync(self, snap: dict) -> bool:
+        """ Returns True if the snapshot follows the last external message by at most max_resync_gap sequences. """
+        return self.sequence is not None and 0 < snap['sequence'] - self.sequence <= self.max_resync_gap
+
+    def resync(self, snap: dict) -> list:
+        """ Resyncs the market to the snapshot after a gap and returns the trades of it, see :py:meth:`can_resync`.
+
+        Parameters
+        ----------
+        snap : dict
+
+        Returns
+        -------
+        trades : list
+        """
+        self.resync_stats['resyncs'] = self.resync_stats.get('resyncs', 0) + 1
+        trades = self.market.resync_snap(snap, self.resync_stats)
+        self.sequence = snap['sequence']
+        return trades
+
     def reset(self, market=None):
         """ Resets the market with a new snapshot.
 
@@ -175,8 +217,9 @@ class ExternalMarketEnv(MarketEnv):
             self.episode_time_reset = False
 
         mess, _ = self.os.__next__()
-        self.market.send_message(mess, external=True)
-        self.start_time = np.datetime64(mess.time)
+        self.market.send_message(mess, external=True, lots=True)
+        self.sequence = mess.sequence
+        self.start_time = time_to_ns(mess.time)
         self.quotes = self.market.ob.price_levels.get_quotes()
         obs = self.quotes
 
@@ -11,20 +11,35 @@ import logging
 import gym
 from orderbookmdp.rl.env_utils import quote_differs_pct
 from copy import deepcopy
+from orderbookmdp._orderbookmdp import CyL2OrderBook
+from orderbookmdp.order_book.constants import SIDE_CODES
+from orderbookmdp.order_book.utils import to_int
+from orderbookmdp.order_book.utils import to_lots
 np.set_printoptions(formatter={'float': '{: 0.3f}'.format})
 
 
 class GdaxOrderBook(WebsocketClient):
-    def __init__(self, product='BTC-USD', **kwargs):
-        super(GdaxOrderBook, self).__init__(**kwargs)
-        self.public_client = cbpro.PublicClient()
+    """ A level 2 order book kept up to date by the exchange's websocket feed.
+
+    With book_type 'sorted_dict' the levels are kept in SortedDicts of Decimals. With book_type 'cy' they are kept
+    as integer lots per tick in a :py:class:`orderbookmdp._orderbookmdp.CyL2OrderBook`, created with book_kwargs,
+    and each l2update is applied as one batch. Other book types raise a ValueError.
+    """
+    def __init__(self, product='BTC-USD', book_type='sorted_dict', book_kwargs=None,
+                 url='wss://ws-feed.pro.coinbase.com/', api_url='https://api.pro.coinbase.com', **kwargs):
+        if book_type not in ('sorted_dict', 'cy'):
+            raise ValueError("book_type is 'sorted_dict' or 'cy', not {!r}".format(book_type))
+        super(GdaxOrderBook, self).__init__(url=url, channels=['level2'], **kwargs)
+        self.public_client = cbpro.PublicClient(api_url=api_url)
         self.products = [product]
         self.message_count = 0
         self.initialized = False
+        self.book_type = book_type
+        if book_type == 'cy':
+            self.book = CyL2OrderBook(**(book_kwargs or {}))
 
     def on_open(self):
-        self.url = "wss://ws-feed.pro.coinbase.com/"
-        self.channels = ['level2']
+        logging.info('Opens level 2 order book from {}'.format(self.url))
 
     def on_message(self, msg):
         if msg['type'] == 'snapshot':
@@ -37,6 +52,9 @@ class GdaxOrderBook(WebsocketClient):
         self.message_count += 1
 
     def fill_snap(self, snap):
+        if self.book_type == 'cy':
+            self.book.fill_snap(snap)
+            return
         self.bids = SortedDict()
         self.asks = SortedDict()
         for bid in snap['bids']:
@@ -46,6 +64,15 @@ class GdaxOrderBook(WebsocketClient):
 
     def update(self, message):
         if message['type'] == 'l2update':
+            if self.book_type == 'cy':
+                changes = message['changes']
+                sides = np.array([SIDE_CODES[change[0]] for change in changes], dtype=np.int8)
+                prices = np.array([to_int(float(change[1]), self.book.multiplier) for change in changes],
+                                  dtype=np.int64)
+                sizes = np.array([to_lots(float(change[2]), self.book.lot_multiplier) for change in changes],
+                                 dtype=np.int64)
+                self.book.update_levels(sides, prices, sizes)
+                return
             for changes in message['changes']:
                 chg = Decimal(changes[2])
                 price = Decimal(changes[1])
@@ -61,6 +88,9 @@ class GdaxOrderBook(WebsocketClient):
                         self.asks[price] = chg
 
     def get_quotes(self):
+        if self.book_type == 'cy':
+            ask, askv, bid, bidv = self.book.get_quotes()
+            return ask / self.book.multiplier, askv, bid / self.book.multiplier, bidv
         if self.asks is not None:
             ask, askv = self.asks.peekitem(index=0)
             bid, bidv = self.bids.peekitem()
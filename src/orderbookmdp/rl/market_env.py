@@ -66,8 +66,8 @@ class MarketEnv(metaclass=DocInheritMeta(style="numpy", abstract_base_class=True
     reward_range = (-float('inf'), float('inf'))
     spec = None
 
-    def __init__(self, market_type='cyext', tick_size=0.01, ob_type='cy', price_level_type='cydeque',
-                 price_levels_type='cylist', initial_funds=10000, T_ID=1, **kwargs):
+    def __init__(self, market_type='cyext', tick_size=0.01, ob_type='cy', price_level_type='cylots',
+                 price_levels_type='cylist', lot_size=1e-8, initial_funds=10000, T_ID=1, **kwargs):
         """
 
         Parameters
@@ -76,6 +76,8 @@ class MarketEnv(metaclass=DocInheritMeta(style="numpy", abstract_base_class=True
             The type of market to be used
         market_setup : dict
             Parameters for the market
+        lot_size : float
+            The minimum multiple of size in the market
         initial_funds : float
             The initial cash of the agent
         T_ID : int
@@ -85,7 +87,7 @@ class MarketEnv(metaclass=DocInheritMeta(style="numpy", abstract_base_class=True
         # Market
         self._market_type = market_type
         self._market_setup = dict(tick_size=tick_size, ob_type=ob_type, price_level_type=price_level_type,
-                                  price_levels_type=price_levels_type)
+                                  price_levels_type=price_levels_type, lot_size=lot_size)
 
         # Init Funds
         self.capital = initial_funds
@@ -0,0 +1,60 @@
+""" Writes the test data as downloaded, sharded or reformatted data directories for the tests of the data layer. """
+import os
+
+import ujson
+
+from orderbookmdp.data_all.reformat_data import MESSAGE_KEYS
+from orderbookmdp.data_all.reformat_data import reformat_messages
+from orderbookmdp.data_all.shards import reformat_shards
+from orderbookmdp.data_all.shards import shard_dir
+
+RAW_TIME = '01_08_2018_10_00_00'
+DAY = '2018-08-01'
+
+
+def load():
+    """ Returns the level 3 snapshots before and after the test messages and the messages. """
+    with open('tests/testdata/messages.json', 'rb') as messages_json_file:
+        messages = ujson.load(messages_json_file)
+    with open('tests/testdata/beginning_level_3.json', 'rb') as begin_json_file:
+        beginning_level_3 = ujson.load(begin_json_file)
+    with open('tests/testdata/ending_level_3.json', 'rb') as end_json_file:
+        ending_level_3 = ujson.load(end_json_file)
+    return beginning_level_3, ending_level_3, messages
+
+
+def write_raw(json_dir, snap, messages):
+    """ Writes a snapshot and messages to json_dir as the raw files of a download started at :py:data:`RAW_TIME`. """
+    os.makedirs(json_dir, exist_ok=True)
+    with open(json_dir + RAW_TIME + '_snaps.json', 'w') as f:
+        f.write(ujson.dumps(snap) + '\n')
+    with open(json_dir + RAW_TIME + '_mess.json', 'w') as f:
+        f.write(''.join(ujson.dumps(message) + '\n' for message in messages))
+
+
+def write_shards(data_dir, snap, messages, products=('BTC-USD', 'ETH-USD'), **reformat_kwargs):
+    """ Writes the same raw files to the shard of each product on :py:data:`DAY` and reformats the shards. """
+    for product in products:
+        write_raw(shard_dir(data_dir, product, DAY) + 'json/', snap, messages)
+    reformat_shards(data_dir, products=list(products), **reformat_kwargs)
+
+
+def write_reformatted(data_dir, snap, messages, store=False) -> (str, str):
+    """
+    Reformats messages to the order files of data_dir and writes the snapshot to its json snapshots.
+
+    Returns
+    -------
+    order_paths: str, snapshot_paths: str
+
+    """
+    order_paths = os.path.join(data_dir, 'store' if store else 'feather') + '/'
+    snapshot_paths = os.path.join(data_dir, 'snap_json') + '/'
+    for directory in (os.path.join(data_dir, 'json'), order_paths, snapshot_paths):
+        os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(data_dir, 'json', 'mess.json'), 'w') as f:
+        f.write(''.join(ujson.dumps(message) + '\n' for message in messages))
+    reformat_messages(data_dir, 0, MESSAGE_KEYS, 2, 'mess.json', store=store)
+    with open(snapshot_paths + 'snap_{}.json'.format(snap['sequence']), 'w') as f:
+        ujson.dump(snap, f)
+    return order_paths, snapshot_paths
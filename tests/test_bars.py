@@ -0,0 +1,95 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+from fixtures import load
+from fixtures import write_reformatted
+
+from orderbookmdp._orderbookmdp import BarBuilder
+from orderbookmdp.data_all.orderstream import load_columns
+from orderbookmdp.data_all.replay import get_engine
+from orderbookmdp.order_book.constants import BUY
+from orderbookmdp.order_book.constants import SELL
+from orderbookmdp.order_book.constants import T_PRICE
+from orderbookmdp.order_book.constants import T_SIZE
+from orderbookmdp.order_book.constants import T_TIME
+
+
+def trade(price, size, time, side=BUY):
+    """ Returns a trade of an external trader at a price in cents. """
+    return -1, -1, price, size, 0, side, time
+
+
+class TestBarBuilder(TestCase):
+
+    def setUp(self):
+        self.trades = [trade(10000, 1.0, 10**9), trade(10100, 2.0, 2 * 10**9, SELL), trade(9900, 1.0, 61 * 10**9),
+                       trade(10000, 3.0, 62 * 10**9), trade(10200, 1.0, 185 * 10**9)]
+
+    def test_time_bars(self):
+        builder = BarBuilder('time', '1min', capacity=1)
+        builder.add_trades(self.trades)
+        bars = builder.bars()
+        self.assertEqual(len(builder), 2)
+        self.assertEqual(bars['start'].tolist(), [10**9, 61 * 10**9])
+        self.assertEqual(bars['end'].tolist(), [2 * 10**9, 62 * 10**9])
+        self.assertEqual(bars['open'].tolist(), [100.0, 99.0])
+        self.assertEqual(bars['high'].tolist(), [101.0, 100.0])
+        self.assertEqual(bars['low'].tolist(), [100.0, 99.0])
+        self.assertEqual(bars['close'].tolist(), [101.0, 100.0])
+        self.assertEqual(bars['volume'].tolist(), [3.0, 4.0])
+        self.assertEqual(bars['buy_volume'].tolist(), [1.0, 4.0])
+        self.assertEqual(bars['ticks'].tolist(), [2, 2])
+        self.assertAlmostEqual(bars['vwap'][0], (100.0 + 2 * 101.0) / 3)
+
+        builder.close()
+        self.assertEqual(builder.pop()['close'].tolist(), [101.0, 100.0, 102.0])
+        self.assertEqual(len(builder), 0)
+
+    def test_threshold_bars(self):
+        builder = BarBuilder('tick', 2)
+        builder.add_trades(self.trades)
+        self.assertEqual(builder.bars()['ticks'].tolist(), [2, 2])
+
+        builder = BarBuilder('volume', 3.0)
+        builder.add_trades(self.trades)
+        self.assertEqual(builder.bars()['volume'].tolist(), [3.0, 4.0])
+
+        builder = BarBuilder('dollar', 250.0)
+        builder.add_trades(self.trades)
+        self.assertEqual(builder.bars()['dollar'].tolist(), [302.0, 399.0])
+
+        builder = BarBuilder('volume', 1.0)
+        builder.add_trades([trade(10000, 1.0, '1970-01-01T00:00:01Z')])
+        self.assertEqual(builder.bars()['start'].tolist(), [10**9])
+
+        with self.assertRaises(ValueError):
+            BarBuilder('range', 1.0)
+
+    def test_market_bars(self):
+        snap, _, messages = load()
+        with tempfile.TemporaryDirectory() as data_dir:
+            order_paths, _ = write_reformatted(data_dir, snap, messages)
+            batch = load_columns(order_paths + os.listdir(order_paths)[0])
+
+        for engine in ('cy', 'py'):
+            market = get_engine(engine)
+            market.fill_snap(snap)
+            market.bars = BarBuilder('time', '30s')
+            trades = market.send_messages(batch)
+            market.bars.close()
+            bars = market.bars.bars()
+            self.assertGreater(len(trades), 0)
+            self.assertEqual(bars['ticks'].sum(), len(trades))
+            self.assertAlmostEqual(bars['volume'].sum(), sum(trade[T_SIZE] for trade in trades))
+            self.assertEqual(bars['start'][0], trades[0][T_TIME])
+            self.assertEqual(bars['close'][-1], trades[-1][T_PRICE] / market.multiplier)
+            self.assertTrue(np.all(np.diff(bars['start'] // (30 * 10**9)) > 0))
+
+            market = get_engine(engine)
+            market.fill_snap(snap)
+            market.bars = BarBuilder('time', '30s')
+            self.assertEqual(market.fast_forward(batch), len(batch['sequence']))
+            market.bars.close()
+            self.assertEqual(len(market.bars), 0)
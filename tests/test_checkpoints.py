@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+from fixtures import RAW_TIME
+from fixtures import load
+from fixtures import write_raw
+
+from orderbookmdp._orderbookmdp import CyExternalMarket
+from orderbookmdp.data_all.checkpoints import CHECKPOINT_LEVELS
+from orderbookmdp.data_all.checkpoints import checkpoint_bounds
+from orderbookmdp.data_all.checkpoints import checkpoint_rows
+from orderbookmdp.data_all.checkpoints import to_nanoseconds
+from orderbookmdp.data_all.manifest import Manifest
+from orderbookmdp.data_all.reformat_data import reformat
+from orderbookmdp.data_all.snapshots import snap_to_arrays
+
+
+class TestCheckpoints(TestCase):
+
+    def test_checkpoint_rows(self):
+        self.assertEqual(checkpoint_rows(10, None, every_messages=4), [4, 8])
+        self.assertEqual(checkpoint_rows(10, None, every_messages=4, prev_messages=2), [2, 6])
+        self.assertEqual(checkpoint_rows(10, None, every_messages=4, prev_messages=4), [0, 4, 8])
+
+        times = to_nanoseconds(np.array(['2018-08-01T10:00:00.5Z', '2018-08-01T10:00:01.2Z',
+                                         '2018-08-01T10:00:01.9Z', '2018-08-01T10:00:03.1Z'], dtype=object))
+        self.assertEqual(times[0], np.datetime64('2018-08-01T10:00:00.5', 'ns').astype(np.int64))
+        self.assertEqual(checkpoint_rows(4, times, every_seconds=1), [1, 3])
+        self.assertEqual(checkpoint_rows(4, times, every_seconds=1, prev_messages=3, prev_slot=times[0] // 10**9 - 1),
+                         [0, 1, 3])
+        self.assertEqual(checkpoint_rows(4, times, every_messages=2, every_seconds=1), [1, 2, 3])
+
+    def test_get_binary_snap(self):
+        with open('tests/testdata/beginning_level_3.json', 'rb') as begin_json_file:
+            snap = json.load(begin_json_file)
+        m = CyExternalMarket(**checkpoint_bounds(snap))
+        m.fill_snap(snap)
+        binary_snap = m.get_binary_snap(snap['sequence'])
+        # The book keeps the snapshot order within a price level
+        self.assertEqual(m.ob.price_levels.dropped, 0)
+        expected = snap_to_arrays(snap)
+        for side in ('bids', 'asks'):
+            order = np.lexsort((np.arange(len(expected[side]['price'])), -expected[side]['price'] if side == 'bids'
+                                else expected[side]['price']))
+            for column in ('price', 'size', 'order_id_hi', 'order_id_lo'):
+                np.testing.assert_array_equal(binary_snap[side][column], expected[side][column][order])
+
+    def test_checkpoint_bounds(self):
+        with open('tests/testdata/beginning_level_3.json', 'rb') as begin_json_file:
+            snap = json.load(begin_json_file)
+        bounds = checkpoint_bounds(snap)
+        self.assertAlmostEqual((bounds['max_price'] - bounds['min_price']) / 0.01, CHECKPOINT_LEVELS)
+        self.assertLess(bounds['min_price'], 6470.05)
+        self.assertGreater(bounds['max_price'], 6529.97)
+        bounds = checkpoint_bounds(snap, levels=100)
+        self.assertAlmostEqual(bounds['min_price'], 6499.48)
+        self.assertAlmostEqual(bounds['max_price'], 6500.48)
+
+        # A snapshot wider than the book is centered on its quotes and the orders outside are dropped
+        snap['bids'].append(['0.01', '1.0', snap['bids'][0][2][:-1] + '0'])
+        snap['asks'].append(['999999.00', '1.0', snap['asks'][0][2][:-1] + '0'])
+        bounds = checkpoint_bounds(snap)
+        self.assertAlmostEqual((bounds['min_price'] + bounds['max_price']) / 2, (6499.88 + 6500.07) / 2, places=1)
+        m = CyExternalMarket(**bounds)
+        m.fill_snap(snap)
+        self.assertEqual(m.ob.price_levels.dropped, 2)
+
+    def test_write_checkpoints(self):
+        snap, _, messages = load()
+        with tempfile.TemporaryDirectory() as data_dir:
+            write_raw(data_dir + '/json/', snap, messages[:-1000])
+
+            def checkpoints():
+                outputs = Manifest(data_dir).outputs('checkpoints', 'snap_bin')
+                self.assertTrue(all(os.path.isfile(os.path.join(data_dir, output)) for output in outputs))
+                return sorted(outputs)
+
+            reformat(data_dir, checkpoint_messages=300)
+            first = checkpoints()
+            self.assertGreater(len(first), 1)
+
+            # The checkpoints of the messages that are reformatted again are replaced
+            with open(data_dir + '/json/' + RAW_TIME + '_mess.json', 'a') as f:
+                f.write(''.join(json.dumps(message) + '\n' for message in messages[-1000:]))
+            reformat(data_dir, checkpoint_messages=300)
+            self.assertEqual(checkpoints()[:len(first) - 1], first[:-1])
+            self.assertGreater(len(checkpoints()), len(first))
+
+            reformat(data_dir, checkpoint_messages=600)
+            self.assertLess(len(checkpoints()), len(first))
+            self.assertTrue(set(first) - set(checkpoints()))
+
+            # No checkpoint is saved of a book that is missing orders outside of its range
+            snap['asks'].append(['999999.00', '1.0', snap['asks'][0][2][:-1] + '0'])
+            with open(data_dir + '/json/' + RAW_TIME + '_snaps.json', 'w') as f:
+                f.write(json.dumps(snap) + '\n')
+            reformat(data_dir, checkpoint_messages=300)
+            self.assertEqual(checkpoints(), [])
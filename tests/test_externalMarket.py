@@ -1,16 +1,30 @@
 import json
+import os
+import tempfile
+from copy import deepcopy
 from types import SimpleNamespace
 from unittest import TestCase
 
 import numpy as np
 
 from orderbookmdp._orderbookmdp import CyExternalMarket
+from orderbookmdp._orderbookmdp import CyOrderBook
+from orderbookmdp._orderbookmdp import Message
+from orderbookmdp.data_all.orderstream import load_columns
+from orderbookmdp.data_all.reformat_data import MESSAGE_KEYS
+from orderbookmdp.data_all.reformat_data import reformat_messages
 from orderbookmdp.order_book.constants import BUY
 from orderbookmdp.order_book.constants import EXT_ID
+from orderbookmdp.order_book.constants import MESSAGE_TYPE_CODES
+from orderbookmdp.order_book.constants import ORDER_TYPE_CODES
+from orderbookmdp.order_book.constants import REASON_CODES
 from orderbookmdp.order_book.constants import SELL
+from orderbookmdp.order_book.constants import SO_EXT_ID
 from orderbookmdp.order_book.constants import SO_PRICE
 from orderbookmdp.order_book.constants import SO_SIZE
 from orderbookmdp.order_book.market import ExternalMarket
+from orderbookmdp.order_book.order_types import limit_message
+from orderbookmdp.order_book.order_types import market_message
 from orderbookmdp.order_book.utils import to_int
 
 tick = 0.01
@@ -58,7 +72,7 @@ def agg_snap(snap):
 
 class TestExternalMarket(TestCase):
 
-    def messages(self, m, b_lvl_3, e_lvl_3, messages):
+    def messages(self, m, b_lvl_3, e_lvl_3, messages, typed=False):
         m.fill_snap(b_lvl_3)
 
         prev_seq = b_lvl_3['sequence']
@@ -83,10 +97,37 @@ class TestExternalMarket(TestCase):
 
             message['trader_id'] = EXT_ID
 
-            mess = SimpleNamespace(**message)
+            if typed:
+                mess = Message(MESSAGE_TYPE_CODES[message['type']],
+                               order_type=ORDER_TYPE_CODES.get(message.get('order_type'), -1),
+                               reason=REASON_CODES.get(message.get('reason'), -1),
+                               side=message.get('side', -1), size=message['size'], price=message.get('price', 0),
+                               funds=message['funds'], order_id=message.get('order_id'), time=message['time'])
+            else:
+                mess = SimpleNamespace(**message)
             m.send_message(mess, external=True)
 
         self.assertEqual(seq, e_lvl_3['sequence'])
+        self.assert_snap(m, e_lvl_3)
+
+    def batch_messages(self, m, b_lvl_3, e_lvl_3, messages, store):
+        m.fill_snap(b_lvl_3)
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            for directory in ('json', 'feather', 'store'):
+                os.makedirs(os.path.join(data_dir, directory))
+            with open(os.path.join(data_dir, 'json', 'mess.json'), 'w') as f:
+                for message in messages:
+                    f.write(json.dumps(message) + '\n')
+            reformat_messages(data_dir, 0, MESSAGE_KEYS, tick_dec, 'mess.json', store=store)
+            directory = os.path.join(data_dir, 'store' if store else 'feather')
+            batch = load_columns(os.path.join(directory, os.listdir(directory)[0]))
+            m.send_messages(batch)
+            del batch
+
+        self.assert_snap(m, e_lvl_3)
+
+    def assert_snap(self, m, e_lvl_3):
         snap = m.ob.price_levels.get_snap()
         corr_snap = agg_snap(e_lvl_3)
 
@@ -229,11 +270,98 @@ class TestExternalMarket(TestCase):
                            price_levels_type='cylist')
         self.messages(m, b_lvl_3, e_lvl_3, messages)
 
-    def test_fill_snap_cymarket_cylist_cydeque(self):
+    def test_fill_snap_cymarket_cylist_cylots(self):
         b_lvl_3, e_lvl_3, messages = load()
-        self.fill_snap('cy', 'cydeque', 'cylist', b_lvl_3, e_lvl_3)
+        self.fill_snap('cy', 'cylots', 'cylist', b_lvl_3, e_lvl_3)
 
-    def test_send_message_cymarket_cylist_cydeque(self):
+    def test_send_message_cymarket_cylist_cylots(self):
         b_lvl_3, e_lvl_3, messages = load()
-        m = CyExternalMarket(price_level_type='cydeque', price_levels_type='cylist')
+        m = CyExternalMarket(price_level_type='cylots', price_levels_type='cylist')
         self.messages(m, b_lvl_3, e_lvl_3, messages)
+
+    def test_send_typed_message_cymarket_cylist_cylots(self):
+        b_lvl_3, e_lvl_3, messages = load()
+        m = CyExternalMarket(price_level_type='cylots', price_levels_type='cylist')
+        self.messages(m, b_lvl_3, e_lvl_3, messages, typed=True)
+
+    def test_lot_sizes_cymarket(self):
+        m = CyExternalMarket(price_level_type='cylots', price_levels_type='cylist')
+        m.send_message(limit_message(SELL, 0.3, 650000, 1))
+        trades, _ = m.send_message(market_message(BUY, 0.1, 2))
+        self.assertEqual(trades[0][3], 0.1)
+        m.send_message(market_message(BUY, 0.2, 2))
+        self.assertFalse(m.ob.price_levels.exist_sell_orders())
+
+        with self.assertRaises(ValueError):
+            CyExternalMarket(price_level_type='deque', price_levels_type='cylist')
+        with self.assertRaises(ValueError):
+            ExternalMarket(ob_type='cy', price_level_type='cylots', price_levels_type='sorted_dict')
+        self.assertIsInstance(CyExternalMarket(price_level_type='cydeque').ob, CyOrderBook)
+        m = ExternalMarket(ob_type='cy', price_level_type='cylots', price_levels_type='cylist')
+        self.assertIsInstance(m.ob, CyOrderBook)
+
+    def test_external_lots(self):
+        for m in (ExternalMarket(), CyExternalMarket()):
+            def limit(side, price, size, lots, order_id):
+                return m.send_message(SimpleNamespace(type=MESSAGE_TYPE_CODES['received'], order_type=ORDER_TYPE_CODES['limit'],
+                                                      side=side, price=price, size=size, trader_id=EXT_ID, order_id=order_id,
+                                                      time=0), external=True, lots=lots)
+
+            # An integer lot count of any integer type and whole float sizes are taken in the units they are marked in
+            limit(SELL, 6500.0, np.int64(150000000), True, 1)
+            limit(SELL, 6500.0, 2, False, 2)
+            limit(BUY, 6400.0, 1.0, False, 3)
+            self.assertAlmostEqual(m.ob.price_levels.get_quotes()[1], 3.5)
+            self.assertAlmostEqual(m.ob.price_levels.get_quotes()[3], 1.0)
+
+    def test_send_messages_sorted_ordered(self):
+        b_lvl_3, e_lvl_3, messages = load()
+        m = ExternalMarket(price_level_type='ordered_dict',
+                           price_levels_type='sorted_dict')
+        self.batch_messages(m, b_lvl_3, e_lvl_3, messages, store=False)
+
+    def test_send_messages_cymarket_cylist_cylots(self):
+        b_lvl_3, e_lvl_3, messages = load()
+        m = CyExternalMarket(price_level_type='cylots', price_levels_type='cylist')
+        self.batch_messages(m, b_lvl_3, e_lvl_3, messages, store=True)
+
+    def resync(self, m, b_lvl_3, e_lvl_3, binary=False):
+        e_lvl_3 = deepcopy(e_lvl_3)
+        b_ids = {order[SO_EXT_ID] for order in b_lvl_3['bids']}
+        order = next(order for order in e_lvl_3['bids'] if order[SO_EXT_ID] in b_ids)
+        order[SO_SIZE] = str(float(order[SO_SIZE]) / 2)  # An order partially filled during the gap
+        e_snap = e_lvl_3
+        if binary:
+            e_market = CyExternalMarket(price_level_type='cylots', price_levels_type='cylist')
+            e_market.fill_snap(e_lvl_3)
+            e_snap = e_market.get_binary_snap(e_lvl_3['sequence'])
+
+        m.fill_snap(b_lvl_3)
+        m.send_message(limit_message(BUY, 1.0, 600000, 1))  # An agent order below the book
+
+        stats = {}
+        m.resync_snap(e_snap, stats)
+        self.assertGreater(stats['added'], 0)
+        self.assertGreater(stats['canceled'], 0)
+        self.assertEqual(stats['changed'], 1)
+        self.assertEqual(m.ob.price_levels.get_snap()['bids'][600000], 1.0)
+        self.assert_snap(m, e_lvl_3)
+
+        stats = {}
+        m.resync_snap(e_snap, stats)
+        self.assertEqual(stats, {'added': 0, 'canceled': 0, 'changed': 0})
+
+    def test_resync_snap_sorted_ordered(self):
+        b_lvl_3, e_lvl_3, messages = load()
+        m = ExternalMarket(price_level_type='ordered_dict', price_levels_type='sorted_dict')
+        self.resync(m, b_lvl_3, e_lvl_3)
+
+    def test_resync_snap_cymarket_cylist_cylots(self):
+        b_lvl_3, e_lvl_3, messages = load()
+        m = CyExternalMarket(price_level_type='cylots', price_levels_type='cylist')
+        self.resync(m, b_lvl_3, e_lvl_3)
+
+    def test_resync_binary_snap_cymarket_cylist_cylots(self):
+        b_lvl_3, e_lvl_3, messages = load()
+        m = CyExternalMarket(price_level_type='cylots', price_levels_type='cylist')
+        self.resync(m, b_lvl_3, e_lvl_3, binary=True)
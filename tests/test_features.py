@@ -0,0 +1,76 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pyarrow.feather
+from fixtures import load
+from fixtures import write_shards
+
+from orderbookmdp.data_all.features import Depth
+from orderbookmdp.data_all.features import OrderFlow
+from orderbookmdp.data_all.features import Quotes
+from orderbookmdp.data_all.features import Reducer
+from orderbookmdp.data_all.features import extract
+from orderbookmdp.data_all.features import extract_shards
+from orderbookmdp.data_all.shards import ShardManifest
+
+
+class Received(Reducer):
+    """ Counts the received messages of each interval and keeps the sequence of the first one. """
+
+    def __init__(self):
+        self.count, self.first = 0, None
+
+    def update(self, market, batch):
+        received = batch['sequence'][batch['type'] == 0]
+        if self.first is None and len(received) > 0:
+            self.first = int(received[0])
+        self.count += len(received)
+
+    def sample(self, market, time):
+        features = {'received': self.count, 'first_received': self.first}
+        self.count = 0
+        return features
+
+
+class TestFeatures(TestCase):
+
+    def setUp(self):
+        snap, self.end, self.messages = load()
+        self.dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.dir.name + '/data'
+        write_shards(self.data_dir, snap, self.messages, store=True)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_extract(self):
+        shards = ShardManifest(self.data_dir)
+        paths = shards.paths(shards.shards('BTC-USD')[0])
+        sent = sum(message['type'] in ('received', 'done', 'change') for message in self.messages)
+
+        features = extract(*paths, [Quotes(), Depth(), OrderFlow(), Received()])
+        self.assertEqual(len(features['time']), 1)
+        self.assertEqual(features['sequence'][0], self.messages[-1]['sequence'])
+        self.assertEqual(features['messages'][0], sent)
+        self.assertEqual(features['received'][0], sum(message['type'] == 'received' for message in self.messages))
+        self.assertEqual(features['bid'][0], max(float(order[0]) for order in self.end['bids']))
+        self.assertEqual(features['ask'][0], min(float(order[0]) for order in self.end['asks']))
+        self.assertGreater(features['bid_depth'][0], 0)
+
+        features = extract(*paths, [OrderFlow(), Received()], interval='1min')
+        self.assertGreater(len(features['time']), 1)
+        self.assertTrue(np.all(np.diff(features['time']) == 60 * 10**9))
+        self.assertEqual(features['messages'].sum(), sent)
+        self.assertEqual(features['first_received'][-1], features['first_received'][0])
+
+    def test_extract_shards(self):
+        out_dir = self.dir.name + '/features'
+        paths = extract_shards(self.data_dir, [Quotes(), Received()], out_dir, interval='1min', cores=2)
+        self.assertEqual(paths, [os.path.join(out_dir, product, '2018-08-01.feather') for product in ('BTC-USD', 'ETH-USD')])
+        tables = [pyarrow.feather.read_table(path) for path in paths]
+        self.assertEqual(tables[0].column_names, ['time', 'sequence', 'bid', 'ask', 'bid_size', 'ask_size', 'spread',
+                                                  'received', 'first_received'])
+        self.assertEqual(tables[0].to_pydict(), tables[1].to_pydict())
+        self.assertEqual(tables[0].column('first_received')[0].as_py(), tables[0].column('first_received')[-1].as_py())
@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+import numpy as np
+
+from orderbookmdp._orderbookmdp import CyL2OrderBook
+from orderbookmdp._orderbookmdp import CyListPriceLevels
+from orderbookmdp.order_book.constants import BUY
+from orderbookmdp.order_book.constants import SELL
+
+snap = {'bids': [['6499.99', '1.5'], ['6499.50', '0.25']],
+        'asks': [['6500.00', '0.5'], ['6501.00', '2.0']]}
+
+
+class TestL2OrderBook(TestCase):
+
+    def setUp(self):
+        self.book = CyL2OrderBook()
+        self.book.fill_snap(snap)
+
+    def test_fill_snap(self):
+        np.testing.assert_allclose(self.book.get_quotes(), [650000, 0.5, 649999, 1.5])
+        self.assertEqual(self.book.get_snap(), {'asks': {650000: 0.5, 650100: 2.0},
+                                                'bids': {649999: 1.5, 649950: 0.25}})
+
+    def test_bounds(self):
+        # 1.15 * 100 is 114.99999999999999 as a float, the bounds are rounded to the tick as in CyListPriceLevels
+        book = CyL2OrderBook(min_price=1.15, max_price=2.15)
+        self.assertEqual((book.min_price, book.max_price), (115, 215))
+        levels = CyListPriceLevels('cylots', min_price=1.15, max_price=2.15)
+        self.assertEqual((levels.min_price, levels.max_price), (book.min_price, book.max_price))
+
+    def test_update_levels(self):
+        sides = np.array([SELL, BUY, BUY], dtype=np.int8)
+        prices = np.array([650000, 649999, 649980], dtype=np.int64)
+        sizes = np.array([0, 0, 10**8], dtype=np.int64)
+        self.book.update_levels(sides, prices, sizes)
+        np.testing.assert_allclose(self.book.get_quotes(), [650100, 2.0, 649980, 1.0])
+
+        self.book.update(SELL, 650100, 0)
+        self.book.update(SELL, 650050, 10**7)
+        self.assertEqual(self.book.get_ask(), 650050)
+        self.assertAlmostEqual(self.book.get_size(SELL, 650050), 0.1)
+
+    def test_depth_and_impact(self):
+        prices, sizes = self.book.get_depth(BUY, 5)
+        self.assertEqual(prices.tolist(), [649999, 649950])
+        self.assertEqual(sizes.tolist(), [1.5, 0.25])
+
+        size, price = self.book.buy_impact(0.5*6500 + 6501)
+        self.assertAlmostEqual(size, 1.5)
+        self.assertAlmostEqual(price, (0.5*6500 + 6501) / 1.5)
+
+        funds, price = self.book.sell_impact(10)
+        self.assertAlmostEqual(funds, 1.5*6499.99 + 0.25*6499.5)
+        self.assertAlmostEqual(price, funds / 1.75)
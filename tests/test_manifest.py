@@ -0,0 +1,60 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from orderbookmdp.data_all.manifest import Manifest
+from orderbookmdp.data_all.manifest import output_entry
+from orderbookmdp.data_all.manifest import source_entry
+
+
+class TestManifest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.dir.name
+        os.makedirs(self.data_dir + '/json/')
+        os.makedirs(self.data_dir + '/store/')
+        self.write(self.data_dir + '/json/mess.json', '{"sequence": 1}\n')
+        self.write(self.data_dir + '/store/0_1_1.arrow', 'messages')
+
+        manifest = Manifest(self.data_dir)
+        manifest.record('store', 'mess.json', source_entry(self.data_dir + '/json/mess.json'),
+                        output_entry(self.data_dir, ['store/0_1_1.arrow']))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    @staticmethod
+    def write(path, text):
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def test_converted(self):
+        manifest = Manifest(self.data_dir)
+        self.assertTrue(manifest.is_converted('store', 'mess.json', verify=True))
+        self.assertFalse(manifest.is_converted('feather', 'mess.json'))
+        self.assertFalse(manifest.is_converted('store', 'other.json'))
+        self.assertEqual(manifest.outputs('store', 'mess.json'), ['store/0_1_1.arrow'])
+
+    def test_source_changed(self):
+        self.write(self.data_dir + '/json/mess.json', '{"sequence": 1}\n{"sequence": 2}\n')
+        self.assertFalse(Manifest(self.data_dir).is_converted('store', 'mess.json'))
+
+    def test_output_changed(self):
+        self.write(self.data_dir + '/store/0_1_1.arrow', 'other messages')
+        manifest = Manifest(self.data_dir)
+        self.assertTrue(manifest.is_converted('store', 'mess.json'))
+        self.assertFalse(manifest.is_converted('store', 'mess.json', verify=True))
+
+        os.remove(self.data_dir + '/store/0_1_1.arrow')
+        self.assertFalse(manifest.is_converted('store', 'mess.json'))
+
+    def test_options(self):
+        manifest = Manifest(self.data_dir)
+        self.assertTrue(manifest.is_converted('store', 'mess.json', options={'compression': 'lz4'}))
+        manifest.record('store', 'mess.json', source_entry(self.data_dir + '/json/mess.json'),
+                        output_entry(self.data_dir, ['store/0_1_1.arrow']), {'compression': 'lz4'})
+        manifest = Manifest(self.data_dir)
+        self.assertTrue(manifest.is_converted('store', 'mess.json', options={'compression': 'lz4'}))
+        self.assertFalse(manifest.is_converted('store', 'mess.json', options={'compression': 'zstd'}))
+        self.assertTrue(manifest.is_converted('store', 'mess.json'))
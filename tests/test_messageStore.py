@@ -0,0 +1,112 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from orderbookmdp.data_all.message_store import EXTENSION
+from orderbookmdp.data_all.message_store import MessageStore
+from orderbookmdp.data_all.message_store import MessageWriter
+from orderbookmdp.data_all.message_store import read_messages
+from orderbookmdp.data_all.message_store import to_columns
+from orderbookmdp.data_all.message_store import write_messages
+from orderbookmdp.data_all.orderstream import load_columns
+from orderbookmdp.data_all.orderstream import load_orders
+from orderbookmdp.data_all.reformat_data import split_order_ids
+from orderbookmdp.order_book.constants import M_DONE
+from orderbookmdp.order_book.constants import M_RECEIVED
+from orderbookmdp.order_book.constants import UNKNOWN
+from orderbookmdp.order_book.utils import uuid_to_int
+
+order_ids = ['6d9cab8e-9c30-45d4-b4a5-d1c7b4e0c3f5', 'ffffffff-ffff-4fff-bfff-ffffffffffff']
+
+
+class TestMessageStore(TestCase):
+
+    def setUp(self):
+        df = pd.DataFrame({'sequence': [10, 11], 'type': np.array([M_RECEIVED, M_DONE], dtype=np.int8),
+                           'side': np.array([0, 1], dtype=np.int8), 'price': [6500.01, np.nan],
+                           'size': [150000000, -1], 'time': ['2018-08-01T10:00:00.000001Z', None]})
+        df['order_id_hi'], df['order_id_lo'] = split_order_ids(pd.Series(order_ids))
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, '0_10_11' + EXTENSION)
+        write_messages(to_columns(df), self.path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_slice(self):
+        store = MessageStore(self.path)
+        self.assertEqual(len(store), 2)
+        columns = store.slice(1, 2, ['sequence', 'size', 'reason'])
+        self.assertEqual(list(columns), ['sequence', 'size', 'reason'])
+        self.assertEqual(columns['sequence'].tolist(), [11])
+        self.assertEqual(columns['size'].dtype, np.int64)
+        self.assertEqual(columns['reason'].tolist(), [UNKNOWN])
+        self.assertFalse(store.column('price').flags.writeable)
+        store.close()
+
+    def test_load_orders(self):
+        orders = list(load_orders(self.path))
+        self.assertEqual([order.sequence for order in orders], [10, 11])
+        self.assertEqual(orders[0].order_id, uuid_to_int(order_ids[0]))
+        self.assertEqual(orders[1].order_id, uuid_to_int(order_ids[1]))
+        self.assertEqual(orders[0].size, 150000000)
+        self.assertEqual(orders[0].price, 6500.01)
+        self.assertEqual(orders[0].time, 1533117600000001000)
+        self.assertEqual(orders[1].time, -1)
+
+    def test_time_strings(self):
+        df = pd.DataFrame({'sequence': [10, 11], 'time': ['2018-08-01T10:00:00.000001Z', None]})
+        write_messages(to_columns(df, time_strings=True), self.path)
+        store = MessageStore(self.path)
+        self.assertEqual(store.column('time').tolist(), ['2018-08-01T10:00:00.000001Z', ''])
+        store.close()
+
+    def test_read_messages(self):
+        for compression in (None, 'lz4'):
+            with MessageWriter(self.path, compression) as writer:
+                for start in range(0, 30, 10):
+                    sequences = np.arange(start, start + 10)
+                    times = ['2018-08-01T10:00:{:02d}Z'.format(k) for k in sequences]
+                    writer.write(to_columns(pd.DataFrame({'sequence': sequences, 'time': times, 'price': sequences})))
+
+            columns = read_messages(self.path, ['sequence', 'price'], sequence_range=(12, 25))
+            self.assertEqual(list(columns), ['sequence', 'price'])
+            self.assertEqual(columns['sequence'].tolist(), list(range(12, 25)))
+            self.assertEqual(columns['price'].tolist(), list(range(12, 25)))
+
+            columns = read_messages(self.path, ['order_id', 'sequence'], time_range=('2018-08-01T10:00:25Z', None))
+            self.assertEqual(list(columns), ['order_id_hi', 'order_id_lo', 'sequence'])
+            self.assertEqual(columns['sequence'].tolist(), list(range(25, 30)))
+
+            columns = read_messages(self.path, ['sequence'], time_range=('2018-08-01T10:00:05Z', '2018-08-01T10:00:20Z'),
+                                    sequence_range=(None, 8))
+            self.assertEqual(columns['sequence'].tolist(), [5, 6, 7])
+            self.assertEqual(read_messages(self.path, ['sequence'], sequence_range=(40, None))['sequence'].dtype, np.int64)
+            self.assertEqual(len(read_messages(self.path)['time']), 30)
+            self.assertEqual(load_columns(self.path, ['sequence'], sequence_range=(28, 40))['sequence'].tolist(), [28, 29])
+
+    def test_load_orders_range(self):
+        orders = list(load_orders(self.path, ['sequence', 'size'], sequence_range=(11, None)))
+        self.assertEqual(len(orders), 1)
+        self.assertEqual(orders[0].sequence, 11)
+        self.assertEqual(orders[0].size, -1)
+        self.assertIsNone(orders[0].price)
+        self.assertIsNone(orders[0].order_id)
+
+    def test_batches(self):
+        with MessageWriter(self.path) as writer:
+            for start in range(0, 30, 10):
+                writer.write(to_columns(pd.DataFrame({'sequence': np.arange(start, start + 10)})))
+        store = MessageStore(self.path)
+        self.assertEqual(store.batch_starts.tolist(), [0, 10, 20, 30])
+        self.assertFalse(store.column('sequence', 12, 18).flags.owndata)
+        self.assertEqual(store.column('sequence', 5, 25).tolist(), list(range(5, 25)))
+        batches = list(store.batches(5, 25, ['sequence']))
+        self.assertEqual([batch['sequence'].tolist() for batch in batches],
+                         [list(range(5, 10)), list(range(10, 20)), list(range(20, 25))])
+        self.assertTrue(all(not batch['sequence'].flags.owndata for batch in batches))
+        self.assertEqual([order.sequence for order in store.rows(8, 22, chunk_size=4)], list(range(8, 22)))
+        store.close()
@@ -0,0 +1,135 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+import ujson
+
+from orderbookmdp._orderbookmdp import CyExternalMarket
+from orderbookmdp.data_all.orderstream import Prefetcher
+from orderbookmdp.data_all.orderstream import fast_forward
+from orderbookmdp.data_all.orderstream import load_files
+from orderbookmdp.data_all.orderstream import orderstream
+from orderbookmdp.data_all.orderstream import orderstream_batches
+from orderbookmdp.data_all.reformat_data import MESSAGE_KEYS
+from orderbookmdp.data_all.reformat_data import reformat_messages
+from orderbookmdp.order_book.market import ExternalMarket
+
+
+def slow_load(path):
+    time.sleep(0.01)
+    return path * 2
+
+
+def failing_load(path):
+    if path == 2:
+        raise ValueError(path)
+    return path
+
+
+def episode(stream):
+    """ Returns the sequences of the first episode of a stream, the snapshots as ('snap', sequence). """
+    sequences = []
+    for batch, snap in stream:
+        if snap is not None:
+            if sequences:
+                return sequences
+            sequences.append(('snap', snap['sequence']))
+        elif isinstance(batch, dict):
+            sequences.extend(batch['sequence'].tolist())
+        else:
+            sequences.append(batch.sequence)
+
+
+def write_data(data_dir):
+    """ Reformats the test messages in two order files with a snapshot before them. """
+    with open('tests/testdata/messages.json', 'rb') as messages_json_file:
+        messages = ujson.load(messages_json_file)
+    with open('tests/testdata/beginning_level_3.json', 'rb') as begin_json_file:
+        snap = ujson.load(begin_json_file)
+    for directory in ('json', 'store', 'snap_json'):
+        os.makedirs(os.path.join(data_dir, directory))
+    for k, part in enumerate((messages[:2000], messages[2000:])):
+        with open(os.path.join(data_dir, 'json', '{}_mess.json'.format(k)), 'w') as f:
+            f.write(''.join(ujson.dumps(message) + '\n' for message in part))
+        reformat_messages(data_dir, k, MESSAGE_KEYS, 2, '{}_mess.json'.format(k), store=True, row_group_size=500)
+    with open(os.path.join(data_dir, 'snap_json', 'snap_1000.json'), 'w') as f:
+        ujson.dump(snap, f)
+    return messages, data_dir + '/store/', data_dir + '/snap_json/'
+
+
+class TestOrderstream(TestCase):
+
+    def test_prefetcher(self):
+        prefetcher = Prefetcher(range(5), slow_load, buffer_size=2)
+        self.assertEqual(list(prefetcher), [(k, k * 2) for k in range(5)])
+        self.assertEqual(prefetcher.files, 5)
+        self.assertGreater(prefetcher.stall_time, 0)
+
+    def test_prefetcher_error(self):
+        prefetcher = Prefetcher(range(5), failing_load)
+        with self.assertRaises(ValueError):
+            list(prefetcher)
+        prefetcher.close()
+
+    def test_load_files(self):
+        for prefetch in (0, 1, 3):
+            stats = {}
+            files = list(load_files(range(4), slow_load, prefetch, stats))
+            self.assertEqual(files, [(k, k * 2) for k in range(4)])
+            self.assertEqual(stats['files'], 4)
+            self.assertGreaterEqual(stats['stall_time'], 0)
+
+    def test_ranges(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            messages, order_paths, snapshot_paths = write_data(data_dir)
+
+            full = episode(orderstream_batches(order_paths, snapshot_paths))
+            self.assertEqual(full[0], ('snap', 1000))
+
+            ranged = episode(orderstream_batches(order_paths, snapshot_paths, sequence_range=(2000, 3500)))
+            self.assertEqual(ranged, [sequence for sequence in full if not isinstance(sequence, int) or sequence < 3500])
+            self.assertEqual(episode(orderstream(order_paths, snapshot_paths, sequence_range=(2000, 3500))), ranged)
+
+            stop_time = messages[[message['sequence'] for message in messages].index(2500)]['time']
+            ranged = episode(orderstream_batches(order_paths, snapshot_paths, time_range=(None, stop_time)))
+            self.assertEqual(ranged, [sequence for sequence in full if not isinstance(sequence, int) or sequence < 2500])
+
+            for batch, snap in orderstream_batches(order_paths, snapshot_paths, columns=['price']):
+                if batch is not None:
+                    self.assertEqual(sorted(batch), ['price', 'sequence', 'type'])
+                    break
+            order = next(order for order, snap in orderstream(order_paths, snapshot_paths, columns=['side'])
+                         if order is not None)
+            self.assertIsNotNone(order.side)
+            self.assertIsNone(order.price)
+
+    def test_fast_forward(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            messages, order_paths, snapshot_paths = write_data(data_dir)
+            stop_time = messages[[message['sequence'] for message in messages].index(2500)]['time']
+            full = episode(orderstream_batches(order_paths, snapshot_paths))
+
+            for market_type in (CyExternalMarket, ExternalMarket):
+                replayed = market_type()
+                stream = orderstream_batches(order_paths, snapshot_paths, sequence_range=(None, 3000))
+                replayed.fill_snap(next(stream)[1])
+                for batch, snap in stream:
+                    if snap is not None:  # The next episode
+                        break
+                    replayed.send_messages(batch)
+
+                for until in ({'until_sequence': 2500}, {'until_time': stop_time}):
+                    market, stats = market_type(), {}
+                    stream = orderstream_batches(order_paths, snapshot_paths, sequence_range=(None, 3000))
+                    batch, snap = fast_forward(market, stream, stats=stats, **until)
+                    self.assertIsNone(snap)
+                    self.assertLessEqual(batch['sequence'][0], 2500)
+                    self.assertEqual(stats['messages'], sum(sequence < batch['sequence'][0] for sequence in full[1:]))
+
+                    market.send_messages(batch)
+                    for batch, snap in stream:
+                        if snap is not None:
+                            break
+                        market.send_messages(batch)
+                    self.assertEqual(market.ob.price_levels.get_snap(), replayed.ob.price_levels.get_snap())
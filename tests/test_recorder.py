@@ -0,0 +1,59 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import ujson
+
+from orderbookmdp.data_all.recorder import Recorder
+from orderbookmdp.data_all.recorder import open_raw
+from orderbookmdp.data_all.recorder import raw_compression
+from orderbookmdp.data_all.recorder import raw_file_time
+
+
+def messages(n):
+    return [{'type': 'received', 'sequence': 100 + k, 'size': '0.01', 'price': '6500.01',
+             'time': '2018-08-01T10:00:{:02d}.000001Z'.format(k // 10)} for k in range(n)]
+
+
+class TestRecorder(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.dir.name + '/'
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self, recorder):
+        read = []
+        for name in sorted(recorder.files, key=raw_file_time):
+            with open_raw(self.data_dir + name) as f:
+                read.extend(ujson.loads(line) for line in f)
+        return read
+
+    def test_record(self):
+        sent = messages(250)
+        recorder = Recorder(self.data_dir, 'zstd', queue_size=8, block_size=512, rotate_messages=100)
+        for msg in sent:
+            recorder.write(msg)
+        recorder.close()
+
+        self.assertEqual(recorder.messages, 250)
+        self.assertEqual(recorder.files, ['01_08_2018_10_00_00_mess.json.zst', '01_08_2018_10_00_10_mess.json.zst',
+                                          '01_08_2018_10_00_20_mess.json.zst'])
+        self.assertEqual(sorted(os.listdir(self.data_dir)), sorted(recorder.files))
+        self.assertEqual(self.read(recorder), sent)
+
+    def test_uncompressed(self):
+        sent = messages(10)
+        recorder = Recorder(self.data_dir, None)
+        for msg in sent:
+            recorder.write(msg)
+        recorder.close()
+        self.assertEqual(recorder.files, ['01_08_2018_10_00_00_mess.json'])
+        self.assertEqual(self.read(recorder), sent)
+
+    def test_compression(self):
+        self.assertIsNone(raw_compression(None))
+        self.assertEqual(raw_compression('zstd'), 'zstd')
+        self.assertIn(raw_compression('unknown'), ('zstd', 'lz4', 'gzip'))
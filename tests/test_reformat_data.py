@@ -0,0 +1,94 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+import ujson
+
+from orderbookmdp.data_all.message_store import EXTENSION
+from orderbookmdp.data_all.message_store import MessageStore
+from orderbookmdp.data_all.message_store import read_messages
+from orderbookmdp.data_all.orderstream import join_order_ids
+from orderbookmdp.data_all.reformat_data import MESSAGE_KEYS
+from orderbookmdp.data_all.reformat_data import encode_message_codes
+from orderbookmdp.data_all.reformat_data import messages_to_columns
+from orderbookmdp.data_all.reformat_data import reformat_messages
+from orderbookmdp.data_all.reformat_data import split_order_ids
+from orderbookmdp.data_all.reformat_data import to_lots
+from orderbookmdp.order_book.constants import BUY
+from orderbookmdp.order_book.constants import M_CHANGE
+from orderbookmdp.order_book.constants import M_DONE
+from orderbookmdp.order_book.constants import M_RECEIVED
+from orderbookmdp.order_book.constants import OT_LIMIT
+from orderbookmdp.order_book.constants import R_CANCELED
+from orderbookmdp.order_book.constants import SELL
+from orderbookmdp.order_book.constants import UNKNOWN
+from orderbookmdp.order_book.utils import uuid_to_int
+
+order_ids = ['6d9cab8e-9c30-45d4-b4a5-d1c7b4e0c3f5', 'ffffffff-ffff-4fff-bfff-ffffffffffff', None]
+
+
+class TestReformatData(TestCase):
+
+    def test_order_ids(self):
+        order_id_hi, order_id_lo = split_order_ids(pd.Series(order_ids))
+        self.assertEqual(order_id_hi.dtype, 'uint64')
+        self.assertEqual(order_id_lo.dtype, 'uint64')
+
+        joined = join_order_ids(order_id_hi, order_id_lo)
+        self.assertEqual(joined[0], uuid_to_int(order_ids[0]))
+        self.assertEqual(joined[1], uuid_to_int(order_ids[1]))
+        self.assertEqual(joined[2], 0)
+
+    def test_message_codes(self):
+        df = pd.DataFrame({'type': ['received', 'done', 'change'],
+                           'order_type': ['limit', None, None],
+                           'reason': [None, 'canceled', None],
+                           'side': ['buy', 'sell', None]})
+        encode_message_codes(df)
+        self.assertEqual(df['type'].tolist(), [M_RECEIVED, M_DONE, M_CHANGE])
+        self.assertEqual(df['order_type'].tolist(), [OT_LIMIT, UNKNOWN, UNKNOWN])
+        self.assertEqual(df['reason'].tolist(), [UNKNOWN, R_CANCELED, UNKNOWN])
+        self.assertEqual(df['side'].tolist(), [BUY, SELL, UNKNOWN])
+        self.assertTrue(all(dtype == 'int8' for dtype in df.dtypes))
+
+    def test_lots(self):
+        lots = to_lots(pd.Series(['0.00000001', '0.29999999', None, '12.5']), 8)
+        self.assertEqual(lots.dtype, 'int64')
+        self.assertEqual(lots.tolist(), [1, 29999999, -1, 1250000000])
+
+    def test_reformat_messages_row_groups(self):
+        messages = [{'type': 'received', 'order_type': 'limit', 'side': 'buy', 'price': '6500.01', 'size': '1.5',
+                     'order_id': order_ids[0], 'sequence': 10, 'time': '2018-08-01T10:00:00.000001Z'},
+                    {'type': 'open', 'side': 'buy', 'price': '6500.01', 'remaining_size': '1.5',
+                     'order_id': order_ids[0], 'sequence': 11, 'time': '2018-08-01T10:00:00.000002Z'},
+                    {'type': 'change', 'side': 'buy', 'price': '6500.01', 'new_size': '1.0', 'old_size': '1.5',
+                     'order_id': order_ids[0], 'sequence': 12, 'time': '2018-08-01T10:00:00.000003Z'},
+                    {'type': 'done', 'reason': 'canceled', 'side': 'buy', 'price': '6500.01', 'remaining_size': '1.0',
+                     'order_id': order_ids[0], 'sequence': 13, 'time': '2018-08-01T10:00:00.000004Z'},
+                    {'type': 'received', 'order_type': 'market', 'side': 'sell', 'funds': '100.0',
+                     'order_id': order_ids[1], 'sequence': 14, 'time': '2018-08-01T10:00:00.000005Z'}]
+        with tempfile.TemporaryDirectory() as data_dir:
+            os.makedirs(data_dir + '/json/')
+            os.makedirs(data_dir + '/store/')
+            with open(data_dir + '/json/mess.json', 'w') as f:
+                f.writelines(ujson.dumps(m) + '\n' for m in messages)
+            reformat_messages(data_dir, 0, MESSAGE_KEYS, 2, 'mess.json', 8, store=True, row_group_size=2)
+
+            self.assertEqual(os.listdir(data_dir + '/store/'), ['0_10_14' + EXTENSION])
+            store = MessageStore(data_dir + '/store/0_10_14' + EXTENSION)
+            self.assertEqual(store.table.column('sequence').num_chunks, 3)
+            expected = messages_to_columns([{k: v for k, v in m.items() if k in MESSAGE_KEYS} for m in messages])
+            for name, column in expected.items():
+                np.testing.assert_array_equal(store.column(name), column)
+            self.assertEqual(store.column('size').tolist(), [150000000, -1, 100000000, -1, -1])
+            store.close()
+
+            os.makedirs(data_dir + '/feather/')
+            for compression, level in (('zstd', 19), ('lz4', None), (None, None)):
+                output, = reformat_messages(data_dir, 1, MESSAGE_KEYS, 2, 'mess.json', 8, row_group_size=2,
+                                            compression=compression, compression_level=level)
+                columns = read_messages(data_dir + '/' + output)
+                for name, column in expected.items():
+                    np.testing.assert_array_equal(columns[name], column)
@@ -0,0 +1,88 @@
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+from fixtures import load
+from fixtures import write_reformatted
+
+from orderbookmdp._orderbookmdp import CyExternalMarket
+from orderbookmdp.data_all.orderstream import orderstream
+from orderbookmdp.data_all.orderstream import orderstream_batches
+from orderbookmdp.data_all.replay import LATENCY_BINS
+from orderbookmdp.data_all.replay import get_engine
+from orderbookmdp.data_all.replay import latency_percentile
+from orderbookmdp.data_all.replay import market_batches
+from orderbookmdp.data_all.replay import replay
+from orderbookmdp.data_all.replay import summarize
+from orderbookmdp.order_book.market import ExternalMarket
+
+
+class TestReplay(TestCase):
+
+    def setUp(self):
+        snap, self.end, self.messages = load()
+        self.dir = tempfile.TemporaryDirectory()
+        self.order_paths, self.snapshot_paths = write_reformatted(self.dir.name, snap, self.messages, store=True)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_replay(self):
+        order_paths, snapshot_paths = self.order_paths, self.snapshot_paths
+        sent = sum(message['type'] in ('received', 'done', 'change') for message in self.messages)
+        for engine, price_levels_type in (('cy', None), ('py', 'fast_avl')):
+            metrics = replay(order_paths, snapshot_paths, engine, price_levels_type)
+            self.assertEqual(metrics['messages'], sent)
+            self.assertEqual(sum(int(histogram.sum()) for histogram in metrics['latencies'].values()), sent)
+            self.assertEqual(metrics['orders'], len(self.end['bids']) + len(self.end['asks']))
+            self.assertGreater(metrics['peak_rss'], 0)
+
+            summary = summarize([metrics, metrics])
+            self.assertEqual(summary['messages'], 2 * sent)
+            self.assertEqual(summary['latency']['done']['count'], 2 * metrics['latencies']['done'].sum())
+            self.assertLessEqual(summary['latency']['done']['p50'], summary['latency']['done']['p99'])
+
+        metrics = replay(order_paths, snapshot_paths, sequence_range=(None, 3000))
+        self.assertEqual(metrics['messages'], sum(message['type'] in ('received', 'done', 'change') and
+                                                  message['sequence'] < 3000 for message in self.messages))
+
+    def test_get_engine(self):
+        self.assertIsInstance(get_engine('cy'), CyExternalMarket)
+        self.assertIsInstance(get_engine('py', 'fast_avl'), ExternalMarket)
+        with self.assertRaises(ValueError):
+            get_engine('cy', 'fast_avl')
+        with self.assertRaises(ValueError):
+            get_engine('cy', price_level_type='deque')
+        with self.assertRaises(ValueError):
+            get_engine('rust')
+
+    def test_replay_projection(self):
+        order_paths, snapshot_paths = self.order_paths, self.snapshot_paths
+        columns = ['type', 'side', 'price', 'size', 'order_id', 'time', 'sequence']
+        for engine in ('cy', 'py'):
+            market = get_engine(engine)
+            for batch in market_batches(market, order_paths, snapshot_paths, columns=columns):
+                market.send_messages(batch)
+            self.assertEqual(len(market.ob.orders), len(self.end['bids']) + len(self.end['asks']))
+
+            market = get_engine(engine)
+            stream = orderstream_batches(order_paths, snapshot_paths, columns=columns)
+            market.fill_snap(next(stream)[1])
+            batch, _ = next(stream)
+            self.assertNotIn('order_type', batch)
+            with self.assertRaisesRegex(ValueError, 'order_type, reason, funds, trader_id'):
+                market.send_messages(batch)
+            with self.assertRaises(ValueError):
+                market.fast_forward(batch)
+
+            market = get_engine(engine)
+            stream = orderstream(order_paths, snapshot_paths, columns=columns)
+            market.fill_snap(next(stream)[1])
+            with self.assertRaises(ValueError):
+                for order, _ in stream:
+                    market.send_message(order, external=True, lots=True)
+
+    def test_latency_percentile(self):
+        histogram = np.histogram(np.full(100, 1000), LATENCY_BINS)[0]
+        self.assertAlmostEqual(latency_percentile(histogram, 50), 1000, delta=25)
+        self.assertAlmostEqual(latency_percentile(histogram, 99), 1000, delta=25)
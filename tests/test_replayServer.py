@@ -0,0 +1,135 @@
+import asyncio
+import os
+import tempfile
+import time
+import urllib.request
+from decimal import Decimal
+from unittest import TestCase
+
+import ujson
+from fixtures import load
+
+from orderbookmdp.data_all.replay_server import L2Book
+from orderbookmdp.data_all.replay_server import ReplayServer
+from orderbookmdp.data_all.replay_server import consume
+from orderbookmdp.data_all.shards import shard_dir
+
+
+def write_raw(path, lines):
+    with open(path, 'w') as f:
+        f.write(''.join(line + '\n' for line in lines))
+
+
+def level2(snap):
+    levels = {'buy': {}, 'sell': {}}
+    for side, key in (('buy', 'bids'), ('sell', 'asks')):
+        for price, size, _ in snap[key]:
+            levels[side][Decimal(price)] = levels[side].get(Decimal(price), 0) + Decimal(size)
+    return levels
+
+
+class TestReplayServer(TestCase):
+
+    def setUp(self):
+        self.begin, self.end, self.messages = load()
+
+        self.dir = tempfile.TemporaryDirectory()
+        os.makedirs(self.dir.name + '/json')
+        json_dir = self.dir.name + '/json/'
+        write_raw(json_dir + '01_08_2018_10_00_00_snaps.json', [ujson.dumps(self.begin)])
+        write_raw(json_dir + '01_08_2018_10_00_00_mess.json', [ujson.dumps(msg) for msg in self.messages[:2000]])
+        write_raw(json_dir + '01_08_2018_10_05_00_mess.json', [ujson.dumps(msg) for msg in self.messages[2000:]])
+        self.server = ReplayServer(self.dir.name).start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.dir.cleanup()
+
+    def test_full(self):
+        received = []
+        n_messages = asyncio.run(consume(self.server.url, on_message=received.append))
+        self.assertEqual(n_messages, len(self.messages))
+        self.assertEqual(received, self.messages)
+
+    def test_level2(self):
+        received = []
+        asyncio.run(consume(self.server.url, channels=['level2'], on_message=received.append))
+        self.assertEqual(received[0]['type'], 'snapshot')
+        self.assertTrue(all(msg['type'] == 'l2update' for msg in received[1:]))
+
+        levels = {'buy': {}, 'sell': {}}
+        for price, size in received[0]['bids']:
+            levels['buy'][Decimal(price)] = Decimal(size)
+        for price, size in received[0]['asks']:
+            levels['sell'][Decimal(price)] = Decimal(size)
+        self.assertEqual(levels, level2(self.begin))
+
+        for msg in received[1:]:
+            for side, price, size in msg['changes']:
+                if Decimal(size) == 0:
+                    del levels[side][Decimal(price)]
+                else:
+                    levels[side][Decimal(price)] = Decimal(size)
+        self.assertEqual(levels, level2(self.end))
+
+    def test_max_messages(self):
+        self.assertEqual(asyncio.run(consume(self.server.url, max_messages=10)), 10)
+
+    def test_speed(self):
+        json_dir = self.dir.name + '/json/'
+        for name in os.listdir(json_dir):
+            os.remove(json_dir + name)
+        write_raw(json_dir + '01_08_2018_10_00_00_mess.json',
+                  [ujson.dumps({'type': 'received', 'sequence': k, 'time': '2018-08-01T10:00:0{}.000000Z'.format(k)})
+                   for k in range(3)])
+        server = ReplayServer(self.dir.name, speed=10).start()
+        start = time.perf_counter()
+        self.assertEqual(asyncio.run(consume(server.url)), 3)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+        server.stop()
+
+    def test_shards(self):
+        for day, messages in (('2018-08-01', self.messages[:2000]), ('2018-08-02', self.messages[2000:])):
+            json_dir = shard_dir(os.path.join(self.dir.name, 'sharded'), 'BTC-USD', day) + 'json/'
+            os.makedirs(json_dir)
+            write_raw(json_dir + '{}_08_2018_00_00_00_mess.json'.format(day[8:]), [ujson.dumps(msg) for msg in messages])
+        data_dir = os.path.join(self.dir.name, 'sharded')
+        write_raw(shard_dir(data_dir, 'BTC-USD', '2018-08-01') + 'json/01_08_2018_00_00_00_snaps.json', [ujson.dumps(self.begin)])
+
+        for days, messages in ((None, self.messages), (['2018-08-02'], self.messages[2000:])):
+            server = ReplayServer(data_dir, product='BTC-USD', days=days).start()
+            received = []
+            asyncio.run(consume(server.url, on_message=received.append))
+            self.assertEqual(received, messages)
+            server.stop()
+
+        with self.assertRaises(ValueError):
+            ReplayServer(data_dir, product='ETH-USD')
+        with self.assertRaises(ValueError):
+            ReplayServer(data_dir, product='BTC-USD', days=['2018-08-03'])
+        os.makedirs(os.path.join(data_dir, 'BTC-USD', '2018-08-04', 'json'))
+        with self.assertRaises(ValueError):
+            ReplayServer(data_dir, product='BTC-USD')
+
+    def test_rest(self):
+        with urllib.request.urlopen(self.server.api_url + '/products/BTC-USD/book?level=3') as response:
+            self.assertEqual(ujson.loads(response.read()), self.begin)
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(self.server.api_url + '/products/ETH-USD/book?level=3')
+
+
+class TestL2Book(TestCase):
+
+    def test_update(self):
+        book = L2Book({'bids': [['100.00', '1.0', 'a'], ['100.00', '0.5', 'b']], 'asks': [['101.00', '2.0', 'c']]})
+        self.assertEqual(book.snapshot_message('BTC-USD')['bids'], [['100.00', '1.50000000']])
+
+        self.assertEqual(book.update({'type': 'received', 'order_id': 'd'}), [])
+        self.assertEqual(book.update({'type': 'open', 'order_id': 'd', 'side': 'buy', 'price': '99.00',
+                                      'remaining_size': '0.1'}), [['buy', '99.00', '0.10000000']])
+        self.assertEqual(book.update({'type': 'match', 'maker_order_id': 'c', 'size': '0.5'}),
+                         [['sell', '101.00', '1.50000000']])
+        self.assertEqual(book.update({'type': 'change', 'order_id': 'a', 'new_size': '0.25'}),
+                         [['buy', '100.00', '0.75000000']])
+        self.assertEqual(book.update({'type': 'done', 'order_id': 'b'}), [['buy', '100.00', '0.25000000']])
+        self.assertEqual(book.update({'type': 'done', 'order_id': 'e'}), [])
@@ -0,0 +1,75 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from orderbookmdp.data_all.message_store import EXTENSION
+from orderbookmdp.data_all.message_store import to_columns
+from orderbookmdp.data_all.message_store import write_messages
+from orderbookmdp.data_all.sequence_index import build_index
+from orderbookmdp.data_all.sequence_index import load_index
+from orderbookmdp.data_all.sequence_index import resume_snaps
+from orderbookmdp.data_all.sequence_index import sequence_gaps
+
+
+class TestSequenceIndex(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.order_paths = os.path.join(self.dir.name, 'store') + '/'
+        self.snapshot_paths = os.path.join(self.dir.name, 'snap_json') + '/'
+        os.makedirs(self.order_paths)
+        os.makedirs(self.snapshot_paths)
+        for k, (start, end) in enumerate([(101, 200), (201, 300)]):
+            df = pd.DataFrame({'sequence': np.arange(start, end + 1)})
+            write_messages(to_columns(df), self.order_paths + '{}_{}_{}{}'.format(k, start, end, EXTENSION))
+        for seq in (100, 150, 250, 300, 400):
+            open(self.snapshot_paths + 'snap_{}.json'.format(seq), 'w').close()
+        build_index(self.order_paths, self.snapshot_paths)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_snapshots(self):
+        index = load_index(self.order_paths)
+        self.assertEqual(index.files, ['0_101_200' + EXTENSION, '1_201_300' + EXTENSION])
+        self.assertEqual(index.locate_snap(100), (0, 0))
+        self.assertEqual(index.locate_snap(150), (0, 50))
+        self.assertEqual(index.locate_snap(250), (1, 50))
+        self.assertEqual(index.locate_snap(300), (-1, 0))
+        self.assertEqual(index.locate_snap(400), (-1, 0))
+        for _ in range(10):
+            self.assertIn(index.random_snap(), (100, 150, 250))
+        self.assertEqual(index.random_snap([150, 300]), 150)
+        self.assertIsNone(load_index(self.snapshot_paths))
+
+    def test_gaps(self):
+        rows, sizes = sequence_gaps(np.array([5, 6, 8, 9, 12]), prev_sequence=2)
+        self.assertEqual(rows.tolist(), [0, 2, 4])
+        self.assertEqual(sizes.tolist(), [3, 2, 3])
+        self.assertEqual(sequence_gaps(np.array([5, 6, 8]))[0].tolist(), [2])
+        self.assertEqual(resume_snaps(np.array([8, 150, 2000]), np.array([1000, 100, 150])).tolist(), [1, 2, -1])
+
+        index = load_index(self.order_paths)
+        self.assertEqual(index.gap_files.tolist(), [])
+
+        order_paths = os.path.join(self.dir.name, 'gaps') + '/'
+        os.makedirs(order_paths)
+        sequences = [np.r_[101:121, 130:201], np.arange(211, 301)]
+        for k, sequence in enumerate(sequences):
+            df = pd.DataFrame({'sequence': sequence})
+            write_messages(to_columns(df), order_paths + '{}_{}_{}{}'.format(k, sequence[0], sequence[-1], EXTENSION))
+        open(self.snapshot_paths + 'snap_1000.json', 'w').close()
+        build_index(order_paths, self.snapshot_paths)
+
+        index = load_index(order_paths)
+        self.assertEqual(index.gap_sequences.tolist(), [130, 211])
+        self.assertEqual(index.gap_sizes.tolist(), [10, 11])
+        rows, sizes, snaps = index.gaps(0)
+        self.assertEqual(rows.tolist(), [20])
+        self.assertEqual(index.snap_files[snaps[0]], 'snap_150.json')
+        rows, sizes, snaps = index.gaps(1)
+        self.assertEqual(rows.tolist(), [0])
+        self.assertEqual(index.snap_files[snaps[0]], 'snap_250.json')
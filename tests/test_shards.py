@@ -0,0 +1,60 @@
+import os
+import random
+import tempfile
+from unittest import TestCase
+
+from fixtures import load
+from fixtures import write_raw
+
+from orderbookmdp.data_all.orderstream import orderstream_batches
+from orderbookmdp.data_all.shards import ShardManifest
+from orderbookmdp.data_all.shards import is_sharded
+from orderbookmdp.data_all.shards import list_shards
+from orderbookmdp.data_all.shards import reformat_shards
+from orderbookmdp.data_all.shards import shard_dir
+from orderbookmdp.data_all.shards import shard_raw_files
+
+
+class TestShards(TestCase):
+
+    def setUp(self):
+        self.snap, _, self.messages = load()
+        self.dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.dir.name
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_reformat_shards(self):
+        for product in ('BTC-USD', 'ETH-USD'):
+            write_raw(shard_dir(self.data_dir, product, '2018-08-01') + 'json/', self.snap, self.messages)
+        self.assertTrue(is_sharded(self.data_dir))
+        self.assertEqual(list_shards(self.data_dir), [('BTC-USD', '2018-08-01'), ('ETH-USD', '2018-08-01')])
+
+        reformat_shards(self.data_dir, cores=2, store=True, products=['BTC-USD', 'ETH-USD'])
+        shards = ShardManifest(self.data_dir)
+        self.assertEqual(shards.products, ['BTC-USD', 'ETH-USD'])
+        entry = shards.shards('BTC-USD')[0]
+        self.assertEqual(entry['rows'], len(self.messages))
+        self.assertEqual(entry['first_sequence'], self.messages[0]['sequence'])
+        self.assertEqual(entry['last_sequence'], self.messages[-1]['sequence'])
+        self.assertEqual(entry['snaps'], [[self.snap['sequence'], 0, 0]])
+        self.assertLessEqual(entry['first_time'], entry['last_time'])
+
+        self.assertEqual(len(shards.shards()), 2)
+        self.assertEqual(len(shards.shards(time_range=(entry['first_time'], None))), 2)
+        self.assertEqual(shards.shards(time_range=(None, '2018-08-01T00:00:00Z')), [])
+        self.assertEqual(shards.sample('ETH-USD', rng=random.Random(0))['product'], 'ETH-USD')
+
+        batch, snap = next(orderstream_batches(*shards.paths(entry)))
+        self.assertEqual(snap['sequence'], self.snap['sequence'])
+
+    def test_shard_raw_files(self):
+        write_raw(self.data_dir + '/json/', self.snap, self.messages)
+        self.assertFalse(is_sharded(self.data_dir))
+        with self.assertRaises(ValueError):
+            shard_raw_files(self.data_dir, 'BTC-USD,ETH-USD')
+        self.assertEqual(shard_raw_files(self.data_dir, 'BTC-USD'), [('BTC-USD', '2018-08-01')])
+        self.assertEqual(sorted(os.listdir(shard_dir(self.data_dir, 'BTC-USD', '2018-08-01') + 'json/')),
+                         ['01_08_2018_10_00_00_mess.json', '01_08_2018_10_00_00_snaps.json'])
+        self.assertTrue(is_sharded(self.data_dir))
@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from orderbookmdp._orderbookmdp import CyExternalMarket
+from orderbookmdp.data_all.snapshots import SNAP_EXTENSION
+from orderbookmdp.data_all.snapshots import binary_snap_name
+from orderbookmdp.data_all.snapshots import find_binary_snap
+from orderbookmdp.data_all.snapshots import load_binary_snap
+from orderbookmdp.data_all.snapshots import load_json_snap
+from orderbookmdp.data_all.snapshots import save_binary_snap
+from orderbookmdp.data_all.snapshots import save_json_snap
+from orderbookmdp.data_all.snapshots import snap_to_arrays
+from orderbookmdp.order_book.market import ExternalMarket
+from orderbookmdp.order_book.utils import uuid_to_int
+
+
+def load():
+    with open('tests/testdata/beginning_level_3.json', 'rb') as begin_json_file:
+        return json.load(begin_json_file)
+
+
+class TestSnapshots(TestCase):
+
+    def setUp(self):
+        self.snap = load()
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'snap_{}{}'.format(self.snap['sequence'], SNAP_EXTENSION))
+        save_binary_snap(snap_to_arrays(self.snap), self.path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_save_load(self):
+        binary_snap = load_binary_snap(self.path)
+        self.assertEqual(binary_snap['sequence'], self.snap['sequence'])
+        for side in ('bids', 'asks'):
+            self.assertEqual(len(binary_snap[side]['price']), len(self.snap[side]))
+            self.assertEqual(binary_snap[side]['price'].dtype, np.int64)
+            order = self.snap[side][0]
+            self.assertEqual(binary_snap[side]['price'][0], round(float(order[0]) * 100))
+            self.assertEqual(binary_snap[side]['size'][0], round(float(order[1]) * 10**8))
+            order_id = (int(binary_snap[side]['order_id_hi'][0]) << 64) | int(binary_snap[side]['order_id_lo'][0])
+            self.assertEqual(order_id, uuid_to_int(order[2]))
+
+    def test_compression(self):
+        binary_snap = load_binary_snap(self.path)
+        for compression, level in (('zstd', 9), ('lz4', None), ('gzip', 1)):
+            path = os.path.join(self.dir.name, binary_snap_name(self.snap['sequence'], compression))
+            save_binary_snap(binary_snap, path, level)
+            compressed = load_binary_snap(path)
+            for side in ('bids', 'asks'):
+                for column in ('price', 'size', 'order_id_hi', 'order_id_lo'):
+                    np.testing.assert_array_equal(compressed[side][column], binary_snap[side][column])
+            os.remove(path)
+
+            path = os.path.join(self.dir.name, 'snap.json' + {'zstd': '.zst', 'lz4': '.lz4', 'gzip': '.gz'}[compression])
+            save_json_snap(self.snap, path, level)
+            self.assertEqual(load_json_snap(path), self.snap)
+
+        os.remove(self.path)
+        self.assertIsNone(find_binary_snap(self.dir.name + '/', self.snap['sequence']))
+        save_binary_snap(binary_snap, os.path.join(self.dir.name, binary_snap_name(self.snap['sequence'], 'zstd')))
+        self.assertTrue(find_binary_snap(self.dir.name + '/', self.snap['sequence']).endswith('.npz.zst'))
+
+    def test_fill_binary_snap(self):
+        m, m_binary = [ExternalMarket(price_level_type='ordered_dict', price_levels_type='sorted_dict') for _ in range(2)]
+        self.fill_snaps(m, m_binary)
+        self.assertEqual(m.external_market_order_ids, m_binary.external_market_order_ids)
+        self.fill_snaps(CyExternalMarket(), CyExternalMarket())
+
+    def fill_snaps(self, m, m_binary):
+        m.fill_snap(self.snap)
+        m_binary.fill_snap(load_binary_snap(self.path))
+        snap, snap_binary = m.ob.price_levels.get_snap(), m_binary.ob.price_levels.get_snap()
+        for side in ('bids', 'asks'):
+            self.assertEqual(list(snap[side]), list(snap_binary[side]))
+            np.testing.assert_allclose(list(snap[side].values()), list(snap_binary[side].values()))
+
+    def test_tick_size(self):
+        m = CyExternalMarket(tick_size=0.1)
+        with self.assertRaises(ValueError):
+            m.fill_snap(load_binary_snap(self.path))